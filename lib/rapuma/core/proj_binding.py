@@ -16,7 +16,7 @@
 # Firstly, import all the standard Python modules we need for
 # this process
 
-import os, shutil, codecs, re, subprocess, tempfile
+import os, shutil, codecs, re, subprocess, tempfile, multiprocessing
 from configobj                      import ConfigObj, Section
 
 # Load the local classes
@@ -24,11 +24,41 @@ from rapuma.core.tools                  import Tools
 from rapuma.core.user_config            import UserConfig
 from rapuma.core.proj_local             import ProjLocal
 from rapuma.core.proj_log               import ProjLog
+from rapuma.core.proj_trace             import ProjTrace
 from rapuma.manager.project             import Project
 from rapuma.project.proj_config         import Config
 from rapuma.project.proj_background     import ProjBackground
 
 
+###############################################################################
+############################### Worker Functions ##############################
+###############################################################################
+
+def renderGroupWorker (pid, gid, startPage, resultQueue) :
+    '''Render one group in its own process and report back to the
+    scheduler with the number of pages that were made, and the config
+    changes that were made along the way. This lives out here so it can
+    be handed to multiprocessing. Anything that goes wrong (including a
+    sys.exit() from the log) is sent back as the error.'''
+
+    # Only send back the stages timed in this process
+    trace = ProjTrace(pid)
+    trace.reset()
+    # Other groups are writing to the same config files
+    tools = Tools()
+    tools.keepConfChanges()
+    try :
+        project = Project(pid, gid)
+        project.startPage = startPage
+        project.viewRender = False
+        project.renderGroup()
+        gidPdfFile = project.local.gidPdfFile
+        totalPages = project.tools.pdfTotalPages(gidPdfFile)
+        resultQueue.put((gid, totalPages, None, trace.getSpans(), tools.getConfChanges()))
+    except BaseException as e :
+        resultQueue.put((gid, None, str(e), trace.getSpans(), tools.getConfChanges()))
+
+
 ###############################################################################
 ################################## Begin Class ################################
 ###############################################################################
@@ -53,6 +83,7 @@ class ProjBinding (object) :
         self.projHome           = os.path.join(os.environ['RAPUMA_PROJECTS'], self.pid)
         self.local              = ProjLocal(self.pid)
         self.log                = ProjLog(self.pid)
+        self.trace              = ProjTrace(self.pid)
         self.pdfViewerCmd       = self.tools.getPdfViewerCommand(self.userConfig, self.projectConfig)
 
         # Log messages for this module
@@ -68,7 +99,16 @@ class ProjBinding (object) :
             '0265' : ['ERR', 'Rendered file not found: <<1>>'],
             '0270' : ['WRN', 'PDF viewing is disabled.'],
             '0280' : ['ERR', 'GS PDF file merge failed with this error: [<<1>>]'],
-            '0300' : ['MSG', 'File binding operation in process, please wait...']
+            '0300' : ['MSG', 'File binding operation in process, please wait...'],
+
+            '0400' : ['MSG', 'Rendering [<<1>>] groups with up to [<<2>>] at a time.'],
+            '0405' : ['MSG', 'No groups have a binding order set. There is nothing to render.'],
+            '0410' : ['LOG', 'Started rendering group [<<1>>] on page [<<2>>].'],
+            '0420' : ['MSG', 'Finished rendering group [<<1>>], it has [<<2>>] pages.'],
+            '0430' : ['MSG', 'Page count for group [<<1>>] changed, re-rendering [<<2>>] from page [<<3>>].'],
+            '0440' : ['ERR', 'Rendering group [<<1>>] failed with this error: [<<2>>]'],
+            '0450' : ['ERR', 'The precedingGroup settings for these groups go around in a circle: [<<1>>]'],
+            '0460' : ['MSG', 'All [<<1>>] groups are rendered and ready to bind.']
 
         }
 
@@ -121,41 +161,43 @@ class ProjBinding (object) :
         for key in keyList :
             fileList.append(bindOrder[key])
 
-        # First merge the master pages together
-        tempFile = self.mergePdfFilesGs(fileList)
-
-        # Now add background and doc info if requested
-        bgFile = ''
-        if self.useBackground :
-            bgFile = self.pg_back.addBackground(tempFile)
-        if self.useDocInfo :
-            if bgFile :
-                bgFile = self.pg_back.addDocInfo(bgFile)
-            else :
-                bgFile = self.pg_back.addDocInfo(tempFile)
-
-        # If we are saving this make a name for it
-        if save :
-            bindFileName = self.pid + '_contents_' + self.tools.ymd()
-            # Save this to the Deliverable folder (Make sure there is one)
-            if not os.path.isdir(self.local.projDeliverableFolder) :
-                os.makedirs(self.local.projDeliverableFolder)
-            bindFile = os.path.join(self.local.projDeliverableFolder, bindFileName + '.pdf')
-            if os.path.exists(bgFile) :
-                if shutil.copy(bgFile, bindFile) :
-                    self.log.writeToLog(self.errorCodes['0220'], [bgFile,bindFile])
-            else :
-                if shutil.copy(tempFile, bindFile) :
-                    self.log.writeToLog(self.errorCodes['0220'], [tempFile,bindFile])
-
-            # Direct to viewFile
-            viewFile = bindFile
+        with self.trace.span('bind') :
+
+            # First merge the master pages together
+            tempFile = self.mergePdfFilesGs(fileList)
+
+            # Now add background and doc info if requested
+            bgFile = ''
+            if self.useBackground :
+                bgFile = self.pg_back.addBackground(tempFile)
+            if self.useDocInfo :
+                if bgFile :
+                    bgFile = self.pg_back.addDocInfo(bgFile)
+                else :
+                    bgFile = self.pg_back.addDocInfo(tempFile)
+
+            # If we are saving this make a name for it
+            if save :
+                bindFileName = self.pid + '_contents_' + self.tools.ymd()
+                # Save this to the Deliverable folder (Make sure there is one)
+                if not os.path.isdir(self.local.projDeliverableFolder) :
+                    os.makedirs(self.local.projDeliverableFolder)
+                bindFile = os.path.join(self.local.projDeliverableFolder, bindFileName + '.pdf')
+                if os.path.exists(bgFile) :
+                    if not self.tools.materializeFile(bgFile, bindFile) :
+                        self.log.writeToLog(self.errorCodes['0220'], [bgFile,bindFile])
+                else :
+                    if not self.tools.materializeFile(tempFile, bindFile) :
+                        self.log.writeToLog(self.errorCodes['0220'], [tempFile,bindFile])
+
+                # Direct to viewFile
+                viewFile = bindFile
                 
-        else :
-            if os.path.exists(bgFile) :
-                viewFile = bgFile
             else :
-                viewFile = tempFile
+                if os.path.exists(bgFile) :
+                    viewFile = bgFile
+                else :
+                    viewFile = tempFile
 
         # Binding should have been successful, report it now
         self.log.writeToLog(self.errorCodes['0230'], [viewFile])
@@ -219,7 +261,8 @@ class ProjBinding (object) :
         # Now bind the files
         try :
             self.log.writeToLog(self.errorCodes['0300'])
-            subprocess.call(cmd)
+            with self.trace.span('gsMerge', {'files' : len(sourceList)}) :
+                subprocess.call(cmd)
             # Return our file name for further processing
             return tempFile
         except Exception as e :
@@ -227,5 +270,194 @@ class ProjBinding (object) :
             self.log.writeToLog(self.errorCodes['0280'], [str(e)])
 
 
+###############################################################################
+############################# Rendering Functions #############################
+###############################################################################
+######################## Error Code Block Series = 400 ########################
+###############################################################################
+
+    def renderAllGroups (self) :
+        '''Render every group that has a binding order so the project is
+        ready to bind. A group can only know its start page when the group
+        set as its precedingGroup is done, so the groups are worked out
+        as a chain. Groups that do not have to wait on each other are run
+        at the same time in their own processes. If we have a page count
+        from the last time a preceding group was rendered, the next group
+        is started right away on that guess. If the guess turns out wrong,
+        that group is rendered again once the right number is known.'''
+
+#        import pdb; pdb.set_trace()
+
+        if not self.projectConfig.has_key('Groups') :
+            self.log.writeToLog(self.errorCodes['0405'])
+            return False
+        groups = self.projectConfig['Groups']
+
+        # Collect the groups to render, pulling in any preceding groups they
+        # need for their page numbers
+        order = {}
+        for gid in groups.keys() :
+            try :
+                if int(groups[gid].get('bindingOrder', 0)) > 0 :
+                    order[gid] = int(groups[gid]['bindingOrder'])
+            except ValueError :
+                pass
+        if not order :
+            self.log.writeToLog(self.errorCodes['0405'])
+            return False
+        preceding = {}
+        todo = order.keys()
+        while todo :
+            gid = todo.pop()
+            pGrp = str(groups[gid].get('precedingGroup', 'None'))
+            if pGrp in ['None', '', gid] or not groups.has_key(pGrp) :
+                preceding[gid] = None
+            else :
+                preceding[gid] = pGrp
+                if not preceding.has_key(pGrp) and pGrp not in todo :
+                    todo.append(pGrp)
+        followers = {}
+        for gid, pGrp in preceding.iteritems() :
+            if pGrp :
+                followers.setdefault(pGrp, []).append(gid)
+
+        # Keep things in binding order, groups only pulled in to get
+        # the page numbering right go last
+        def priority (gid) :
+            return (order.get(gid, len(groups) + 1), gid)
+
+        # Known page counts from the last render of each group
+        guessPages = {}
+        for gid in preceding.keys() :
+            try :
+                guessPages[gid] = int(groups[gid]['totalPages'])
+            except :
+                pass
+
+        def rootStartPage (gid) :
+            try :
+                return int(groups[gid].get('startPageNumber', 1))
+            except ValueError :
+                return 1
+
+        workers = self.getRenderWorkerCount(len(preceding))
+        self.log.writeToLog(self.errorCodes['0400'], [str(len(preceding)), str(workers)])
+        with self.trace.span('renderAllGroups', {'groups' : len(preceding)}) :
+
+            pending     = sorted(preceding.keys(), key=priority)
+            running     = {}
+            startPages  = {}
+            donePages   = {}
+            stale       = set()
+            resultQueue = multiprocessing.Queue()
+            confChanges = []
+
+            def startOf (gid) :
+                '''Return the page this group should start on, if it can be
+                known (or reasonably guessed) right now.'''
+                pGrp = preceding[gid]
+                if not pGrp :
+                    return rootStartPage(gid)
+                if startPages.has_key(pGrp) :
+                    if donePages.has_key(pGrp) :
+                        return startPages[pGrp] + donePages[pGrp]
+                    if running.has_key(pGrp) and guessPages.has_key(pGrp) :
+                        return startPages[pGrp] + guessPages[pGrp]
+
+            def rerender (gid, startPage) :
+                '''Send a group (and everything after it) back to be
+                rendered again.'''
+                if startPage :
+                    self.log.writeToLog(self.errorCodes['0430'], [preceding[gid], gid, str(startPage)])
+                if running.has_key(gid) :
+                    stale.add(gid)
+                elif gid not in pending :
+                    if donePages.has_key(gid) :
+                        del donePages[gid]
+                    pending.append(gid)
+                    pending.sort(key=priority)
+                for fGrp in followers.get(gid, []) :
+                    if donePages.has_key(fGrp) or running.has_key(fGrp) :
+                        rerender(fGrp, None)
+
+            while pending or running :
+                # Start whatever we can
+                for gid in list(pending) :
+                    if len(running) >= workers :
+                        break
+                    startPage = startOf(gid)
+                    if startPage is None :
+                        continue
+                    pending.remove(gid)
+                    startPages[gid] = startPage
+                    # The first in the chain goes with its normal setting
+                    override = startPage if preceding[gid] else None
+                    proc = multiprocessing.Process(target=renderGroupWorker, args=(self.pid, gid, override, resultQueue))
+                    proc.start()
+                    running[gid] = proc
+                    self.log.writeToLog(self.errorCodes['0410'], [gid, str(startPage)])
+
+                # Nothing running and nothing can start means we are stuck
+                if not running :
+                    self.log.writeToLog(self.errorCodes['0450'], [', '.join(pending)])
+
+                # Wait for the next group to finish
+                gid, totalPages, err, spans, changes = resultQueue.get()
+                self.trace.addSpans(spans)
+                confChanges.append(changes)
+                running.pop(gid).join()
+                if err is not None :
+                    for proc in running.values() :
+                        proc.terminate()
+                    self.log.writeToLog(self.errorCodes['0440'], [gid, err])
+                if gid in stale :
+                    stale.discard(gid)
+                    pending.append(gid)
+                    pending.sort(key=priority)
+                    continue
+                donePages[gid] = totalPages
+                self.log.writeToLog(self.errorCodes['0420'], [gid, str(totalPages)])
+
+                # Check the guesses made on this group
+                for fGrp in followers.get(gid, []) :
+                    if startPages.has_key(fGrp) and (donePages.has_key(fGrp) or running.has_key(fGrp)) :
+                        if startPages[fGrp] != startPages[gid] + totalPages :
+                            rerender(fGrp, startPages[gid] + totalPages)
+
+            # Put together the config changes the groups made, in the order they
+            # finished, and write each file out once with the final numbers
+            self.config.getProjectConfig()
+            self.projectConfig = self.config.projectConfig
+            configs = {self.projectConfig.filename : self.projectConfig}
+            for changes in confChanges :
+                for confFile in changes.keys() :
+                    if not configs.has_key(confFile) :
+                        configs[confFile] = ConfigObj(confFile, encoding='utf-8')
+                    self.tools.applyConfChanges(configs[confFile], changes[confFile])
+            for gid in donePages.keys() :
+                self.projectConfig['Groups'][gid]['startPageNumber'] = startPages[gid]
+                self.projectConfig['Groups'][gid]['totalPages'] = donePages[gid]
+            for config in configs.values() :
+                self.tools.writeConfFile(config)
+
+        self.log.writeToLog(self.errorCodes['0460'], [str(len(donePages))])
+        return True
+
+
+    def getRenderWorkerCount (self, jobs) :
+        '''Return how many groups can be rendered at one time. This uses
+        the usfm renderWorkers setting if there is one, otherwise it will
+        be the number of CPUs.'''
+
+        try :
+            workers = int(self.projectConfig['Managers']['usfm_Xetex'].get('renderWorkers', 0))
+        except :
+            workers = 0
+        if workers < 1 :
+            try :
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError :
+                workers = 1
+        return max(1, min(workers, jobs))
 
 
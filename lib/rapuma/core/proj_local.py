@@ -214,6 +214,8 @@ class ProjLocal (object) :
             self.projLogFile            = os.path.join(self.projHome, self.projLogFileName)
             self.projErrorLogFileName   = 'error.log'
             self.projErrorLogFile       = os.path.join(self.projHome, self.projErrorLogFileName)
+            self.projTimingFileName     = 'timing.json'
+            self.projTimingFile         = os.path.join(self.projHome, self.projTimingFileName)
         # Other info vals to set
         self.lockExt                    = '.lck'
 
@@ -16,13 +16,18 @@
 # Firstly, import all the standard Python modules we need for
 # this process
 
-import codecs, os, fileinput, sys
+import codecs, os, sys, shutil, fcntl
 
 # Load the local classes
 from rapuma.core.tools          import Tools
 from rapuma.core.proj_local     import ProjLocal
 from rapuma.core.user_config    import UserConfig
 
+# Log events made in this process. These are only held in worker processes
+# (see holdEvents()) so they can be sent back to the parent and written to
+# the log by it, in order, instead of each worker writing its own.
+heldEvents = {'hold' : False, 'events' : []}
+
 
 class ProjLog (object) :
 
@@ -98,26 +103,15 @@ class ProjLog (object) :
             # Build the event line
             eventLine = '\"' + self.tools.tStamp() + '\", \"' + code + '\", \"' + msg + '\"'
 
+            # A worker hands its events to the parent to write
+            if heldEvents['hold'] :
+                heldEvents['events'].append((code, eventLine))
+                eventLine = None
+
             # Do we need a log file made?
             try :
-                if not os.path.isfile(self.local.projLogFile) or os.path.getsize(self.local.projLogFile) == 0 :
-                    writeObject = codecs.open(self.local.projLogFile, "w", encoding='utf_8')
-                    writeObject.write('Rapuma event log file created: ' + self.tools.tStamp() + '\n')
-                    writeObject.close()
-
-                # Now log the event to the top of the log file using preAppend().
-                self.preAppend(eventLine, self.local.projLogFile)
-
-                # FIXME: Add the TOD list output here, also, output any TODs 
-                # to the error log as well as these are bad errors.
-
-                # Write errors and warnings to the error log file
-                if code == 'WRN' and self.userConfig['System']['debugging'] == 'True':
-                    self.writeToErrorLog(self.local.projErrorLogFile, eventLine)
-
-                if code == 'ERR' :
-                    self.writeToErrorLog(self.local.projErrorLogFile, eventLine)
-
+                if eventLine :
+                    self.writeEventLine(code, eventLine)
             except Exception as e :
                 # If we don't succeed, we should probably quite here
                 self.tools.terminal("Failed to write message to log file: " + msg)
@@ -131,6 +125,67 @@ class ProjLog (object) :
             return
 
 
+    def writeEventLine (self, code, eventLine) :
+        '''Write an event line to the top of the log file, and to the error
+        log if it is an error (or a warning when debugging).'''
+
+        # More than one process can be logging at the same time (like
+        # when groups are rendered in parallel) so only one at a time
+        # is let in here
+        with open(self.local.projLogFile + '.lock', 'a') as lockObject :
+            fcntl.flock(lockObject, fcntl.LOCK_EX)
+            if not os.path.isfile(self.local.projLogFile) or os.path.getsize(self.local.projLogFile) == 0 :
+                writeObject = codecs.open(self.local.projLogFile, "w", encoding='utf_8')
+                writeObject.write('Rapuma event log file created: ' + self.tools.tStamp() + '\n')
+                writeObject.close()
+
+            # Now log the event to the top of the log file using preAppend().
+            self.preAppend(eventLine, self.local.projLogFile)
+
+            # FIXME: Add the TOD list output here, also, output any TODs 
+            # to the error log as well as these are bad errors.
+
+            # Write errors and warnings to the error log file
+            if code == 'WRN' and self.userConfig['System']['debugging'] == 'True':
+                self.writeToErrorLog(self.local.projErrorLogFile, eventLine)
+
+            if code == 'ERR' :
+                self.writeToErrorLog(self.local.projErrorLogFile, eventLine)
+            fcntl.flock(lockObject, fcntl.LOCK_UN)
+
+
+    def holdEvents (self) :
+        '''Start holding the log events made in this process instead of
+        writing them. This is for worker processes, the parent writes them
+        with writeHeldEvents().'''
+
+        heldEvents['hold'] = True
+        heldEvents['events'] = []
+
+
+    def getHeldEvents (self) :
+        '''Return the log events held in this process, and let them go.'''
+
+        events = list(heldEvents['events'])
+        heldEvents['events'] = []
+
+        return events
+
+
+    def writeHeldEvents (self, events) :
+        '''Write out the log events sent back by a worker process (see
+        holdEvents()). They were already shown on the terminal by the
+        worker so they only go to the log files here.'''
+
+        if not self.local.projectConfFile or not os.path.exists(self.local.projectConfFile) :
+            return
+        try :
+            for (code, eventLine) in events :
+                self.writeEventLine(code, eventLine)
+        except Exception as e :
+            self.tools.terminal('Failed to write worker messages to log file: [' + str(e) + ']')
+
+
     def writeToErrorLog (self, errorLog, eventLine) :
         '''In a perfect world there would be no errors, but alas there are and
         we need to put them in a special file that can be accessed after the
@@ -155,18 +210,21 @@ class ProjLog (object) :
 
 
     def preAppend (self, line, file_name) :
-        '''Got the following code out of a Python forum.  This will pre-append a
-        line to the beginning of a file.'''
+        '''This will pre-append a line to the beginning of a file. The new
+        file is written next to the old one and moved into place when it is
+        done so the file is never left part written. The log lock should be
+        held when this is called (see writeToLog()).'''
 
 #        import pdb; pdb.set_trace()
 
-        fobj = fileinput.FileInput(file_name, inplace=1)
-        first_line = fobj.readline()
-        sys.stdout.write("%s\n%s" % (line, first_line))
-        for line in fobj:
-            sys.stdout.write("%s" % line)
-
-        fobj.close()
+        if isinstance(line, unicode) :
+            line = line.encode('utf_8')
+        tmpFile = file_name + '.' + str(os.getpid())
+        with open(file_name, 'rb') as oldObject :
+            with open(tmpFile, 'wb') as newObject :
+                newObject.write(line + '\n')
+                shutil.copyfileobj(oldObject, newObject)
+        os.rename(tmpFile, file_name)
 
 
 
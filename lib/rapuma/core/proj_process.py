@@ -23,6 +23,7 @@ from rapuma.core.tools              import Tools
 from rapuma.core.user_config        import UserConfig
 from rapuma.core.proj_local         import ProjLocal
 from rapuma.core.proj_log           import ProjLog
+from rapuma.core.usfm_index         import UsfmIndex
 #from rapuma.core.paratext           import Paratext
 from rapuma.project.proj_config     import Config
 
@@ -33,6 +34,7 @@ class ProjProcess (object) :
         '''Intitate the whole class and create the object.'''
 
         self.pid                    = pid
+        self.gid                    = gid
         self.tools                  = Tools()
         self.user                   = UserConfig()
         self.userConfig             = self.user.userConfig
@@ -58,6 +60,8 @@ class ProjProcess (object) :
 
             '1210' : ['MSG', 'Processes completed successfully on: [<<1>>] by [<<2>>]'],
             '1220' : ['ERR', 'Processes for [<<1>>] failed. Script [<<2>>] returned this error: [<<3>>]'],
+            '1230' : ['ERR', 'Could not load the text process module [<<1>>]. Error given was: [<<2>>]'],
+            '1235' : ['ERR', 'Processes for [<<1>>] failed. The transform() in [<<2>>] gave this error: [<<3>>]'],
             '1240' : ['MSG', 'Component group preprocessing [<<1>>] for group [<<2>>].'],
             '1260' : ['ERR', 'Installed the default component preprocessing script. Editing will be required for it to work with your project.'],
             '1265' : ['LOG', 'Component preprocessing script is already installed.'],
@@ -185,13 +189,34 @@ class ProjProcess (object) :
     def runProcessScript (self, target, scriptFile) :
         '''Run a text processing script on a component. This assumes the 
         component and the script are valid and the component lock is turned 
-        off. If not, you cannot expect any good to come of this.'''
+        off. If not, you cannot expect any good to come of this. Scripts
+        with a transform() function are run in this process, any others
+        are run on their own.'''
+
+        try :
+            transform = self.tools.getTextTransform(scriptFile)
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['1230'], [self.tools.fName(scriptFile), str(e)])
+            return False
+        if transform :
+            cid = self.tools.discoverCIDFromFile(target)
+            context = {'pid' : self.pid, 'gid' : self.gid, 'target' : target, 'projectConfig' : self.projectConfig}
+            try :
+                if self.tools.transformTextFile(transform, target, cid, context) :
+                    # The text has moved, so should its index
+                    UsfmIndex(target).refresh()
+            except Exception as e :
+                self.log.writeToLog(self.errorCodes['1235'], [self.tools.fName(target), self.tools.fName(scriptFile), str(e)])
+                return False
+            self.log.writeToLog(self.errorCodes['1210'], [self.tools.fName(target), self.tools.fName(scriptFile)])
+            return True
 
         # subprocess will fail if permissions are not set on the
         # script we want to run. The correct permission should have
         # been set when we did the installation.
         err = subprocess.call([scriptFile, target])
         if err == 0 :
+            UsfmIndex(target).refresh()
             self.log.writeToLog(self.errorCodes['1210'], [self.tools.fName(target), self.tools.fName(scriptFile)])
         else :
             self.log.writeToLog(self.errorCodes['1220'], [self.tools.fName(target), self.tools.fName(scriptFile), str(err)])
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# This class will keep track of how long the different stages of a process
+# take. Stages are recorded as named spans which can be nested. All the spans
+# for a session are kept at the module level so any object in the process can
+# add to them. At the end of the session they are written out to a JSON report
+# in the project folder and a summary can be shown on the terminal.
+
+
+###############################################################################
+################################## Trace Class ################################
+###############################################################################
+# Firstly, import all the standard Python modules we need for
+# this process
+
+import os, time, timeit, json, codecs
+from contextlib                 import contextmanager
+
+# Session data shared by all the trace objects in this process
+sessionData = {'pid' : None, 'start' : time.time(), 'spans' : [], 'open' : []}
+
+
+class ProjTrace (object) :
+
+    def __init__(self, pid = None) :
+        '''Set up a trace object for a project. All trace objects in
+        a process share the same session data.'''
+
+        # Remember what project we are working with so we know
+        # where the report should go at the end of the session
+        if pid :
+            sessionData['pid']  = pid
+        self.pid                = sessionData['pid']
+
+
+###############################################################################
+################################ Trace Functions ##############################
+###############################################################################
+
+    def start (self, name, info = None) :
+        '''Start timing a stage. Info is an optional dict of extra things
+        to record with it, like the gid or cid that is being worked on.'''
+
+        sessionData['open'].append({
+            'name'      : name,
+            'info'      : info or {},
+            'start'     : time.time(),
+            'timer'     : timeit.default_timer(),
+            'depth'     : len(sessionData['open'])
+        })
+
+
+    def stop (self, name = None) :
+        '''Stop timing the last stage that was started. If a name is given,
+        any stages started after the named one are stopped as well.'''
+
+        while sessionData['open'] :
+            span = sessionData['open'].pop()
+            self.record(span)
+            if not name or span['name'] == name :
+                break
+
+
+    @contextmanager
+    def span (self, name, info = None) :
+        '''Time whatever is done in a with statement.'''
+
+        self.start(name, info)
+        try :
+            yield
+        finally :
+            self.stop(name)
+
+
+    def record (self, span, finished = True) :
+        '''Add a stage to the list of the ones that are done.'''
+
+        sessionData['spans'].append({
+            'name'      : span['name'],
+            'info'      : span['info'],
+            'start'     : round(span['start'] - sessionData['start'], 4),
+            'time'      : round(timeit.default_timer() - span['timer'], 4),
+            'depth'     : span['depth'],
+            'process'   : os.getpid(),
+            'finished'  : finished
+        })
+
+
+    def getSpans (self) :
+        '''Return a list of the stages that are done.'''
+
+        return list(sessionData['spans'])
+
+
+    def addSpans (self, spans) :
+        '''Add stages that were recorded by another process (which had
+        to have been started in this session).'''
+
+        sessionData['spans'].extend(spans)
+
+
+    def reset (self) :
+        '''Clear out everything. This is needed in new processes as they
+        come with a copy of the parent's stages.'''
+
+        del sessionData['spans'][:]
+        del sessionData['open'][:]
+
+
+    def getStageTotals (self) :
+        '''Return a dict of the total time spent in each named stage.'''
+
+        totals = {}
+        for span in sessionData['spans'] :
+            stage = totals.setdefault(span['name'], {'count' : 0, 'time' : 0.0})
+            stage['count'] += 1
+            stage['time'] = round(stage['time'] + span['time'], 4)
+        return totals
+
+
+    def writeReport (self, reportFile, totalTime) :
+        '''Write out the timing report for this session. Anything that was
+        not stopped (because the process halted) is recorded as unfinished.'''
+
+        while sessionData['open'] :
+            self.record(sessionData['open'].pop(), False)
+
+        report = {
+            'pid'       : self.pid,
+            'date'      : time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sessionData['start'])),
+            'total'     : totalTime,
+            'stages'    : self.getStageTotals(),
+            'spans'     : sorted(sessionData['spans'], key=lambda s : s['start'])
+        }
+        with codecs.open(reportFile, 'w', encoding='utf_8') as reportObject :
+            reportObject.write(json.dumps(report, indent=4, sort_keys=True))
+        return True
+
+
+    def summary (self) :
+        '''Return a list of lines that summarize the stages, longest first.'''
+
+        totals = self.getStageTotals()
+        lines = []
+        for name in sorted(totals.keys(), key=lambda n : totals[n]['time'], reverse=True) :
+            lines.append('\t' + name + ' (' + str(totals[name]['count']) + 'x): ' + '%.2f' % totals[name]['time'] + ' sec.')
+        return lines
+
+
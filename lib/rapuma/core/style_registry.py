@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# This class will hand out parsed USFM stylesheets. Each style file is only
+# parsed once in a process, and the results are also kept in a pickled disk
+# cache keyed by a hash of the file so other sessions do not need to parse it
+# either. Merged stylesheets (the palaso default stylesheet plus any number of
+# style files) are shared by everyone that asks for them so they cannot be
+# changed. Use copy() to get one that can be.
+
+
+###############################################################################
+################################ Component Class ##############################
+###############################################################################
+# Firstly, import all the standard Python modules we need for
+# this process
+
+import os, hashlib, cPickle
+from palaso.sfm                             import usfm, style
+
+# Stylesheets we have already parsed in this process. Single style files are
+# kept by their hash, merged stylesheets by the list of hashes they are made of.
+parsedStyles = {}
+mergedStyles = {}
+
+
+class FrozenStylesheet (dict) :
+    '''A stylesheet dictionary that cannot be changed. The styleHash
+    is a hash of the style files that went into it.'''
+
+    styleHash = None
+
+    def readOnly (self, *args, **kwargs) :
+        raise TypeError('This stylesheet is shared and cannot be changed, use copy() to get one that can be.')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = readOnly
+
+    def copy (self) :
+        return dict(self)
+
+
+class StyleRegistry (object) :
+
+    def __init__(self, cacheFolder = None) :
+        '''Do the primary initialization for this class. The cacheFolder
+        is where the pickled style files go, if none is given nothing
+        is cached on disk.'''
+
+        self.cacheFolder            = cacheFolder
+
+
+###############################################################################
+############################### Registry Functions ############################
+###############################################################################
+
+    def getStylesheet (self, styFiles) :
+        '''Return the palaso default USFM stylesheet with the styles in a
+        list of style files added to it, in the order given.'''
+
+        styHashes = []
+        for styFile in styFiles :
+            styHashes.append(self.parseStyFile(os.path.expanduser(styFile)))
+        key = tuple(styHashes)
+        if not mergedStyles.has_key(key) :
+            stylesheet = usfm.default_stylesheet.copy()
+            for styHash in styHashes :
+                stylesheet.update(parsedStyles[styHash])
+            mergedStyles[key] = FrozenStylesheet(stylesheet)
+            mergedStyles[key].styleHash = hashlib.sha1(' '.join(styHashes)).hexdigest()
+
+        return mergedStyles[key]
+
+
+    def parseStyFile (self, styFile) :
+        '''Parse a style file if it has not been done already. Return the
+        hash it is kept under.'''
+
+        with open(styFile, 'rb') as styObject :
+            contents = styObject.read()
+        styHash = hashlib.sha1(contents).hexdigest()
+        if parsedStyles.has_key(styHash) :
+            return styHash
+
+        styles = self.loadCachedStyles(styHash)
+        if styles == None :
+            with open(styFile, 'r') as styObject :
+                styles = style.parse(styObject)
+            self.storeCachedStyles(styHash, styles)
+        parsedStyles[styHash] = styles
+
+        return styHash
+
+
+    def loadCachedStyles (self, styHash) :
+        '''Return the pickled styles for a hash or None if they are not
+        in the cache (or can no longer be read).'''
+
+        if not self.cacheFolder :
+            return None
+        cacheFile = os.path.join(self.cacheFolder, styHash + '.pickle')
+        if not os.path.isfile(cacheFile) :
+            return None
+        try :
+            with open(cacheFile, 'rb') as cacheObject :
+                return cPickle.load(cacheObject)
+        except Exception :
+            return None
+
+
+    def storeCachedStyles (self, styHash, styles) :
+        '''Pickle parsed styles into the cache. This goes to a temporary
+        file first so no one will ever read a part written one.'''
+
+        if not self.cacheFolder :
+            return False
+        cacheFile = os.path.join(self.cacheFolder, styHash + '.pickle')
+        tmpFile = cacheFile + '.' + str(os.getpid())
+        try :
+            if not os.path.isdir(self.cacheFolder) :
+                os.makedirs(self.cacheFolder)
+            with open(tmpFile, 'wb') as cacheObject :
+                cPickle.dump(styles, cacheObject, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmpFile, cacheFile)
+            return True
+        except Exception :
+            if os.path.isfile(tmpFile) :
+                os.remove(tmpFile)
+            return False
+
+
@@ -18,11 +18,35 @@
 # this process
 
 import codecs, os, sys, re, fileinput, zipfile, shutil, stat, errno
-import difflib, tempfile, subprocess
+import difflib, tempfile, subprocess, fcntl, mmap, ast, imp, copy
 from datetime                               import *
 from xml.etree                              import cElementTree as ET
 from collections                            import defaultdict
 from configobj                              import ConfigObj, Section
+from pyPdf                                  import PdfFileReader, PdfFileWriter
+from pyPdf.generic                          import NameObject
+
+# Load the local classes
+from rapuma.core.proj_trace                 import ProjTrace
+
+
+# The Linux ioctl request that makes a reflink (a copy that shares its
+# data blocks with the original until one of them is written to)
+FICLONE = 0x40049409
+
+# Page counts of PDF files we have already looked at in this process.
+# The key is the file path, the value is (size, mtime, pages).
+pdfPageCounts = {}
+
+# Text process modules we have already loaded in this process. The key is
+# the script path, the value is (size, mtime, transform).
+textTransforms = {}
+
+# Config changes made in this process, by file name. These are only kept in
+# worker processes (see keepConfChanges()) so that their changes can be
+# merged into the files, and sent back to the parent, instead of each one
+# writing its own copy of a config over the others.
+confChanges = {'keep' : False, 'files' : {}}
 
 
 ###############################################################################
@@ -34,6 +58,8 @@ class Tools (object) :
     def __init__(self) :
         '''Do the primary initialization for this manager.'''
 
+        self.trace              = ProjTrace()
+
 
 ###############################################################################
 ############################ Functions Begin Here #############################
@@ -41,6 +67,122 @@ class Tools (object) :
 
 ##### PDF Tools
 
+    def pdfPullPages (self, source, target, pgRange) :
+        '''Copy the pages given in a pdftk style page range (see
+        parsePageRange()) from the source to the target file. This is done
+        in-process and only the objects the pages use are written out so
+        the work is in proportion to the number of pages pulled. If the
+        range is something we cannot read, pdftk will be asked to do it.'''
+
+        with self.trace.span('pdfPullPages', {'pages' : pgRange}) :
+            try :
+                with open(source, 'rb') as sourceObject :
+                    reader = PdfFileReader(sourceObject)
+                    pages = self.parsePageRange(pgRange, reader.getNumPages())
+                    if pages != None :
+                        writer = PdfFileWriter()
+                        for page in pages :
+                            writer.addPage(reader.getPage(page))
+                        return self.writePdfFile(writer, target)
+            except Exception as e :
+                self.terminal('Warning: Pulling pages in-process failed with this error: ' + str(e) + ' Trying pdftk.')
+            self.pdftkPullPages(source, target, pgRange)
+            return target
+
+
+    def parsePageRange (self, pgRange, totalPages) :
+        '''Turn a page range like "1-4 7 10-end" into a list of (0 based)
+        page indexes. Ranges can be separated by spaces or commas and can
+        run backwards (like pdftk, "5-1"). Return None if the range does
+        not make sense for this many pages.'''
+
+        pages = []
+        for part in re.split(r'[\s,]+', str(pgRange).strip()) :
+            if not part :
+                continue
+            m = re.match(r'^(\d+|end)(?:-(\d+|end))?$', part)
+            if not m :
+                return
+            first = totalPages if m.group(1) == 'end' else int(m.group(1))
+            last = first
+            if m.group(2) :
+                last = totalPages if m.group(2) == 'end' else int(m.group(2))
+            if not (0 < first <= totalPages and 0 < last <= totalPages) :
+                return
+            step = 1 if last >= first else -1
+            pages.extend(range(first - 1, last - 1 + step, step))
+        return pages or None
+
+
+    def concatPdfFiles (self, pdfList, target) :
+        '''Join a list of PDF files, in the order given, into one target
+        file. This is done in-process, pdftk is used if that fails.'''
+
+        with self.trace.span('pdfConcat', {'files' : len(pdfList)}) :
+            # The files have to stay open until the writer is done with them
+            pdfObjects = []
+            try :
+                writer = PdfFileWriter()
+                for pdfFile in pdfList :
+                    pdfObjects.append(open(pdfFile, 'rb'))
+                    reader = PdfFileReader(pdfObjects[-1])
+                    for page in range(reader.getNumPages()) :
+                        writer.addPage(reader.getPage(page))
+                return self.writePdfFile(writer, target)
+            except Exception as e :
+                self.terminal('Warning: Joining PDF files in-process failed with this error: ' + str(e) + ' Trying pdftk.')
+            finally :
+                for pdfObject in pdfObjects :
+                    pdfObject.close()
+            return self.concatPdfFilesPdftk(pdfList, target)
+
+
+    def mergePdfFiles (self, front, back) :
+        '''Stamp the first page of the back file under every page of the
+        front file (like the pdftk background function). The results go
+        back into the front file and its name is returned. The page boxes
+        of the front file are kept. If this fails, pdftk is used.'''
+
+        with self.trace.span('pdfStamp', {'file' : self.fName(front)}) :
+            try :
+                with open(front, 'rb') as frontObject :
+                    with open(back, 'rb') as backObject :
+                        frontReader = PdfFileReader(frontObject)
+                        backPage = PdfFileReader(backObject).getPage(0)
+                        writer = PdfFileWriter()
+                        for p in range(frontReader.getNumPages()) :
+                            frontPage = frontReader.getPage(p)
+                            # Merging puts new contents and resources on the page
+                            # it is done to, so each page gets its own copy
+                            page = copy.copy(backPage)
+                            page.mergePage(frontPage)
+                            for box in ['/MediaBox', '/CropBox', '/BleedBox', '/TrimBox', '/ArtBox', '/Rotate'] :
+                                if frontPage.has_key(box) :
+                                    page[NameObject(box)] = frontPage[box]
+                            writer.addPage(page)
+                        self.writePdfFile(writer, front)
+                return front
+            except Exception as e :
+                self.terminal('Warning: Merging PDF files in-process failed with this error: ' + str(e) + ' Trying pdftk.')
+            return self.mergePdfFilesPdftk(front, back)
+
+
+    def writePdfFile (self, writer, target) :
+        '''Write out a PdfFileWriter object. This goes to a temp file next
+        to the target first and is then moved over it, as the target may
+        be one of the files the pages are coming from.'''
+
+        tmpOut = target + '.tmp'
+        try :
+            with open(tmpOut, 'wb') as outObject :
+                writer.write(outObject)
+            os.rename(tmpOut, target)
+        finally :
+            if os.path.isfile(tmpOut) :
+                os.remove(tmpOut)
+        return target
+
+
     def mergePdfFilesPdftk (self, front, back) :
         '''Merge two PDF files together using pdftk.'''
 
@@ -51,8 +193,9 @@ class Tools (object) :
 
         # Run the process
         try:
-            subprocess.call(cmd) 
-            shutil.copy(tmpFile, front)
+            with self.trace.span('pdftkMerge') :
+                subprocess.call(cmd) 
+            self.materializeFile(tmpFile, front)
             # Return the name of the primary PDF
             return front
         except Exception as e :
@@ -71,7 +214,8 @@ class Tools (object) :
 
         # Simple try statement seems to work best for this
         try:
-            subprocess.call(cmd) 
+            with self.trace.span('svgToPdf') :
+                subprocess.call(cmd) 
             return pdfFile
         except Exception as e :
             self.terminal('Warning: Converting SVG to PDF, RSVG failed with this error: ' + str(e))
@@ -88,9 +232,141 @@ class Tools (object) :
         # Create a temp file name
         tmpOut = tempfile.NamedTemporaryFile().name
         # Incase the source and target are the same output to a temp file
-        rCode = subprocess.call(['pdftk', source, 'cat', pgRange, 'output', tmpOut])
+        with self.trace.span('pdftkPullPages') :
+            rCode = subprocess.call(['pdftk', source, 'cat', pgRange, 'output', tmpOut])
         # Manually copy the temp file to the target
-        shutil.copy(tmpOut, target)
+        self.materializeFile(tmpOut, target)
+
+
+    def concatPdfFilesPdftk (self, pdfList, target) :
+        '''Using the cat function in pdftk, join a list of PDF files,
+        in the order given, into one target file.'''
+
+        # Output to a temp file in case the target is also in the list
+        tmpOut = tempfile.NamedTemporaryFile().name
+        try :
+            with self.trace.span('pdftkConcat') :
+                rCode = subprocess.call(['pdftk'] + pdfList + ['cat', 'output', tmpOut])
+            if not rCode :
+                self.materializeFile(tmpOut, target)
+                return True
+        except Exception as e :
+            self.terminal('Warning: Joining PDF files failed, pdftk failed with this error: ' + str(e))
+
+
+    def pdfTotalPages (self, pdfFile) :
+        '''Return the number of pages in a PDF file. A big PDF can take a
+        long time to parse so we try to go straight to the /Count of the
+        page tree first (see pdfFastPageCount()). If that does not work out
+        the whole file is parsed with PdfFileReader. Counts are remembered
+        until the size or modification time of the file changes.'''
+
+        fileStat = os.stat(pdfFile)
+        pdfPath = os.path.abspath(pdfFile)
+        if pdfPageCounts.has_key(pdfPath) :
+            (size, mtime, pages) = pdfPageCounts[pdfPath]
+            if size == fileStat.st_size and mtime == fileStat.st_mtime :
+                return pages
+
+        with self.trace.span('pdfTotalPages', {'file' : self.fName(pdfFile)}) :
+            pages = self.pdfFastPageCount(pdfFile)
+            if pages == None :
+                pages = PdfFileReader(open(pdfFile, 'rb')).getNumPages()
+
+        pdfPageCounts[pdfPath] = (fileStat.st_size, fileStat.st_mtime, pages)
+        return pages
+
+
+    def pdfFastPageCount (self, pdfFile) :
+        '''Memory map a PDF file and follow the trailer /Root to the catalog,
+        then to the root /Pages object to get its /Count. This only works
+        with classic xref tables, if the objects are packed in object
+        streams (or anything else looks odd) return None.'''
+
+        try :
+            with open(pdfFile, 'rb') as fileObject :
+                data = mmap.mmap(fileObject.fileno(), 0, access=mmap.ACCESS_READ)
+                try :
+                    # The last startxref in the file points to the newest xref table
+                    starts = re.findall(r'startxref\s+(\d+)', data[-1024:])
+                    if not starts :
+                        return
+                    xrefOffset = int(starts[-1])
+                    xref = self.pdfXrefSections(data, xrefOffset)
+                    if not xref :
+                        return
+                    root = re.search(r'/Root\s+(\d+)\s+\d+\s+R', xref[1])
+                    if not root :
+                        return
+                    catalog = self.pdfObjectText(data, xrefOffset, int(root.group(1)))
+                    pagesRef = re.search(r'/Pages\s+(\d+)\s+\d+\s+R', catalog or '')
+                    if not pagesRef :
+                        return
+                    pages = self.pdfObjectText(data, xrefOffset, int(pagesRef.group(1)))
+                    count = re.search(r'/Count\s+(\d+)', pages or '')
+                    if count :
+                        return int(count.group(1))
+                finally :
+                    data.close()
+        except Exception :
+            return
+
+
+    def pdfXrefSections (self, data, xrefOffset) :
+        '''Read a classic xref table in a (memory mapped) PDF. Return a list
+        of its subsections as (first object, object count, offset of the
+        first entry) and the text of the trailer that follows it. None is
+        returned if there is no classic table at the offset.'''
+
+        if data[xrefOffset:xrefOffset + 4] != 'xref' :
+            return
+        subRe = re.compile(r'\s*(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)')
+        sections = []
+        pos = xrefOffset + 4
+        while True :
+            m = subRe.match(data, pos)
+            if not m :
+                break
+            sections.append((int(m.group(1)), int(m.group(2)), m.end()))
+            # Each entry is always 20 bytes long
+            pos = m.end() + 20 * int(m.group(2))
+        end = data.find('startxref', pos)
+        if end < 0 :
+            return
+        return (sections, data[pos:end])
+
+
+    def pdfObjectText (self, data, xrefOffset, objNum) :
+        '''Look up an object in the xref tables of a PDF (newest first,
+        following /Prev) and return its text, up to endobj. None is
+        returned if it cannot be found where it should be.'''
+
+        entryRe = re.compile(r'(\d{10}) (\d{5}) ([nf])')
+        seen = []
+        while xrefOffset not in seen :
+            seen.append(xrefOffset)
+            xref = self.pdfXrefSections(data, xrefOffset)
+            if not xref :
+                return
+            (sections, trailer) = xref
+            for (first, count, entries) in sections :
+                if first <= objNum < first + count :
+                    entry = entryRe.match(data, entries + 20 * (objNum - first))
+                    if not entry or entry.group(3) != 'n' :
+                        return
+                    offset = int(entry.group(1))
+                    end = data.find('endobj', offset)
+                    if end < 0 :
+                        return
+                    text = data[offset:end]
+                    # Make sure we landed on the right object
+                    if not re.match(str(objNum) + r'\s+\d+\s+obj', text) :
+                        return
+                    return text
+            prev = re.search(r'/Prev\s+(\d+)', trailer)
+            if not prev :
+                return
+            xrefOffset = int(prev.group(1))
 
 
     def pdftkTotalPages (self, pdfFile) :
@@ -314,6 +590,61 @@ class Tools (object) :
             return False
 
 
+    def materializeFile (self, source, target) :
+        '''Make the target a copy of the source as cheaply as the file
+        system allows. A reflink is tried first, then a hard link, then
+        a normal copy. The target is always replaced, never written into,
+        so any other links to the old target are left as they were.
+        Return the kind of copy that was made or None if it failed.
+
+        A hard link is the same file under two names, so a file that is
+        written into in place (like XeTeX does with its output) needs to
+        go through unshareFile() first.'''
+
+        if os.path.isfile(target) and os.path.samefile(source, target) :
+            return 'link'
+        tmpTarget = target + '.' + str(os.getpid()) + '.tmp'
+        if os.path.lexists(tmpTarget) :
+            os.remove(tmpTarget)
+        try :
+            with open(source, 'rb') as sourceObject :
+                with open(tmpTarget, 'wb') as targetObject :
+                    fcntl.ioctl(targetObject.fileno(), FICLONE, sourceObject.fileno())
+            shutil.copymode(source, tmpTarget)
+            os.rename(tmpTarget, target)
+            return 'reflink'
+        except (IOError, OSError) :
+            if os.path.lexists(tmpTarget) :
+                os.remove(tmpTarget)
+        try :
+            os.link(source, tmpTarget)
+            os.rename(tmpTarget, target)
+            return 'link'
+        except (OSError, AttributeError) :
+            if os.path.lexists(tmpTarget) :
+                os.remove(tmpTarget)
+        try :
+            shutil.copy(source, tmpTarget)
+            os.rename(tmpTarget, target)
+            return 'copy'
+        except (IOError, OSError) as e :
+            if os.path.lexists(tmpTarget) :
+                os.remove(tmpTarget)
+            self.terminal('Warning: Could not copy ' + source + ' to ' + target + ': ' + str(e))
+            return None
+
+
+    def unshareFile (self, fileName) :
+        '''If a file has other names (hard links) give it a copy of its
+        own, so writing into it will not change the other ones.'''
+
+        if os.path.isfile(fileName) and os.stat(fileName).st_nlink > 1 :
+            tmpFile = fileName + '.' + str(os.getpid()) + '.tmp'
+            shutil.copy(fileName, tmpFile)
+            os.rename(tmpFile, fileName)
+            return True
+
+
     def fixExecutables (self, scriptDir) :
         '''Go through a folder and set permission on executables.'''
 
@@ -327,6 +658,81 @@ class Tools (object) :
             self.dieNow('Error: fixExecutables() failed with this error: ' + str(e))
 
 
+    def getTextTransform (self, scriptFile) :
+        '''Return the transform(text, cid, context) function from a text
+        process module, or None if the script does not have one. Old style
+        scripts do their work as soon as they are run so they are checked
+        for a transform() without running them. Scripts that are not Python
+        (by their #! line or extension, or because they do not parse as
+        Python) return None too, so they can still be run on their own. A
+        module is only loaded once in a process, unless it changes.'''
+
+        scriptPath = os.path.realpath(scriptFile)
+        fileStat = os.stat(scriptPath)
+        if textTransforms.has_key(scriptPath) :
+            (size, mtime, transform) = textTransforms[scriptPath]
+            if size == fileStat.st_size and mtime == fileStat.st_mtime :
+                return transform
+
+        with open(scriptPath, 'rU') as scriptObject :
+            code = scriptObject.read()
+        transform = None
+        firstLine = code.split('\n', 1)[0]
+        extension = os.path.splitext(scriptPath)[1].lower()
+        isPython = extension == '.py' or re.match(r'#!.*python', firstLine)
+        tree = None
+        if isPython or not (firstLine.startswith('#!') or extension) :
+            try :
+                tree = ast.parse(code, scriptPath)
+            except SyntaxError :
+                # A broken Python script is an error, anything else
+                # is just not Python
+                if isPython :
+                    raise
+        if tree and [n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == 'transform'] :
+            # Load it without leaving a .pyc in the project. The module has
+            # to be kept in sys.modules or its globals go when it does.
+            moduleName = 'rapuma_transform_' + re.sub(r'\W', '_', self.fName(scriptPath))
+            module = imp.new_module(moduleName)
+            module.__file__ = scriptPath
+            exec compile(code, scriptPath, 'exec') in module.__dict__
+            sys.modules[moduleName] = module
+            transform = getattr(module, 'transform', None)
+        textTransforms[scriptPath] = (fileStat.st_size, fileStat.st_mtime, transform)
+
+        return transform
+
+
+    def runTextTransform (self, transform, text, cid, context) :
+        '''Run a text process module's transform() on the text of a
+        component and return the new text. If nothing comes back the text
+        is left as it was. Any error is left for the caller to report.'''
+
+        newText = transform(text, cid, context)
+        if newText == None :
+            return text
+
+        return newText
+
+
+    def transformTextFile (self, transform, target, cid, context) :
+        '''Run a text process module's transform() on the text in a working
+        file (see runTextTransform()) and write back what comes out if it
+        has changed. Return True if the file was changed.'''
+
+        with codecs.open(target, 'rt', 'utf_8_sig') as contents :
+            text = contents.read()
+        newText = self.runTextTransform(transform, text, cid, context)
+        if newText == text :
+            return False
+        tmpFile = target + '.' + str(os.getpid())
+        with codecs.open(tmpFile, 'w', 'utf_8_sig') as output :
+            output.write(newText)
+        os.rename(tmpFile, target)
+
+        return True
+
+
     def makeReadOnly (self, fileName) :
         '''Set the permissions on a file to read only.'''
 
@@ -532,8 +938,15 @@ class Tools (object) :
             self.terminal('decodeText() failed with the following error: ' + str(e))
             self.dieNow()
         # Now try to run the decode() function
+        return self.decodeData(fileObj, sourceEncode, fileName)
+
+
+    def decodeData (self, data, sourceEncode, fileName) :
+        '''Decode text that has already been read in from a file. The file
+        name is only used for the error message.'''
+
         try:
-            return fileObj.decode(sourceEncode)
+            return data.decode(sourceEncode)
 
         except Exception:
             self.terminal('decodeText() could not decode: [' + fileName + ']\n')
@@ -615,6 +1028,9 @@ class Tools (object) :
             configObj.filename = orgFileName
             self.writeConfFile(configObj)
 
+        # Remember what was loaded so changes can be found later
+        configObj.loadedData = configObj.dict()
+
         return configObj
 
 
@@ -706,49 +1122,145 @@ class Tools (object) :
         if not os.path.exists(os.path.split(config.filename)[0]) :
             os.makedirs(os.path.split(config.filename)[0])
 
-        # Make a backup in our temp dir case something goes dreadfully wrong
-        orgConfData = tempfile.NamedTemporaryFile()
-        if os.path.isfile(config.filename) :
-            shutil.copy(config.filename, orgConfData.name)
-
-        # Now do a compare on the new data set to see if there was any actual changes.
-        # Writing out a "non-change" will affect other processes downstream. There may
-        # be a better way to do this but this will have to do for now.
-        newConfData = tempfile.NamedTemporaryFile()
-        new = ConfigObj(config,  encoding='utf-8')
-        new.filename = newConfData.name
-        new.write()
-
-        # Inside of diffl() open both files with universial line endings then
-        # check each line for differences. This looks for an identical file
-        diff = difflib.ndiff(open(newConfData.name, 'rU').readlines(), open(orgConfData.name, 'rU').readlines())
-        for d in diff :
-            if d[:1] == '+' or d[:1] == '-' :
-                # Let's try to write it out
-                try :
-                    # To track when a conf file was saved as well as other general
-                    # housekeeping we will create a GeneralSettings section with
-                    # a last edit date key/value.
-                    self.buildConfSection(config, 'GeneralSettings')
-                    # If we got past that, write a time stamp
-                    config['GeneralSettings']['lastEdit'] = self.tStamp()
-                    # Try to write out the data now
-                    config.write()
-                except Exception as e :
-                    self.terminal(u'\nERROR: Could not write to: ' + config.filename)
-                    self.terminal(u'\nPython reported this error:\n\n\t[' + unicode(e) + ']' + unicode(config) + '\n')
-                    # Recover now
-                    if os.path.isfile(orgConfData.name) :
-                        shutil.copy(orgConfData.name, config.filename)
-                    # Use raise to send out a stack trace. An error at this point
-                    # is like a kernel panic. Not good at all.
-                    raise
-                # No need to look for more if we write out on the first findall
-                break
+        # Worker processes only write out what they changed
+        if confChanges['keep'] and hasattr(config, 'loadedData') and os.path.isfile(config.filename) :
+            return self.writeConfChanges(config)
+
+        # More than one process can be working on the same project (like
+        # when groups are rendered at the same time) so we lock the file
+        # while we are working with it
+        with self.trace.span('writeConfFile', {'file' : os.path.basename(config.filename)}) :
+            lockObject = open(config.filename, 'a')
+            fcntl.flock(lockObject, fcntl.LOCK_EX)
+            try :
+                # Make a backup in our temp dir case something goes dreadfully wrong
+                orgConfData = tempfile.NamedTemporaryFile()
+                if os.path.isfile(config.filename) :
+                    shutil.copy(config.filename, orgConfData.name)
+
+                # Now do a compare on the new data set to see if there was any actual changes.
+                # Writing out a "non-change" will affect other processes downstream. There may
+                # be a better way to do this but this will have to do for now.
+                newConfData = tempfile.NamedTemporaryFile()
+                new = ConfigObj(config,  encoding='utf-8')
+                new.filename = newConfData.name
+                new.write()
+
+                # Inside of diffl() open both files with universial line endings then
+                # check each line for differences. This looks for an identical file
+                diff = difflib.ndiff(open(newConfData.name, 'rU').readlines(), open(orgConfData.name, 'rU').readlines())
+                for d in diff :
+                    if d[:1] == '+' or d[:1] == '-' :
+                        # Let's try to write it out
+                        try :
+                            # To track when a conf file was saved as well as other general
+                            # housekeeping we will create a GeneralSettings section with
+                            # a last edit date key/value.
+                            self.buildConfSection(config, 'GeneralSettings')
+                            # If we got past that, write a time stamp
+                            config['GeneralSettings']['lastEdit'] = self.tStamp()
+                            # Try to write out the data now
+                            config.write()
+                        except Exception as e :
+                            self.terminal(u'\nERROR: Could not write to: ' + config.filename)
+                            self.terminal(u'\nPython reported this error:\n\n\t[' + unicode(e) + ']' + unicode(config) + '\n')
+                            # Recover now
+                            if os.path.isfile(orgConfData.name) :
+                                shutil.copy(orgConfData.name, config.filename)
+                            # Use raise to send out a stack trace. An error at this point
+                            # is like a kernel panic. Not good at all.
+                            raise
+                        # No need to look for more if we write out on the first findall
+                        break
+            finally :
+                fcntl.flock(lockObject, fcntl.LOCK_UN)
+                lockObject.close()
+
         # Should be done if we made it this far
         return True
 
 
+    def keepConfChanges (self) :
+        '''Start keeping the config changes made in this process. This is
+        for worker processes that share config files with others.'''
+
+        confChanges['keep'] = True
+        confChanges['files'] = {}
+
+
+    def getConfChanges (self) :
+        '''Return the config changes kept in this process as a dictionary
+        of change lists (see confDiff()) by file name.'''
+
+        return dict(confChanges['files'])
+
+
+    def writeConfChanges (self, config) :
+        '''Write only what has changed in a config object since it was
+        loaded. The file is read in again while it is locked and the
+        changes are put into that, so what other processes have written
+        is kept. The changes are also kept for getConfChanges().'''
+
+        changes = self.confDiff(config.loadedData, config.dict())
+        if not changes :
+            return True
+        confChanges['files'].setdefault(config.filename, []).extend(changes)
+
+        with self.trace.span('writeConfFile', {'file' : os.path.basename(config.filename)}) :
+            lockObject = open(config.filename, 'a')
+            fcntl.flock(lockObject, fcntl.LOCK_EX)
+            try :
+                current = ConfigObj(config.filename, encoding='utf-8')
+                self.applyConfChanges(current, changes)
+                self.buildConfSection(current, 'GeneralSettings')
+                current['GeneralSettings']['lastEdit'] = self.tStamp()
+                current.write()
+            finally :
+                fcntl.flock(lockObject, fcntl.LOCK_UN)
+                lockObject.close()
+
+        config.loadedData = config.dict()
+        return True
+
+
+    def confDiff (self, old, new, path = ()) :
+        '''Return a list of the changes that will turn one config dictionary
+        into another. Each change is (path, value, removed) where the path
+        is a tuple of the section names and the key.'''
+
+        changes = []
+        for key in new.keys() :
+            if isinstance(new[key], dict) and isinstance(old.get(key), dict) :
+                changes.extend(self.confDiff(old[key], new[key], path + (key,)))
+            elif not old.has_key(key) or old[key] != new[key] :
+                changes.append((path + (key,), new[key], False))
+        for key in old.keys() :
+            if not new.has_key(key) :
+                changes.append((path + (key,), None, True))
+
+        return changes
+
+
+    def applyConfChanges (self, config, changes) :
+        '''Make the changes from confDiff() to a config object.'''
+
+        for (path, value, removed) in changes :
+            section = config
+            for key in path[:-1] :
+                if not isinstance(section.get(key), dict) :
+                    # Nothing to take out of a section that is not there
+                    if removed :
+                        section = None
+                        break
+                    section[key] = {}
+                section = section[key]
+            if removed :
+                if section and section.has_key(path[-1]) :
+                    del section[path[-1]]
+            else :
+                section[path[-1]] = value
+
+
     def xml_to_section (self, xmlFile) :
         '''Read in our default settings from the XML system settings file'''
 
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# This class keeps an index of where things are in a USFM working text. The
+# byte offset of every \c, \v, \s, \fig and \f marker is recorded along with
+# the chapter and verse it falls in. The index is kept in arrays and saved
+# beside the working text (<cid>_base.usfm.idx) so it does not need to be
+# made again until the text changes. With it, finding a reference, pulling
+# out a range of verses or counting things can be done without reading
+# through the whole text. It is used to cut out the text for a reference
+# render (see Usfm.makeSlice()) and, on import, to find the verse a \fig
+# marker is in (see ProjSetup.logFigure()).
+
+
+###############################################################################
+################################ Component Class ##############################
+###############################################################################
+# Firstly, import all the standard Python modules we need for
+# this process
+
+import os, re, struct, codecs
+from array                      import array
+from bisect                     import bisect_left, bisect_right
+
+
+class UsfmIndex (object) :
+
+    # The markers we keep track of, the position in the list is the
+    # number that is stored for it in the index
+    markerKinds     = ['c', 'v', 's', 'fig', 'f']
+    markerRegex     = re.compile(r'\\(c|v|s[0-9]?|fig|f)(?=\s)(?:\s+([0-9]+))?')
+    # File header, format version, the size and time of the text that
+    # was indexed and the number of entries
+    indexMagic      = 'RPIX'
+    indexVersion    = 1
+    headerFormat    = '<4sHQdI'
+
+    def __init__(self, workingFile = None) :
+        '''Do the primary initialization for this class. The index file
+        sits beside the working text. With no working text, a text can
+        still be indexed in memory (see build()).'''
+
+        self.workingFile            = workingFile
+        self.indexFile              = workingFile and workingFile + '.idx'
+        self.kinds                  = array('B')
+        self.offsets                = array('I')
+        self.chapters               = array('H')
+        self.verses                 = array('H')
+        # Made from the above when the index is loaded
+        self.refKeys                = array('I')
+        self.refOffsets             = array('I')
+
+
+###############################################################################
+############################### Index Functions ###############################
+###############################################################################
+
+    def getIndex (self) :
+        '''Load the index, making it again first if it is not there or the
+        working text has changed since it was made. Return False if there
+        is no working text.'''
+
+        if not os.path.isfile(self.workingFile) :
+            return False
+        if not self.loadIndex() :
+            return self.build()
+
+        return True
+
+
+    def build (self, text = None) :
+        '''Read through the working text and record where every marker
+        we are interested in is, then save the index. If a text is given
+        it is indexed instead, the offsets are then into that text and
+        nothing is saved.'''
+
+        if text == None :
+            with open(self.workingFile, 'rb') as textObject :
+                data = textObject.read()
+        else :
+            data = text
+
+        self.kinds = array('B')
+        self.offsets = array('I')
+        self.chapters = array('H')
+        self.verses = array('H')
+        chap = verse = 0
+        for m in self.markerRegex.finditer(data) :
+            kind = m.group(1)
+            if kind.startswith('s') and kind != 's' :
+                kind = 's'
+            if kind == 'c' and m.group(2) :
+                chap = int(m.group(2))
+                verse = 0
+            elif kind == 'v' and m.group(2) :
+                verse = int(m.group(2))
+            self.kinds.append(self.markerKinds.index(kind))
+            self.offsets.append(m.start())
+            self.chapters.append(min(chap, 0xFFFF))
+            self.verses.append(min(verse, 0xFFFF))
+
+        self.makeRefKeys()
+        if text == None :
+            self.storeIndex()
+
+        return True
+
+
+    def refresh (self) :
+        '''Make the index again if there is one for the working text. This
+        is for after the text has been changed in place.'''
+
+        if os.path.isfile(self.indexFile) and os.path.isfile(self.workingFile) :
+            return self.build()
+
+        return False
+
+
+    def loadIndex (self) :
+        '''Read in a saved index. Return False if it is not there, cannot
+        be read or is out of date.'''
+
+        if not os.path.isfile(self.indexFile) :
+            return False
+        stat = os.stat(self.workingFile)
+        try :
+            with open(self.indexFile, 'rb') as indexObject :
+                header = indexObject.read(struct.calcsize(self.headerFormat))
+                (magic, version, size, mtime, count) = struct.unpack(self.headerFormat, header)
+                if magic != self.indexMagic or version != self.indexVersion :
+                    return False
+                if size != stat.st_size or mtime != stat.st_mtime :
+                    return False
+                kinds = array('B')
+                offsets = array('I')
+                chapters = array('H')
+                verses = array('H')
+                for a in [kinds, offsets, chapters, verses] :
+                    a.fromfile(indexObject, count)
+        except (IOError, EOFError, struct.error) :
+            return False
+
+        (self.kinds, self.offsets, self.chapters, self.verses) = (kinds, offsets, chapters, verses)
+        self.makeRefKeys()
+
+        return True
+
+
+    def storeIndex (self) :
+        '''Save the index beside the working text. This goes to a temporary
+        file first so no one will ever read a part written one.'''
+
+        stat = os.stat(self.workingFile)
+        tmpFile = self.indexFile + '.' + str(os.getpid())
+        try :
+            with open(tmpFile, 'wb') as indexObject :
+                indexObject.write(struct.pack(self.headerFormat, self.indexMagic, self.indexVersion,
+                    stat.st_size, stat.st_mtime, len(self.offsets)))
+                for a in [self.kinds, self.offsets, self.chapters, self.verses] :
+                    a.tofile(indexObject)
+            os.rename(tmpFile, self.indexFile)
+            return True
+        except (IOError, OSError) :
+            if os.path.isfile(tmpFile) :
+                os.remove(tmpFile)
+            return False
+
+
+    def makeRefKeys (self) :
+        '''Make a sorted list of chapter:verse keys (with the offset each
+        one starts at) from the \c and \v entries, for looking up
+        references.'''
+
+        pairs = []
+        for i in range(len(self.kinds)) :
+            if self.kinds[i] <= 1 :
+                pairs.append((self.refKey(self.chapters[i], self.verses[i]), self.offsets[i]))
+        # The first place a reference is found is the one we want
+        pairs.sort()
+        self.refKeys = array('I')
+        self.refOffsets = array('I')
+        for (key, offset) in pairs :
+            if not self.refKeys or self.refKeys[-1] != key :
+                self.refKeys.append(key)
+                self.refOffsets.append(offset)
+
+
+    def refKey (self, chapter, verse) :
+        '''Return a single number that sorts in chapter:verse order.'''
+
+        return (int(chapter) << 16) + int(verse)
+
+
+###############################################################################
+############################### Lookup Functions ##############################
+###############################################################################
+
+    def getRefAt (self, offset) :
+        '''Return the (chapter, verse) a byte offset in the text is in.
+        Zero is returned for either if it comes before the first one.'''
+
+        i = bisect_right(self.offsets, offset) - 1
+        if i < 0 :
+            return (0, 0)
+
+        return (self.chapters[i], self.verses[i])
+
+
+    def getOffset (self, chapter, verse = 0) :
+        '''Return the byte offset a reference starts at. Verse 0 is the
+        chapter marker. Return None if it is not in the text.'''
+
+        key = self.refKey(chapter, verse)
+        i = bisect_left(self.refKeys, key)
+        if i < len(self.refKeys) and self.refKeys[i] == key :
+            return self.refOffsets[i]
+
+
+    def getRange (self, startChapter, startVerse, endChapter, endVerse) :
+        '''Return the (start, end) byte offsets of a range of references.
+        The end is where whatever follows the last verse starts (or the
+        end of the text). Return None if the start is not in the text.'''
+
+        start = self.getOffset(startChapter, startVerse)
+        if start == None :
+            return None
+        # Find the next reference after the end of the range
+        i = bisect_right(self.refKeys, self.refKey(endChapter, endVerse))
+        if endVerse == 0 :
+            # The whole chapter was asked for
+            i = bisect_left(self.refKeys, self.refKey(int(endChapter) + 1, 0))
+        if i < len(self.refKeys) :
+            end = self.refOffsets[i]
+        else :
+            end = os.path.getsize(self.workingFile)
+
+        return (start, max(start, end))
+
+
+    def getVerses (self, chapter) :
+        '''Return a list of (verse, offset) for the verses in a chapter,
+        in verse order.'''
+
+        first = bisect_left(self.refKeys, self.refKey(chapter, 1))
+        last = bisect_left(self.refKeys, self.refKey(int(chapter) + 1, 0))
+
+        return [(self.refKeys[i] & 0xFFFF, self.refOffsets[i]) for i in range(first, last)]
+
+
+    def getText (self, startChapter, startVerse, endChapter = None, endVerse = None) :
+        '''Return the text of a reference, or range of references, as
+        unicode. Return None if it is not in the text.'''
+
+        if endChapter == None :
+            (endChapter, endVerse) = (startChapter, startVerse)
+        textRange = self.getRange(startChapter, startVerse, endChapter, endVerse or 0)
+        if not textRange :
+            return None
+        with open(self.workingFile, 'rb') as textObject :
+            textObject.seek(textRange[0])
+            data = textObject.read(textRange[1] - textRange[0])
+
+        return codecs.decode(data, 'utf_8', 'replace')
+
+
+    def getMarkerCounts (self, chapter = None) :
+        '''Return a dictionary with the number of each kind of marker found
+        in the text, or just in one chapter.'''
+
+        counts = dict([(kind, 0) for kind in self.markerKinds])
+        if chapter == None :
+            (first, last) = (0, len(self.kinds))
+        else :
+            first = bisect_left(self.refKeys, self.refKey(chapter, 0))
+            if first == len(self.refKeys) or (self.refKeys[first] >> 16) != int(chapter) :
+                return counts
+            (first, last) = (bisect_left(self.offsets, self.refOffsets[first]), len(self.kinds))
+            nextChapter = bisect_left(self.refKeys, self.refKey(int(chapter) + 1, 0))
+            if nextChapter < len(self.refKeys) :
+                last = bisect_left(self.offsets, self.refOffsets[nextChapter])
+        for i in range(first, last) :
+            counts[self.markerKinds[self.kinds[i]]] += 1
+
+        return counts
+
+
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# This class will read through a XeTeX log file and pick out the things that
+# are worth looking at after a render, like overfull and underfull boxes,
+# missing characters and font problems. Each one is tied back to the
+# component (and chapter:verse if it can be worked out) it came from.
+
+
+###############################################################################
+################################ Component Class ##############################
+###############################################################################
+# Firstly, import all the standard Python modules we need for
+# this process
+
+import os, re, codecs
+
+
+class XetexLog (object) :
+
+    # TeX wraps its log lines at this many characters
+    maxPrintLine    = 79
+
+    # Classes of things we look for, the first one that matches wins
+    warningTypes    = [
+        ('overfullHbox',        re.compile(r'^Overfull \\hbox \((.+?)pt too wide\).*?lines? (\d+)')),
+        ('underfullHbox',       re.compile(r'^Underfull \\hbox \(badness (\d+)\).*?lines? (\d+)')),
+        ('overfullVbox',        re.compile(r'^Overfull \\vbox \((.+?)pt too high\)(?:.*?lines? (\d+))?')),
+        ('underfullVbox',       re.compile(r'^Underfull \\vbox \(badness (\d+)\)(?:.*?lines? (\d+))?')),
+        ('missingCharacter',    re.compile(r'^Missing character: There is no (.+?) in font (.+?)!')),
+        ('fontNotLoadable',     re.compile(r'^! Font (\S+) not loadable')),
+        ('fontSubstitution',    re.compile(r'(?i)^.*font.*(?:substitut|instead)')),
+        ('error',               re.compile(r'^! (.+)')),
+        ('warning',             re.compile(r'(?i)^.*warning[:!]'))
+    ]
+    fileOpen        = re.compile(r'\(([^\s()]+\.[A-Za-z0-9]+)')
+    # Written to the log as the first page of each cid is shipped out
+    pageMark        = re.compile(r'^RapumaCidStart:(\S+):(-?\d+)')
+    # Written to the log at a page break in a chunk render, how far down
+    # the page the text came, how far it could have gone and the line height
+    pageFill        = re.compile(r'^RapumaPageFill:(-?[0-9.]+)pt:(-?[0-9.]+)pt:(-?[0-9.]+)pt')
+    lineNumber      = re.compile(r'^l\.(\d+) ')
+    # A box display after a box warning ends at a blank line. If the log
+    # stops before that (or something else is written in the middle of it)
+    # these end it, it is never more than so many lines long anyway
+    boxEnd          = re.compile(r'^(?:(?:Overfull|Underfull) \\[hv]box|Missing character: |! )')
+    maxBoxLines     = 100
+
+    def __init__(self, cidFiles) :
+        '''Do the primary initialization for this parser. The cidFiles
+        dict maps the working text file names to their cids and
+        full paths, {fileName : (cid, path)}.'''
+
+        self.cidFiles           = cidFiles
+        self.fileStack          = []
+        self.items              = []
+        self.refIndexes         = {}
+        self.skipBoxLines       = 0
+        self.lastError          = None
+        self.pageMarks          = {}
+        self.lastPageFill       = None
+
+
+###############################################################################
+############################### Parsing Functions #############################
+###############################################################################
+
+    def parseFile (self, logFile) :
+        '''Read a log file, one line at a time, through the parser.'''
+
+        if not os.path.isfile(logFile) :
+            return False
+        with codecs.open(logFile, 'r', encoding='utf_8', errors='replace') as logObject :
+            for line in self.unwrapLines(logObject) :
+                self.parseLine(line)
+        return True
+
+
+    def unwrapLines (self, lines) :
+        '''Put back together lines that TeX has wrapped.'''
+
+        held = ''
+        for line in lines :
+            line = line.rstrip('\r\n')
+            held = held + line
+            if len(line) != self.maxPrintLine :
+                yield held
+                held = ''
+        if held :
+            yield held
+
+
+    def parseLine (self, line) :
+        '''Look at one (unwrapped) log line.'''
+
+        m = self.pageMark.match(line)
+        if m :
+            self.pageMarks[m.group(1)] = int(m.group(2))
+            self.skipBoxLines = 0
+            return
+        m = self.pageFill.match(line)
+        if m :
+            self.lastPageFill = [float(m.group(1)), float(m.group(2)), float(m.group(3))]
+            self.skipBoxLines = 0
+            return
+
+        # After a box warning TeX shows what was in the box, down to a blank
+        # line. Text in there can have anything in it so we skip all that.
+        if self.skipBoxLines :
+            if not line.strip() :
+                self.skipBoxLines = 0
+                return
+            if not self.boxEnd.match(line) :
+                self.skipBoxLines -= 1
+                return
+            self.skipBoxLines = 0
+
+        # The line number of an error comes a little after the error itself
+        if self.lastError :
+            m = self.lineNumber.match(line)
+            if m :
+                self.lastError['line'] = int(m.group(1))
+                self.lastError['ref'] = self.getRef(self.lastError['path'], int(m.group(1)))
+                self.lastError = None
+                return
+
+        for (wClass, regex) in self.warningTypes :
+            m = regex.match(line)
+            if m :
+                self.addItem(wClass, line, m)
+                if wClass.endswith('Hbox') or wClass.endswith('Vbox') :
+                    self.skipBoxLines = self.maxBoxLines
+                return
+
+        # Anything else could be opening or closing files
+        self.trackFiles(line)
+
+
+    def trackFiles (self, line) :
+        '''Keep track of what file TeX is in. Files are opened with a "("
+        in front of the name and closed with a ")". Any other kind of
+        parenthesis is only kept track of to the end of the line, so one
+        that is never closed cannot pile up.'''
+
+        pos = 0
+        # What each "(" opened on this line is, True for a file
+        opened = []
+        while pos < len(line) :
+            c = line[pos]
+            if c == '(' :
+                m = self.fileOpen.match(line, pos)
+                if m :
+                    self.fileStack.append(m.group(1))
+                    opened.append(True)
+                    pos = m.end()
+                    continue
+                # Some other kind of parenthesis
+                opened.append(False)
+            elif c == ')' :
+                if (not opened or opened.pop()) and self.fileStack :
+                    self.fileStack.pop()
+            pos += 1
+
+
+    def addItem (self, wClass, line, match) :
+        '''Record something that was found.'''
+
+        (cid, path) = self.currentCid()
+        lineNo = None
+        if wClass in ['overfullHbox', 'underfullHbox'] :
+            lineNo = int(match.group(2))
+        elif wClass in ['overfullVbox', 'underfullVbox'] and match.group(2) :
+            lineNo = int(match.group(2))
+        item = {
+            'class'     : wClass,
+            'cid'       : cid,
+            'file'      : self.currentFile(),
+            'line'      : lineNo,
+            'ref'       : self.getRef(path, lineNo),
+            'message'   : line.strip(),
+            'path'      : path
+        }
+        self.items.append(item)
+        if wClass in ['error', 'fontNotLoadable'] :
+            self.lastError = item
+
+
+    def currentFile (self) :
+        '''Return the name of the file TeX is working in.'''
+
+        for f in reversed(self.fileStack) :
+            if f :
+                return os.path.basename(f)
+
+
+    def currentCid (self) :
+        '''Return the cid (and working text path) of the nearest
+        working text file TeX has open.'''
+
+        for f in reversed(self.fileStack) :
+            if f and self.cidFiles.has_key(os.path.basename(f)) :
+                return self.cidFiles[os.path.basename(f)]
+        return (None, None)
+
+
+    def getRef (self, path, lineNo) :
+        '''Return the chapter:verse for a line in a working text.'''
+
+        if not path or not lineNo :
+            return
+        if not self.refIndexes.has_key(path) :
+            self.refIndexes[path] = self.makeRefIndex(path)
+        index = self.refIndexes[path]
+        if 0 < lineNo <= len(index) :
+            return index[lineNo - 1]
+
+
+    def makeRefIndex (self, path) :
+        '''Make a list of the chapter:verse we are in at the end of each
+        line of a USFM file.'''
+
+        index = []
+        chap = verse = None
+        cvRegex = re.compile(r'\\([cv])\s+(\d+[-\w]*)')
+        try :
+            with codecs.open(path, 'r', encoding='utf_8_sig', errors='replace') as usfmObject :
+                for line in usfmObject :
+                    for (marker, num) in cvRegex.findall(line) :
+                        if marker == 'c' :
+                            chap = num
+                            verse = None
+                        else :
+                            verse = num
+                    if chap and verse :
+                        index.append(chap + ':' + verse)
+                    else :
+                        index.append(chap)
+        except IOError :
+            pass
+        return index
+
+
+###############################################################################
+############################### Output Functions ##############################
+###############################################################################
+
+    def getIndex (self) :
+        '''Return the findings grouped by cid with a count of each class.
+        Things that could not be tied to a cid are filed under "-".'''
+
+        index = {}
+        for item in self.items :
+            cid = item['cid'] or '-'
+            entry = index.setdefault(cid, {'counts' : {}, 'items' : []})
+            entry['counts'][item['class']] = entry['counts'].get(item['class'], 0) + 1
+            entry['items'].append(dict([(k, v) for (k, v) in item.items() if k not in ['cid', 'path']]))
+        return index
+
+
+    def getPageMarks (self) :
+        '''Return the page number each cid started on, {cid : page}.'''
+
+        return dict(self.pageMarks)
+
+
+    def getPageFill (self) :
+        '''Return how full the page was at the last page break that was
+        noted, [total, goal, line height] in points, or None.'''
+
+        return self.lastPageFill
+
+
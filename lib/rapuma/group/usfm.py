@@ -22,6 +22,8 @@ from configobj import ConfigObj, Section
 
 # Load the local classes
 from rapuma.core.tools                  import Tools
+from rapuma.core.proj_trace             import ProjTrace
+from rapuma.core.usfm_index             import UsfmIndex
 from rapuma.group.group                 import Group
 from rapuma.project.proj_font           import ProjFont
 from rapuma.project.proj_illustration   import ProjIllustration
@@ -56,6 +58,7 @@ class Usfm (Group) :
         self.project                = project
         self.local                  = project.local
         self.tools                  = Tools()
+        self.trace                  = ProjTrace(project.pid)
         self.proj_font              = ProjFont(self.pid)
         self.proj_illustration      = ProjIllustration(self.pid, self.gid)
         self.proj_config            = Config(self.pid, self.gid)
@@ -88,6 +91,8 @@ class Usfm (Group) :
         self.gidFolder              = os.path.join(self.projComponentFolder, self.gid)
         # File names with folder paths
         self.rapumaXmlCompConfig    = os.path.join(self.project.local.rapumaConfigFolder, self.xmlConfFile)
+        # Working text slices that stand in for whole cids (see makeSlice())
+        self.slices                 = {}
 
 
 
@@ -126,7 +131,12 @@ class Usfm (Group) :
             '0255' : ['LOG', 'Illustrations not being used. The piclist file has been removed from the [<<1>>] illustrations folder.'],
             '0260' : ['LOG', 'Piclist file for [<<1>>] has been created.'],
             '0265' : ['ERR', 'Failed to create piclist file for [<<1>>]!'],
-            '0300' : ['ERR', 'One or more illustration files are missing from the project. Please import these files before continuing.']
+            '0300' : ['ERR', 'One or more illustration files are missing from the project. Please import these files before continuing.'],
+
+            '0510' : ['ERR', 'Scripture reference [<<1>>] not understood. It should look like: MAT 5, MAT 5-7, MAT 5:3-12 or MAT 5:3-7:10'],
+            '0520' : ['ERR', 'The book in reference [<<1>>] is not a component in the [<<2>>] group.'],
+            '0530' : ['ERR', 'Could not find [<<1>>] in: [<<2>>]'],
+            '0540' : ['MSG', 'Rendering [<<1>>] from a slice of the [<<2>>] working text.']
         }
 
 
@@ -156,6 +166,8 @@ class Usfm (Group) :
         '''Return the full path of the cName working text file. This assumes
         the cid is valid.'''
 
+        if self.slices.has_key(cid) :
+            return self.slices[cid]
         return os.path.join(self.local.projComponentFolder, cid, self.makeFileNameWithExt(cid))
 
 
@@ -180,15 +192,34 @@ class Usfm (Group) :
         else :
             cids = cidList
 
-        # Preprocess all subcomponents (one or more)
-        # Stop if it breaks at any point
-        for cid in cids :
-            if not self.preProcessGroup(gid, [cid]) :
-                return False
+        # For a scripture reference only the one cid is needed
+        ref = None
+        if self.project.renderRef :
+            ref = self.parseRef(gid, self.project.renderRef)
+            cids = cidList = [ref[0]]
+
+        with self.trace.span('usfmRender', {'gid' : gid}) :
+
+            # Preprocess all subcomponents (one or more), or just the ones
+            # that have changed if we were told which (see watchGroup())
+            if self.project.preprocessCids != None :
+                cids = [cid for cid in cids if cid in self.project.preprocessCids]
+
+            # Stop if it breaks at any point
+            with self.trace.span('preprocess', {'gid' : gid}) :
+                for cid in cids :
+                    if not self.preProcessGroup(gid, [cid]) :
+                        return False
+
+            # The slice is cut from the working text after it has been preprocessed
+            if ref :
+                with self.trace.span('slice', {'ref' : self.project.renderRef}) :
+                    self.makeSlice(ref)
 
-        # With everything in place we can render the component.
-        # Note: We pass the cidList straight through
-        self.project.managers['usfm_' + self.renderer.capitalize()].run(gid, cidList, pages, override, save)
+            # With everything in place we can render the component.
+            # Note: We pass the cidList straight through
+            with self.trace.span('rendererRun', {'gid' : gid, 'renderer' : self.renderer}) :
+                self.project.managers['usfm_' + self.renderer.capitalize()].run(gid, cidList, pages, override, save)
 
         return True
 
@@ -217,45 +248,47 @@ class Usfm (Group) :
 
 # FIXME: Some changes may be needed here to guide creation of adjustment files
             # Component adjustment file
-            cidAdjFile = self.getCidAdjPath(cid)
-            if useManualAdjustments :
-                self.createCompAdjustmentFile(cid)
-            else :
-                # If no adjustments, remove any exsiting file
-                if os.path.isfile(cidAdjFile) :
-                    os.remove(cidAdjFile)
+            with self.trace.span('adjustments', {'cid' : cid}) :
+                cidAdjFile = self.getCidAdjPath(cid)
+                if useManualAdjustments :
+                    self.createCompAdjustmentFile(cid)
+                else :
+                    # If no adjustments, remove any exsiting file
+                    if os.path.isfile(cidAdjFile) :
+                        os.remove(cidAdjFile)
             # Component piclist file
-            cidPiclistFile = self.proj_illustration.getCidPiclistFile(cid)
-            if useIllustrations :
-                if self.proj_illustration.hasIllustrations(cid) :
-                    # Check for missing illustrations (die here if not found)
-                    if self.proj_illustration.missingIllustrations(cid) :
-                        self.log.writeToLog(self.errorCodes['0300'])
-                    # Create piclist file if not there or if the config has changed
-                    if not os.path.isfile(cidPiclistFile) or self.tools.isOlder(cidPiclistFile, self.local.illustrationConfFile) :
-                        # Now make a fresh version of the piclist file
-                        if self.proj_illustration.createPiclistFile(cid) :
-                            self.log.writeToLog(self.errorCodes['0260'], [cid])
+            with self.trace.span('piclist', {'cid' : cid}) :
+                cidPiclistFile = self.proj_illustration.getCidPiclistFile(cid)
+                if useIllustrations :
+                    if self.proj_illustration.hasIllustrations(cid) :
+                        # Check for missing illustrations (die here if not found)
+                        if self.proj_illustration.missingIllustrations(cid) :
+                            self.log.writeToLog(self.errorCodes['0300'])
+                        # Create piclist file if not there or if the config has changed
+                        if not os.path.isfile(cidPiclistFile) or self.tools.isOlder(cidPiclistFile, self.local.illustrationConfFile) :
+                            # Now make a fresh version of the piclist file
+                            if self.proj_illustration.createPiclistFile(cid) :
+                                self.log.writeToLog(self.errorCodes['0260'], [cid])
+                            else :
+                                self.log.writeToLog(self.errorCodes['0265'], [cid])
                         else :
-                            self.log.writeToLog(self.errorCodes['0265'], [cid])
+                            for f in [self.local.layoutConfFile, self.local.illustrationConfFile] :
+                                if self.tools.isOlder(cidPiclistFile, f) or not os.path.isfile(cidPiclistFile) :
+                                    # Remake the piclist file
+                                    if self.proj_illustration.createPiclistFile(cid) :
+                                        self.log.writeToLog(self.errorCodes['0260'], [cid])
+                                    else :
+                                        self.log.writeToLog(self.errorCodes['0265'], [cid])
                     else :
-                        for f in [self.local.layoutConfFile, self.local.illustrationConfFile] :
-                            if self.tools.isOlder(cidPiclistFile, f) or not os.path.isfile(cidPiclistFile) :
-                                # Remake the piclist file
-                                if self.proj_illustration.createPiclistFile(cid) :
-                                    self.log.writeToLog(self.errorCodes['0260'], [cid])
-                                else :
-                                    self.log.writeToLog(self.errorCodes['0265'], [cid])
+                        # Does not seem to be any illustrations for this cid
+                        # clean out any piclist file that might be there
+                        if os.path.isfile(cidPiclistFile) :
+                            os.remove(cidPiclistFile)
                 else :
-                    # Does not seem to be any illustrations for this cid
-                    # clean out any piclist file that might be there
+                    # If we are not using illustrations then any existing piclist file will be removed
                     if os.path.isfile(cidPiclistFile) :
                         os.remove(cidPiclistFile)
-            else :
-                # If we are not using illustrations then any existing piclist file will be removed
-                if os.path.isfile(cidPiclistFile) :
-                    os.remove(cidPiclistFile)
-                    self.log.writeToLog(self.errorCodes['0255'], [cid])
+                        self.log.writeToLog(self.errorCodes['0255'], [cid])
 
         # Any more stuff to run?
 
@@ -380,6 +413,182 @@ class Usfm (Group) :
         return True
 
 
+###############################################################################
+############################# USFM Slice Functions ############################
+###############################################################################
+######################## Error Code Block Series = 0500 #######################
+###############################################################################
+
+    def parseRef (self, gid, ref) :
+        '''Take a scripture reference like "MAT 5-7" or "MAT 5:3-7:10"
+        and return (cid, startChap, startVerse, endChap, endVerse). The
+        verses are None when whole chapters are wanted.'''
+
+        m = re.match(r'^\s*(\w{3})\s+(\d+)(?::(\d+))?(?:\s*-\s*(\d+)(?::(\d+))?)?\s*$', ref)
+        if not m :
+            self.log.writeToLog(self.errorCodes['0510'], [ref])
+            return None
+        (book, sc, sv, ec, ev) = m.groups()
+        cid = book.lower()
+        if cid not in self.projectConfig['Groups'][gid]['cidList'] :
+            self.log.writeToLog(self.errorCodes['0520'], [ref, gid])
+            return None
+        sc = int(sc)
+        sv = sv and int(sv)
+        if not ec :
+            # Just one chapter or verse
+            (ec, ev) = (sc, sv)
+        elif sv and not ev :
+            # MAT 5:3-12, the end is a verse in the same chapter
+            (ec, ev) = (sc, int(ec))
+        else :
+            ec = int(ec)
+            ev = ev and int(ev)
+
+        return (cid, sc, sv, ec, ev)
+
+
+    def makeSlice (self, ref) :
+        '''Cut the part of a cid working text given in the ref (see
+        parseRef()) out into a slice working text and use it in place of
+        the whole thing. The book headers (everything before the
+        introduction or first chapter) are kept. The adjustment and
+        piclist files are copied along with it so TeX will find them.
+        Where the chapters and verses are is looked up in the working
+        text index (see UsfmIndex).'''
+
+        (cid, sc, sv, ec, ev) = ref
+        source = os.path.join(self.local.projComponentFolder, cid, self.makeFileNameWithExt(cid))
+        usfmIndex = UsfmIndex(source)
+        if not usfmIndex.getIndex() :
+            self.log.writeToLog(self.errorCodes['0530'], [self.project.renderRef, self.tools.fName(source)])
+            return False
+        with open(source, 'rb') as sourceObject :
+            data = sourceObject.read()
+        headEnd = len(data)
+        head = re.search(r'\\(c|imt\d?|is\d?|ip|ipi|im|imi|ipq|imq|ipr|iq\d?|ib|ili\d?|iot|io\d?|iex|imte\d?|ie)\b', data)
+        if head :
+            headEnd = head.start()
+        verseMarker = re.compile(r'\\v\s+(\d+)(?:-(\d+))?')
+
+        def text (start, end) :
+            '''Return part of the working text as unicode.'''
+            return codecs.decode(data[start:end], 'utf_8')
+
+        def chapterSpan (num) :
+            '''Return the start and end of a chapter in the text.'''
+            return usfmIndex.getRange(num, 0, num, 0)
+
+        def versePos (span, chapter, num, after) :
+            '''Return where the first verse in a chapter that ends at or
+            after num starts (or begins after num if after is True).'''
+            for (lo, pos) in usfmIndex.getVerses(chapter) :
+                v = verseMarker.match(data, pos)
+                hi = int(v and v.group(2) or lo)
+                if (after and lo > num) or (not after and hi >= num) :
+                    return pos
+            if after :
+                return span[1]
+
+        startSpan = chapterSpan(sc)
+        endSpan = chapterSpan(ec)
+        if not startSpan or not endSpan :
+            self.log.writeToLog(self.errorCodes['0530'], [self.project.renderRef, self.tools.fName(source)])
+            return False
+
+        # Starting part way into a chapter needs the chapter number and a
+        # paragraph marker (the one the verse is in) to start it off
+        lead = ''
+        start = startSpan[0]
+        if sv and sv > 1 :
+            start = versePos(startSpan, sc, sv, False)
+            if start == None :
+                self.log.writeToLog(self.errorCodes['0530'], [self.project.renderRef, self.tools.fName(source)])
+                return False
+            paras = re.findall(r'\\(p|m|nb|pi\d?|mi|pmo|q\d?|qm\d?|li\d?)\s', text(startSpan[0], start))
+            lead = '\\c ' + str(sc) + '\n\\' + (paras and paras[-1] or 'p') + '\n'
+        end = endSpan[1]
+        if ev :
+            end = versePos(endSpan, ec, ev, True)
+        # Do not leave an empty paragraph at the end
+        body = re.sub(r'(\s*\\(p|m|nb|pi\d?|mi|pmo|q\d?|qm\d?|li\d?|b))+\s*$', '', text(start, end))
+
+        # Write out the slice and the files that go with it
+        sliceFolder = os.path.join(self.local.projComponentFolder, cid, 'Slice')
+        target = os.path.join(sliceFolder, self.makeFileNameWithExt(cid))
+        self.writeSliceFiles(cid, target, text(0, headEnd).rstrip() + '\n' + lead + body.rstrip() + '\n',
+            (sc, sv or 0), (ec, ev or 999))
+
+        self.slices[cid] = target
+        self.log.writeToLog(self.errorCodes['0540'], [self.project.renderRef, cid])
+        return True
+
+
+    def makeChunks (self, cid, chapters) :
+        '''Split a cid working text with more than the given number of
+        chapters into chunks of about that many chapters each, so they
+        can be rendered separately. The first chunk has everything that
+        comes before the first chapter, the rest only get the book ID and
+        running header lines (no titles or introduction). Return a list
+        of the chunk working text files, empty if it was not split.'''
+
+        source = self.getCidPath(cid)
+        with codecs.open(source, 'r', encoding='utf_8') as sourceObject :
+            text = sourceObject.read()
+        starts = [(int(c.group(1)), c.start()) for c in re.finditer(r'\\c\s+(\d+)', text)]
+        if chapters < 1 or len(starts) <= chapters :
+            return []
+
+        # Spread the chapters out evenly over the chunks
+        count = (len(starts) + chapters - 1) / chapters
+        size = (len(starts) + count - 1) / count
+        heads = [l for l in text[:starts[0][1]].splitlines() if re.match(r'\s*\\(id|ide|h\d?|toc\d?|rem|usfm|sts)\b', l)]
+        chunkFolder = os.path.join(self.local.projComponentFolder, cid, 'Chunk')
+        chunks = []
+        for i in range(0, len(starts), size) :
+            end = len(text)
+            last = starts[-1][0]
+            if i + size < len(starts) :
+                end = starts[i + size][1]
+                last = starts[i + size - 1][0]
+            if i == 0 :
+                chunkText = text[:end]
+            else :
+                chunkText = '\n'.join(heads) + '\n' + text[starts[i][1]:end]
+            target = os.path.join(chunkFolder, self.makeFileName(cid) + '-' + str(len(chunks) + 1) + '.' + self.cType)
+            self.writeSliceFiles(cid, target, chunkText.rstrip() + '\n', (starts[i][0] if i else 0, 0), (last, 999))
+            chunks.append(target)
+
+        return chunks
+
+
+    def writeSliceFiles (self, cid, target, text, first, last) :
+        '''Write out a slice of a working text along with its own copies
+        of the adjustment and piclist files. These are read in order by
+        the macros so only entries from first to last (chapter, verse)
+        are kept, anything else would hold up the ones after it.'''
+
+        if not os.path.isdir(os.path.dirname(target)) :
+            os.makedirs(os.path.dirname(target))
+        with codecs.open(target, 'w', encoding='utf_8') as sliceObject :
+            sliceObject.write(text)
+        refRegex = re.compile(r'^\s*\w{3}\s+(\d+)\.(\d+)')
+        for (f, ext) in [(self.getCidAdjPath(cid), '.adj'), (self.proj_illustration.getCidPiclistFile(cid), '.piclist')] :
+            sliceFile = target + ext
+            if not os.path.isfile(f) :
+                if os.path.isfile(sliceFile) :
+                    os.remove(sliceFile)
+                continue
+            with codecs.open(f, 'r', encoding='utf_8') as refObject :
+                lines = refObject.readlines()
+            with codecs.open(sliceFile, 'w', encoding='utf_8') as sliceObject :
+                for line in lines :
+                    m = refRegex.match(line)
+                    if m and not first <= (int(m.group(1)), int(m.group(2))) <= last :
+                        continue
+                    sliceObject.write(line)
+
+
 ###############################################################################
 ######################## USFM Component Text Functions ########################
 ###############################################################################
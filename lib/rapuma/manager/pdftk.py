@@ -18,7 +18,6 @@
 
 import os, shutil, re, codecs, subprocess
 from configobj                          import ConfigObj
-from pyPdf                              import PdfFileReader
 
 # Load the local classes
 from rapuma.core.tools                  import Tools
@@ -147,21 +146,24 @@ class Pdftk (Manager) :
         # Make a list of files that pdftk will merge together
         sourceList = self.sourceListFromCidList(cidList)
                 
-        # Merge the files
+        # Merge the files (pdftk writes into the file, it could be linked to a saved copy)
         cmd = ['pdftk'] + sourceList + ['cat', 'output', self.local.gidPdfFile]
+        self.tools.unshareFile(self.local.gidPdfFile)
 
 #        import pdb; pdb.set_trace()
 
         # No return from pdftk is good, we can continue on
         if not subprocess.call(cmd) : 
             # Collect the page count and record in group (Write out at the end of the opp.)
-            self.projectConfig['Groups'][gid]['totalPages'] = str(PdfFileReader(open(self.local.gidPdfFile)).getNumPages())
+            self.projectConfig['Groups'][gid]['totalPages'] = str(self.tools.pdfTotalPages(self.local.gidPdfFile))
             # Write out any changes made to the project.conf file that happened during this opp.
             self.tools.writeConfFile(self.projectConfig)
 
-            # Pull out pages if requested (use the same file for output)
+            # Pull out pages if requested. This goes to its own file, the gidPdfFile
+            # is left whole so it can still be used for binding.
+            outputFile = self.local.gidPdfFile
             if pgRange :
-                self.tools.pdftkPullPages(self.local.gidPdfFile, self.local.gidPdfFile, pgRange)
+                outputFile = self.tools.pdfPullPages(self.local.gidPdfFile, self.local.gidPagesPdfFile, pgRange)
 
             # The gidPdfFile is the residue of the last render and if approved, can be
             # used for the binding process. In regard to saving and file naming, the
@@ -183,27 +185,26 @@ class Pdftk (Manager) :
                     os.makedirs(self.local.projDeliverableFolder)
                 # Final file name and path
                 saveFile = os.path.join(self.local.projDeliverableFolder, saveFileName)
-                # Copy, no news is good news
-                if shutil.copy(self.local.gidPdfFile, saveFile) :
-                    self.log.writeToLog(self.errorCodes['5730'], [saveFileName])
+                # Link or copy it, whatever the file system can do fastest
+                if self.tools.materializeFile(outputFile, saveFile) :
+                    self.log.writeToLog(self.errorCodes['5720'], [saveFileName])
                 else :
-                    self.log.writeToLog(self.errorCodes['5720'], [saveFileName])            
+                    self.log.writeToLog(self.errorCodes['5730'], [saveFileName])
 
             # If given, the override file name becomes the file name 
             if override :
                 saveFile = override
-                # With shutil.copy(), no news is good news
-                if shutil.copy(self.local.gidPdfFile, saveFile) :
-                    self.log.writeToLog(self.errorCodes['5730'], [saveFileName])
-                else :
+                if self.tools.materializeFile(outputFile, saveFile) :
                     self.log.writeToLog(self.errorCodes['5720'], [saveFileName])
+                else :
+                    self.log.writeToLog(self.errorCodes['5730'], [saveFileName])
 
             # Once we know the file is successfully generated, add a background if defined
             if self.useBackground :
                 if saveFile :
                     viewFile = self.pg_back.addBackground(saveFile)
                 else :
-                    viewFile = self.pg_back.addBackground(self.local.gidPdfFile)
+                    viewFile = self.pg_back.addBackground(outputFile)
                     
             # Add a timestamp and doc info if requested in addition to background
             if self.useDocInfo :
@@ -216,7 +217,7 @@ class Pdftk (Manager) :
                     if os.path.isfile(viewFile) :
                         viewFile = self.pg_back.addDocInfo(viewFile)
                     else :
-                        viewFile = self.pg_back.addDocInfo(self.local.gidPdfFile)
+                        viewFile = self.pg_back.addDocInfo(outputFile)
 
             # To avoid confusion with file names, if this is a saved file,
             # and it has a background, we need to remove the original, non-
@@ -239,8 +240,8 @@ class Pdftk (Manager) :
             else :
                 # The view file in this case is just temporary
                 if not os.path.isfile(viewFile) :
-                    viewFile = self.local.gidPdfFile.replace(gid + '.pdf', gid + '-view.pdf')
-                    shutil.copy(self.local.gidPdfFile, viewFile)
+                    viewFile = os.path.splitext(outputFile)[0] + '-view.pdf'
+                    self.tools.materializeFile(outputFile, viewFile)
                     self.log.writeToLog(self.errorCodes['5020'], [self.tools.fName(viewFile)])
 
             if os.path.isfile(viewFile) :
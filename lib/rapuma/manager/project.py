@@ -16,7 +16,8 @@
 # Firstly, import all the standard Python modules we need for
 # this process
 
-import codecs, os, sys, shutil, imp, subprocess, zipfile, StringIO, filecmp
+import codecs, os, sys, shutil, imp, subprocess, zipfile, StringIO, filecmp, time, signal
+import fcntl, errno
 from configobj                      import ConfigObj, Section
 
 
@@ -27,6 +28,59 @@ from rapuma.core.user_config        import UserConfig
 from rapuma.core.proj_local         import ProjLocal
 from rapuma.core.proj_log           import ProjLog
 from rapuma.project.proj_config     import Config
+from rapuma.group.usfm_data         import UsfmData
+
+###############################################################################
+############################ Speculation Functions ############################
+###############################################################################
+
+def getSpeculatePidFile (pid) :
+    '''Return the file that holds the process ID of the speculative render
+    of a project (see Project.startSpeculation()).'''
+
+    return os.path.join(ProjLocal(pid).projComponentFolder, 'speculate.pid')
+
+
+def stopSpeculativeRender (pid) :
+    '''Stop the speculative render of a project if one is running and
+    wait until it has exited. This has to be done before anything is done
+    that changes the project. Return the process ID that was stopped, or
+    None if there was not one running.'''
+
+    pidFile = getSpeculatePidFile(pid)
+    if not os.path.isfile(pidFile) :
+        return None
+    with open(pidFile, 'r') as pidObject :
+        # The speculative process holds a lock on the file as long as it
+        # is running, if we can get it the process ID in there is old
+        try :
+            fcntl.flock(pidObject, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return None
+        except IOError as e :
+            if e.errno not in [errno.EAGAIN, errno.EACCES] :
+                return None
+        # The process ID is written just after the lock is taken
+        specPid = 0
+        for i in range(50) :
+            pidObject.seek(0)
+            try :
+                specPid = int(pidObject.read().strip())
+                break
+            except ValueError :
+                time.sleep(0.01)
+        # The process ID is still in use as the process group ID as long as
+        # anything in the group holds the lock, so it is safe to stop them
+        if specPid > 0 :
+            try :
+                os.killpg(specPid, signal.SIGTERM)
+            except OSError :
+                pass
+        # The lock is let go when the process is gone
+        fcntl.flock(pidObject, fcntl.LOCK_EX)
+        fcntl.flock(pidObject, fcntl.LOCK_UN)
+
+    return specPid
+
 
 ###############################################################################
 ################################## Begin Class ################################
@@ -58,6 +112,18 @@ class Project (object) :
         self.projectName            = self.projectConfig['ProjectInfo']['projectTitle']
         self.plid                   = self.projectConfig['ProjectInfo']['languageCode']
         self.psid                   = self.projectConfig['ProjectInfo']['scriptCode']
+        # Render session settings (see watchGroup() and renderAllGroups())
+        self.watchMode              = False
+        # If set, only these cids are preprocessed, the rest are rendered as they are
+        self.preprocessCids         = None
+        self.viewRender             = True
+        self.startPage              = None
+        # A quick, low fidelity render that is kept apart from the final one (see Xetex)
+        self.draftMode              = False
+        # A scripture reference (like "MAT 5-7") to render instead of whole cids (see Usfm)
+        self.renderRef              = None
+        # A background render done only to fill the render cache (see startSpeculation())
+        self.speculative            = False
         
         # The gid cannot generally be set yet but we will make a placeholder
         # for it here and the functions below will set it. (I'm just say'n)
@@ -98,6 +164,14 @@ class Project (object) :
             '0211' : ['ERR', 'Failed to write out project [<<1>>] settings to the project configuration file.'],
 
             '0660' : ['ERR', 'Invalid component ID: [<<1>>].'],
+            '0670' : ['MSG', 'Watching [<<1>>] for changes, press Ctrl-C to stop.'],
+            '0675' : ['MSG', 'Changes found in: [<<1>>], rendering: [<<2>>]'],
+            '0680' : ['MSG', 'Stopped watching [<<1>>].'],
+            '0685' : ['LOG', 'The pyinotify module was not found, polling for changes every [<<1>>] second(s).'],
+            '0690' : ['ERR', 'Watch mode is not supported for the [<<1>>] component type.'],
+
+            '0710' : ['LOG', 'Started a speculative render of [<<1>>] in process [<<2>>].'],
+            '0720' : ['LOG', 'Stopped the speculative render in process [<<1>>].'],
 
         }
 
@@ -179,13 +253,148 @@ class Project (object) :
         if cidList :
             self.isValidCidList(cidList)
 
+        # A foreground render always comes before a speculative one
+        if not self.speculative :
+            self.stopSpeculation()
+
         # Otherwise, do a basic test for exsistance and move on
         if self.projectConfig['Groups'].has_key(self.gid) :
             # Now create the group and pass the params on
             self.createGroup().render(self.gid, cidList, pages, override, save)
+            # The next cids are likely to be asked for soon, get them ready
+            self.startSpeculation(cidList)
             return True
 
 
+    def watchGroup (self, cidList = '', pages = '', override = '', save = False, interval = 1.0, debounce = 0.5) :
+        '''Stay resident and render the group (or the cids in the cidList)
+        whenever a working text, adjustment, piclist, or config file changes.
+        Each render is done with a fresh project object so config changes
+        get picked up. If only working texts have changed, only those cids
+        will be run through XeTeX again. This is stopped with Ctrl-C.'''
+
+#        import pdb; pdb.set_trace()
+
+        if self.cType != 'usfm' :
+            self.log.writeToLog(self.errorCodes['0690'], [self.cType])
+
+        cids = cidList or self.projectConfig['Groups'][self.gid]['cidList']
+        if cidList :
+            self.isValidCidList(cidList)
+        cidFiles, otherFiles = self.getWatchFiles(cids)
+
+        # Use inotify to wake up if we can, otherwise we poll
+        notifier = None
+        try :
+            import pyinotify
+            wm = pyinotify.WatchManager()
+            folders = set([os.path.dirname(f) for f in cidFiles.keys() + otherFiles])
+            for folder in folders :
+                if os.path.isdir(folder) :
+                    wm.add_watch(folder, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE)
+            notifier = pyinotify.Notifier(wm, timeout = int(interval * 1000))
+        except ImportError :
+            self.log.writeToLog(self.errorCodes['0685'], [str(interval)])
+
+        def wait () :
+            '''Wait for something to happen or the poll interval.'''
+            if notifier :
+                if notifier.check_events() :
+                    notifier.read_events()
+                    notifier.process_events()
+            else :
+                time.sleep(interval)
+
+        # Render once to start with, this will also start the viewer
+        project = self
+        project.watchMode = True
+        project.renderGroup(cidList, pages, override, save)
+        textStates = self.getFileStates(cidFiles.keys())
+        otherStates = self.getFileStates(otherFiles)
+        self.log.writeToLog(self.errorCodes['0670'], [self.gid])
+        try :
+            while True :
+                wait()
+                newTextStates = self.getFileStates(cidFiles.keys())
+                newOtherStates = self.getFileStates(otherFiles)
+                if newTextStates == textStates and newOtherStates == otherStates :
+                    continue
+                # Let things settle (editors often write more than once)
+                while True :
+                    time.sleep(debounce)
+                    settledText = self.getFileStates(cidFiles.keys())
+                    settledOther = self.getFileStates(otherFiles)
+                    if settledText == newTextStates and settledOther == newOtherStates :
+                        break
+                    newTextStates, newOtherStates = settledText, settledOther
+
+                # A change to any of the group files affects all the cids
+                textChanged = [f for f in newTextStates if newTextStates[f] != textStates.get(f)]
+                otherChanged = [f for f in newOtherStates if newOtherStates[f] != otherStates.get(f)]
+                if otherChanged :
+                    affected = list(cids)
+                    preprocessCids = None
+                else :
+                    affected = [cid for cid in cids if cid in [cidFiles[f] for f in textChanged]]
+                    preprocessCids = affected
+                self.log.writeToLog(self.errorCodes['0675'], [' '.join([self.tools.fName(f) for f in textChanged + otherChanged]), ' '.join(affected)])
+
+                # The working texts are recorded before the render so edits
+                # made while it runs are not lost. The rest are recorded after
+                # as rendering makes changes to some of them.
+                textStates = newTextStates
+                project = Project(self.pid, self.gid)
+                project.watchMode = True
+                project.viewRender = False
+                project.draftMode = self.draftMode
+                project.renderRef = self.renderRef
+                # The whole group is still rendered (so the view has all of
+                # it) but only the cids that changed need preprocessing, the
+                # others are reused from the last render
+                project.preprocessCids = preprocessCids
+                project.renderGroup(cidList, pages, override, save)
+                otherStates = self.getFileStates(otherFiles)
+        except KeyboardInterrupt :
+            if notifier :
+                notifier.stop()
+            self.log.writeToLog(self.errorCodes['0680'], [self.gid])
+
+        return True
+
+
+    def getWatchFiles (self, cids) :
+        '''Return a dictionary of the files that belong to each cid (file:cid)
+        and a list of the files that affect the whole group.'''
+
+        group = self.createGroup()
+        cidFiles = {}
+        for cid in cids :
+            cidFiles[group.getCidPath(cid)] = cid
+            cidFiles[group.getCidAdjPath(cid)] = cid
+            cidFiles[os.path.join(self.local.projComponentFolder, cid, group.makeFileNameWithExt(cid) + '.piclist')] = cid
+
+        otherFiles = [self.local.projectConfFile, self.local.layoutConfFile, self.local.macroConfFile,
+                        self.local.fontConfFile, self.local.illustrationConfFile, self.local.adjustmentConfFile,
+                            self.local.extTexFile, self.local.glbExtStyFile, self.local.grpExtTexFile, self.local.grpExtStyFile]
+
+        return cidFiles, [f for f in otherFiles if f]
+
+
+    def getFileStates (self, files) :
+        '''Return a dictionary of (mtime, size) for each file in a list.
+        Files that do not exist get None.'''
+
+        states = {}
+        for f in files :
+            try :
+                st = os.stat(f)
+                states[f] = (st.st_mtime, st.st_size)
+            except OSError :
+                states[f] = None
+
+        return states
+
+
     def createGroup (self) :
         '''Create a group object that can be acted on. It is assumed
         this only happens for one group per session. This group
@@ -236,6 +445,119 @@ class Project (object) :
                 print c, comps[c][1]
 
 
+###############################################################################
+######################### Speculative Render Functions ########################
+###############################################################################
+####################### Error Code Block Series = 0700 ########################
+###############################################################################
+
+    def getNextCids (self, cidList, count) :
+        '''Return up to count cids that come after the last one in the
+        cidList, in canonical order.'''
+
+        groupCids = UsfmData().canonListSort(self.projectConfig['Groups'][self.gid]['cidList'])
+        lastCid = UsfmData().canonListSort(cidList)[-1]
+        if lastCid not in groupCids :
+            return []
+        i = groupCids.index(lastCid) + 1
+
+        return [cid for cid in groupCids[i:i + count] if cid not in cidList]
+
+
+    def startSpeculation (self, cidList) :
+        '''After rendering a few cids the user usually goes on to render
+        the next ones. If speculativeRenders is set, render that many of
+        the next cids in a background process at a low priority so they
+        will be waiting in the render cache. Nothing else is kept from
+        these renders. Only one runs at a time in a project and it is
+        stopped by stopSpeculativeRender() as soon as anything else is
+        done to the project.'''
+
+#        import pdb; pdb.set_trace()
+
+        if self.cType != 'usfm' or not cidList or not hasattr(os, 'fork') :
+            return False
+        if self.speculative or self.watchMode or self.draftMode or self.renderRef :
+            return False
+        try :
+            count = int(self.projectConfig['Managers'][self.cType + '_Xetex'].get('speculativeRenders', '0'))
+        except (KeyError, ValueError) :
+            count = 0
+        nextCids = []
+        if count > 0 :
+            nextCids = self.getNextCids(cidList, count)
+        if not nextCids :
+            return False
+
+        pidFile = getSpeculatePidFile(self.pid)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # The new process tells us through this when it is up and running
+        (readFd, writeFd) = os.pipe()
+        childPid = os.fork()
+        if childPid :
+            os.close(writeFd)
+            started = os.read(readFd, 1)
+            os.close(readFd)
+            if not started :
+                return False
+            self.log.writeToLog(self.errorCodes['0710'], [' '.join(nextCids), str(childPid)])
+            return True
+
+        # From here on this is the speculative process. It gets its own
+        # process group so it can be stopped along with any XeTeX it started.
+        try :
+            os.close(readFd)
+            os.setsid()
+            os.nice(19)
+            devNull = os.open(os.devnull, os.O_RDWR)
+            for fd in [0, 1, 2] :
+                os.dup2(devNull, fd)
+            # The lock on the pid file is held for as long as this process
+            # is running, if someone else has it there is one running already
+            pidFd = os.open(pidFile, os.O_RDWR | os.O_CREAT)
+            fcntl.fcntl(pidFd, fcntl.F_SETFD, fcntl.fcntl(pidFd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            fcntl.flock(pidFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.ftruncate(pidFd, 0)
+            os.write(pidFd, str(os.getpid()))
+            os.write(writeFd, '1')
+            os.close(writeFd)
+            # The working text dependencies are shared with the foreground
+            # renders, a stop request is held off until the one being made
+            # is done, then it is taken
+            held = []
+            signal.signal(signal.SIGTERM, lambda signum, frame : held.append(signum))
+            project = Project(self.pid, self.gid)
+            project.speculative = True
+            project.viewRender = False
+            for cid in nextCids :
+                project.createGroup().preProcessGroup(self.gid, [cid])
+                if held :
+                    raise SystemExit
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            for cid in nextCids :
+                project = Project(self.pid, self.gid)
+                project.speculative = True
+                project.viewRender = False
+                project.renderGroup([cid])
+        except BaseException :
+            pass
+        finally :
+            os._exit(0)
+
+
+    def stopSpeculation (self) :
+        '''Stop a speculative render if one is running in this project
+        and wait until it is gone.'''
+
+        specPid = stopSpeculativeRender(self.pid)
+        if not specPid :
+            return False
+        self.log.writeToLog(self.errorCodes['0720'], [str(specPid)])
+
+        return True
+
+
 ###############################################################################
 ############################ System Level Functions ###########################
 ###############################################################################
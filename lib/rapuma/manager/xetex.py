@@ -16,12 +16,13 @@
 # Firstly, import all the standard Python modules we need for
 # this process
 
-import os, shutil, re, codecs, subprocess
+import os, shutil, re, codecs, subprocess, json, multiprocessing, hashlib, copy, time
 from configobj                          import ConfigObj
-from pyPdf                              import PdfFileReader
 
 # Load the local classes
 from rapuma.core.tools                  import Tools
+from rapuma.core.proj_trace             import ProjTrace
+from rapuma.core.xetex_log              import XetexLog
 from rapuma.manager.manager             import Manager
 from rapuma.project.proj_config         import Config
 from rapuma.project.proj_macro          import Macro
@@ -34,6 +35,49 @@ from rapuma.group.usfmTex               import UsfmTex
 from rapuma.group.usfm_data             import UsfmData
 
 
+###############################################################################
+############################### Worker Functions ##############################
+###############################################################################
+
+def renderCidWorker (job) :
+    '''Run XeTeX on a single cid TeX control file, then read through the
+    log it made. This has to live at the module level so it can be handed
+    off to a multiprocessing pool. The job is a tuple of (cid, cmds,
+    envDict, logFile, cidFiles, pdfCmds). In two stage mode pdfCmds is
+    the xdvipdfmx command and the XDV file is converted right here, while
+    the other workers are still typesetting, otherwise it is None. What
+    is returned is (cid, return code, error, diagnostics index, XeTeX
+    time, conversion result, page fill), the conversion result being
+    what convertXdvWorker() returns, or None, and the page fill how full
+    the last page was (see XetexLog.getPageFill()).'''
+
+    (cid, cmds, envDict, logFile, cidFiles, pdfCmds) = job
+    start = time.time()
+    try :
+        rCode = subprocess.call(cmds, env = envDict)
+    except Exception as e :
+        return (cid, None, str(e), {}, None, None, None)
+    xetexTime = round(time.time() - start, 2)
+    xetexLog = XetexLog(cidFiles)
+    xetexLog.parseFile(logFile)
+    converted = None
+    if pdfCmds :
+        converted = convertXdvWorker((cid, pdfCmds, envDict))
+    return (cid, rCode, '', xetexLog.getIndex(), xetexTime, converted, xetexLog.getPageFill())
+
+
+def convertXdvWorker (job) :
+    '''Run xdvipdfmx on a single cid XDV file. This is called by
+    renderCidWorker() in the same worker that did the typesetting. The
+    job is a tuple of (cid, cmds, envDict).'''
+
+    (cid, cmds, envDict) = job
+    try :
+        return (cid, subprocess.call(cmds, env = envDict), '')
+    except Exception as e :
+        return (cid, None, str(e))
+
+
 ###############################################################################
 ################################## Begin Class ################################
 ###############################################################################
@@ -53,6 +97,7 @@ class Xetex (Manager) :
         # Create all the values we can right now for this manager.
         # Others will be created at run time when we know the cid.
         self.tools                  = Tools()
+        self.trace                  = ProjTrace(project.pid)
         self.project                = project
         self.local                  = project.local
         self.log                    = project.log
@@ -114,6 +159,34 @@ class Xetex (Manager) :
             self.chapNumOffSingChap     = self.tools.str2bool(self.macroConfig['Macros'][self.macPackId]['ChapterVerse']['omitChapterNumberOnSingleChapterBook'])
         except :
             self.chapNumOffSingChap     = None
+        # The name of the preloaded format file, if one is being used (see makeTexFormat())
+        self.texFormat              = None
+        # When True XeTeX makes XDV files which xdvipdfmx turns into PDF (see run())
+        self.twoStageRender         = False
+        # A draft render is a quick look at the text. The illustrations are
+        # swapped for low resolution copies and hyphenation, background and
+        # diagnostic layers are left out. Everything it makes goes to its own
+        # folder so the final render files and caches are never touched.
+        # A render of a scripture reference (see Usfm.makeSlice()) keeps to
+        # itself in the same way, as does a speculative render (see
+        # Project.startSpeculation()) but that one shares the render cache.
+        self.draftMode              = project.draftMode
+        self.renderRef              = project.renderRef
+        self.speculative            = project.speculative
+        self.draftIllustrationFolder = None
+        if self.draftMode or self.renderRef or self.speculative :
+            self.local              = copy.copy(project.local)
+        if self.draftMode :
+            self.useHyphenation     = False
+            self.useBackground      = False
+            self.useDocInfo         = False
+            self.useDiagnostic      = False
+            self.useOutputFolder(self.local.projGidDraftFolder)
+        if self.renderRef :
+            self.useOutputFolder(os.path.join(self.local.projGidFolder, 'Slice'))
+        if self.speculative :
+            self.useOutputFolder(os.path.join(self.local.projGidFolder, 'Speculate'))
+            self.local.projRenderCacheFolder = project.local.projRenderCacheFolder
         # Make any dependent folders if needed
         if not os.path.isdir(self.local.projGidFolder) :
             os.makedirs(self.local.projGidFolder)
@@ -133,6 +206,7 @@ class Xetex (Manager) :
             '1040' : ['LOG', 'Created: [<<1>>]'],
 
             '0420' : ['WRN', 'TeX settings file has been frozen for debugging purposes.'],
+            '0430' : ['LOG', 'Settings unchanged, [<<1>>] did not need to be recreated.'],
             '0440' : ['LOG', 'Created: [<<1>>]'],
             '0460' : ['LOG', 'Settings changed in [<<1>>], [<<2>>] needed to be recreated.'],
             '0465' : ['LOG', 'File: [<<1>>] missing, created a new one.'],
@@ -146,13 +220,32 @@ class Xetex (Manager) :
             '0625' : ['MSG', 'Rendering of [<<1>>] successful.'],
             '0630' : ['ERR', 'Rendering [<<1>>] was unsuccessful. <<2>> (<<3>>)'],
             '0635' : ['ERR', 'XeTeX error code [<<1>>] not understood by Rapuma.'],
+            '0640' : ['LOG', 'Parallel rendering [<<1>>] component(s) with [<<2>>] worker(s).'],
+            '0642' : ['LOG', 'The chunks of [<<1>>] did not end on full pages last time, rendering it whole.'],
+            '0645' : ['LOG', 'Start pages changed, rendering these components again: [<<1>>]'],
+            '0646' : ['LOG', 'A chunk of [<<1>>] did not end on a full page, rendering it again whole.'],
+            '0647' : ['WRN', 'Start pages still did not settle after [<<1>>] passes, page numbers may be wrong in: [<<2>>]'],
             '0650' : ['ERR', 'Component type [<<1>>] not supported!'],
+            '0655' : ['ERR', 'Failed to join component PDF files into: [<<1>>]'],
+            '0660' : ['MSG', 'Dependent files unchanged, using cached render of [<<1>>] ([<<2>>] pages).'],
+            '0665' : ['LOG', 'Stored render of [<<1>>] in the render cache as: [<<2>>]'],
+            '0667' : ['WRN', 'The render of [<<1>>] did not finish, it was not stored in the render cache.'],
+            '0670' : ['WRN', 'Could not use the render cache: [<<1>>]'],
+            '0675' : ['LOG', 'Created XeTeX format file: [<<1>>]'],
+            '0680' : ['WRN', 'Could not create XeTeX format file [<<1>>], macros will be loaded the normal way.'],
+            '0685' : ['LOG', 'XeTeX format folder [<<1>>] is not writable, macros will be loaded the normal way.'],
             '0690' : ['MSG', 'Dependent files unchanged, rerendering of [<<1>>] un-necessary.'],
             '0695' : ['MSG', 'Routing <<1>> to PDF viewer.'],
             '0700' : ['ERR', 'Rendered file not found: <<1>>'],
             '0710' : ['WRN', 'PDF viewing is disabled.'],
             '0720' : ['MSG', 'Saved rendered file to: [<<1>>]'],
             '0730' : ['ERR', 'Failed to save rendered file to: [<<1>>]'],
+            '0740' : ['MSG', 'XeTeX reported: <<1>>. See: [<<2>>]'],
+            '0745' : ['LOG', 'XeTeX reported nothing that needs looking at for [<<1>>].'],
+            '0750' : ['MSG', 'Typesetting unchanged, using cached XDV file for [<<1>>].'],
+            '0755' : ['ERR', 'Converting [<<1>>] to PDF with xdvipdfmx failed. (<<2>>)'],
+            '0760' : ['LOG', 'Stored XDV file for [<<1>>] in the render cache as: [<<2>>]'],
+            '0765' : ['MSG', 'Draft render of [<<1>>], output will go to: [<<2>>]'],
 
             '1000' : ['WRN', 'XeTeX debugging is set to [<<1>>]. These are the paths XeTeX is seeing: [<<2>>]'],
             '1090' : ['ERR', 'Invalid value [<<1>>] used for XeTeX debugging. Must use an integer of 0, 1, 2, 4, 8, 16, or 32']
@@ -210,6 +303,16 @@ class Xetex (Manager) :
                 return self.projectConfig['Groups'][pGrp]['startPageNumber']
 
 
+    def useOutputFolder (self, folder) :
+        '''Point the group output files and the render cache at another
+        folder. This works on a copy of the project local object.'''
+
+        for fileID in ['gidTexFile', 'gidPdfFile', 'gidPagesPdfFile', 'gidRenderManifestFile', 'gidDiagnosticsFile'] :
+            setattr(self.local, fileID, os.path.join(folder, getattr(self.local, fileID + 'Name')))
+        self.local.projRenderCacheFolder = os.path.join(folder, 'Cache')
+        self.local.projGidFolder = folder
+
+
     def makeExtFile (self, fileName, description) :
         '''Generic function to create an extension file if one does not already exist.'''
 
@@ -317,6 +420,13 @@ class Xetex (Manager) :
             self.log.writeToLog(self.errorCodes['0420'])
             return False
 
+        # If none of the settings have changed since the file was last
+        # made, leave it alone (and its time stamp with it)
+        fingerprint = self.makeSettingsFingerprint()
+        if fingerprint == self.getSettingsFingerprint() :
+            self.log.writeToLog(self.errorCodes['0430'], [self.local.macSettingsFileName])
+            return True
+
         def appendLine(line, realVal) :
             '''Use this to shorten the code and look for listy things.'''
             if type(line) == list :
@@ -325,9 +435,13 @@ class Xetex (Manager) :
             else :
                 linesOut.append(self.proj_config.processNestedPlaceholders(line, realVal))
 
-        # Open a fresh settings file
-        with codecs.open(self.local.macSettingsFile, "w", encoding='utf_8') as writeObject :
+        # Open a fresh settings file. It is written to a temporary file
+        # first and only put in place when it is done, a settings file
+        # that was only part written must never carry the fingerprint
+        tmpFile = self.local.macSettingsFile + '.' + str(os.getpid())
+        with codecs.open(tmpFile, "w", encoding='utf_8') as writeObject :
             writeObject.write(self.tools.makeFileHeader(self.local.macSettingsFileName, description))
+            writeObject.write('% Settings fingerprint: ' + fingerprint + '\n')
             # Build a dictionary from the default XML settings file
             # Create a dict that contains only the data we need here
             macPackDict = self.tools.xmlFileToDict(self.local.macPackConfXmlFile)
@@ -399,8 +513,47 @@ class Xetex (Manager) :
             # Die here if testing
             if outputTest :
                 self.tools.dieNow()
-            # Report finished if not
-            return True
+
+        os.rename(tmpFile, self.local.macSettingsFile)
+        # Report finished if not
+        self.log.writeToLog(self.errorCodes['0440'], [self.local.macSettingsFileName])
+        return True
+
+
+    def makeSettingsFingerprint (self) :
+        '''Return a hash of everything that goes into the settings file.
+        That is the macPack XML file, the macro package settings, the
+        layout and font settings that placeholders and boolDepends refer
+        to, and the local paths that get filled in.'''
+
+        # The GeneralSettings section only has a time stamp in it
+        def noStamp (cfg) :
+            return dict([(k, v) for k, v in cfg.iteritems() if k != 'GeneralSettings'])
+
+        sha = hashlib.sha1()
+        if os.path.isfile(self.local.macPackConfXmlFile) :
+            with open(self.local.macPackConfXmlFile, 'rb') as xmlObject :
+                sha.update(xmlObject.read())
+        data = [self.macroConfig['Macros'].get(self.macPackId, {}), noStamp(self.layoutConfig), 
+                    noStamp(self.fontConfig), self.projectConfig['CompTypes'][self.Ctype], 
+                        self.local.projHome, self.local.projMacPackFolder]
+        sha.update(json.dumps(data, sort_keys = True))
+
+        return sha.hexdigest()
+
+
+    def getSettingsFingerprint (self) :
+        '''Return the fingerprint recorded in the current settings file,
+        or None if there is not one.'''
+
+        if os.path.isfile(self.local.macSettingsFile) :
+            with codecs.open(self.local.macSettingsFile, "r", encoding='utf_8') as settingsObject :
+                # It will be found right after the file header
+                for i, line in enumerate(settingsObject) :
+                    if line.startswith('% Settings fingerprint: ') :
+                        return line.split(':', 1)[1].strip()
+                    if i > 20 :
+                        break
 
 
     def affirm (self, boolDependInfo) :
@@ -446,91 +599,23 @@ class Xetex (Manager) :
         if os.path.exists(self.local.gidTexFile) :
             os.remove(self.local.gidTexFile)
 
-        # Create the main TeX settings file (made on every run)
-        self.makeSettingsTexFile()
-
         # Start writing out the gid.tex file. Check/make dependencies as we go.
         # If we fail to make a dependency it will die and report during that process.
         # We bring in each element in the order necessary
         with codecs.open(self.local.gidTexFile, "w", encoding='utf_8') as gidTexObject :
             # Write out the file header
             gidTexObject.write(self.tools.makeFileHeader(self.local.gidTexFileName, description))
-            # First bring in the main macro file
-            gidTexObject.write('\\input \"' + self.local.primaryMacroFile + '\"\n')
-            # Check for a preStyle extension file and load if it is there
-            if os.path.exists(self.local.preStyTexExtFile) :
-                gidTexObject.write('\\input \"' + self.local.preStyTexExtFile + '\"\n')
-            ########
-            # FIXME? To avoid problems with the usfmTex marginalverses macro code, we bring
-            # in the stylesheets now. Will this cause any problems with other macPacks?
-            ########
-            # Load style files (default and extention come with the package)
-            gidTexObject.write('\\stylesheet{' + self.local.defaultStyFile + '}\n')
-            # Load the global style extensions
-            gidTexObject.write('\\stylesheet{' + self.local.glbExtStyFile + '}\n')
-            # Load the group style extensions (if needed)
-            if self.projectConfig['Groups'][self.gid].has_key('useGrpStyOverride') and self.tools.str2bool(self.projectConfig['Groups'][self.gid]['useGrpStyOverride']) :
-                self.makeGrpExtStyFile()
-                gidTexObject.write('\\stylesheet{' + self.local.grpExtStyFile + '}\n')
-            # Load the settings (usfmTex: if marginalverses, load code in this)
-            gidTexObject.write('\\input \"' + self.local.macSettingsFile + '\"\n')
-            # Load the TeX macro extensions for this macro package
-            gidTexObject.write('\\input \"' + self.local.extTexFile + '\"\n')
-            # Load the group TeX macro extensions (if needed)
-            if self.projectConfig['Groups'][self.gid].has_key('useGrpTexOverride') and self.tools.str2bool(self.projectConfig['Groups'][self.gid]['useGrpTexOverride']) :
-                self.makeGrpExtTexFile()
-                gidTexObject.write('\\input \"' + self.local.grpExtTexFile + '\"\n')
-            # Load hyphenation data if needed
-            if self.useHyphenation :
-                # This is the main hyphenation settings file, this must be loaded first
-                gidTexObject.write('\\input \"' + self.proj_hyphenation.projHyphSetTexFile + '\"\n')
-                # This is the character definition file for hyphenation, this should be loaded second
-                gidTexObject.write('\\input \"' + self.proj_hyphenation.projHyphCharTexFile + '\"\n')
-                # This is the exception words list (all the hyphenated words), this is loaded last
-                gidTexObject.write('\\input \"' + self.proj_hyphenation.projHyphExcTexFile + '\"\n')
+            # Bring in all the macros and settings
+            self.writeTexPreambleOrFormat(gidTexObject)
             # If this is less than a full group render, just go with default pg num (1)
-            if cidList == self.projectConfig['Groups'][self.gid]['cidList'] :
-                # Check if this setting is there
-                startPageNumber = self.checkStartPageNumber()
-                if startPageNumber > 1 :
-                    gidTexObject.write('\\pageno = ' + str(startPageNumber) + '\n')
+            startPageNumber = self.getStartPageNumber(cidList)
+            if startPageNumber > 1 :
+                gidTexObject.write('\\pageno = ' + str(startPageNumber) + '\n')
             # Insert Document properties and x1a compliant info if needed
             gidTexObject.write(self.makeXoneACompliant())
             # Now add in each of the components
             for cid in cidList :
-                # Output files and commands for usfm cType
-                if self.cType == 'usfm' :
-                    cidSource       = os.path.join(self.local.projComponentFolder, cid, self.project.groups[self.gid].makeFileNameWithExt(cid))
-                    cidTexFileOn    = os.path.join(self.local.projTexFolder, self.gid + '-' + cid + '-On-ext.tex')
-                    cidTexFileOff   = os.path.join(self.local.projTexFolder, self.gid + '-' + cid + '-Off-ext.tex')
-                    cidStyFileOn    = os.path.join(self.local.projStyleFolder, self.gid + '-' + cid + '-On-ext.sty')
-                    cidStyFileOff   = os.path.join(self.local.projStyleFolder, self.gid + '-' + cid + '-Off-ext.sty')
-                    # Check to see if a TeX macro override is needed
-                    if self.projectConfig['Groups'][self.gid].has_key('compTexOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compTexOverrideList'] :
-                        self.makeCmpExtTexFileOn(cidTexFileOn)
-                        gidTexObject.write('\\input \"' + cidTexFileOn + '\"\n')
-                    # Check to see if a style override is needed (if so create "on" file)
-                    if self.projectConfig['Groups'][self.gid].has_key('compStyOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compStyOverrideList'] :
-                        self.makeCmpExtStyFileOn(cidStyFileOn)
-                        gidTexObject.write('\\stylesheet{' + cidStyFileOn + '}\n')
-                    # Check for short books add omit statement
-                    if self.chapNumOffSingChap and self.cidChapNumDict[cid] == 1 :
-                        gidTexObject.write('\\OmitChapterNumbertrue\n') 
-                    # Add the working file here
-                    gidTexObject.write('\\ptxfile{' + cidSource + '}\n')
-                    # Check again for short books turn off omit statement
-                    if self.chapNumOffSingChap and self.cidChapNumDict[cid] == 1 :
-                        gidTexObject.write('\\OmitChapterNumberfalse\n') 
-                    # Check for for style override and add the "Off" style file here
-                    if self.projectConfig['Groups'][self.gid].has_key('compStyOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compStyOverrideList'] :
-                        self.makeCmpExtStyFileOn(cidStyFileOff)
-                        gidTexObject.write('\\stylesheet{' + cidStyFileOff + '}\n')
-                    # Check for for TeX macro override and add the "Off" TeX file here
-                    if self.projectConfig['Groups'][self.gid].has_key('compTexOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compTexOverrideList'] :
-                        self.makeCmpExtTexFileOff(cidTexFileOff)
-                        gidTexObject.write('\\input \"' + cidTexFileOff + '\"\n')
-                else :
-                    self.log.writeToLog(self.errorCodes['0650'], [self.cType])
+                self.writeCidTexLines(gidTexObject, cid)
 
             # This can only hapen once in the whole process, this marks the end
             gidTexObject.write('\\bye\n')
@@ -538,6 +623,159 @@ class Xetex (Manager) :
         return True
 
 
+    def makeCidTexFile (self, cid, startPageNumber, unit = None, source = None) :
+        '''Create a TeX control file for a single component. This is
+        used when the components of a group are rendered separately.
+        The page numbering starts where the group render would have
+        it start. For a chunk of a component, the unit is the chunk
+        name and the source is its working text.'''
+
+        description = 'This is a component TeX control file. XeTeX will \
+            read this file to render a single component of the group. It \
+            is remade on every parallel render run.'
+
+        cidTexFile = self.getCidTexFile(unit or cid)
+        with codecs.open(cidTexFile, "w", encoding='utf_8') as cidTexObject :
+            cidTexObject.write(self.tools.makeFileHeader(self.tools.fName(cidTexFile), description))
+            self.writeTexPreambleOrFormat(cidTexObject)
+            cidTexObject.write('\\pageno = ' + str(startPageNumber) + '\n')
+            cidTexObject.write(self.makeXoneACompliant())
+            # A chunk ends with the page break at the end of \ptxfile. Have
+            # XeTeX note how full the page is then (see chunkEndsFull())
+            if unit and unit != cid :
+                cidTexObject.write('\\let\\RapumaPagebreak=\\pagebreak\n')
+                cidTexObject.write('\\def\\pagebreak{\\immediate\\write-1{RapumaPageFill:\\the\\pagetotal:\\the\\pagegoal:\\the\\baselineskip}\\RapumaPagebreak}\n')
+            self.writeCidTexLines(cidTexObject, cid, source)
+            cidTexObject.write('\\bye\n')
+
+        return True
+
+
+    def getCidTexFile (self, cid) :
+        '''Return the full path of the TeX control file for a single cid.'''
+
+        return os.path.join(self.local.projGidFolder, self.gid + '-' + cid + '.tex')
+
+
+    def getCidPdfFile (self, cid) :
+        '''Return the full path of the PDF XeTeX will make from a cid
+        TeX control file.'''
+
+        return os.path.join(self.local.projGidFolder, self.gid + '-' + cid + '.pdf')
+
+
+    def getStartPageNumber (self, cidList) :
+        '''Return the page number the render should start on. If this is
+        less than a full group render, just go with default pg num (1).'''
+
+        if cidList == self.projectConfig['Groups'][self.gid]['cidList'] :
+            # A number handed down by the caller (see renderAllGroups())
+            # wins over what is in the config
+            if self.project.startPage :
+                return int(self.project.startPage)
+            # Check if this setting is there
+            try :
+                return int(self.checkStartPageNumber())
+            except :
+                return 1
+        return 1
+
+
+    def writeTexPreamble (self, texObject) :
+        '''Write out all the macro, style, settings and hyphenation links
+        that come before any components in a TeX control file.'''
+
+        # First bring in the main macro file
+        texObject.write('\\input \"' + self.local.primaryMacroFile + '\"\n')
+        # Check for a preStyle extension file and load if it is there
+        if os.path.exists(self.local.preStyTexExtFile) :
+            texObject.write('\\input \"' + self.local.preStyTexExtFile + '\"\n')
+        ########
+        # FIXME? To avoid problems with the usfmTex marginalverses macro code, we bring
+        # in the stylesheets now. Will this cause any problems with other macPacks?
+        ########
+        # Load style files (default and extention come with the package)
+        texObject.write('\\stylesheet{' + self.local.defaultStyFile + '}\n')
+        # Load the global style extensions
+        texObject.write('\\stylesheet{' + self.local.glbExtStyFile + '}\n')
+        # Load the group style extensions (if needed)
+        if self.projectConfig['Groups'][self.gid].has_key('useGrpStyOverride') and self.tools.str2bool(self.projectConfig['Groups'][self.gid]['useGrpStyOverride']) :
+            self.makeGrpExtStyFile()
+            texObject.write('\\stylesheet{' + self.local.grpExtStyFile + '}\n')
+        # Load the settings (usfmTex: if marginalverses, load code in this)
+        texObject.write('\\input \"' + self.local.macSettingsFile + '\"\n')
+        # Load the TeX macro extensions for this macro package
+        texObject.write('\\input \"' + self.local.extTexFile + '\"\n')
+        # Load the group TeX macro extensions (if needed)
+        if self.projectConfig['Groups'][self.gid].has_key('useGrpTexOverride') and self.tools.str2bool(self.projectConfig['Groups'][self.gid]['useGrpTexOverride']) :
+            self.makeGrpExtTexFile()
+            texObject.write('\\input \"' + self.local.grpExtTexFile + '\"\n')
+        # Point to the low resolution illustrations for a draft render
+        if self.draftIllustrationFolder :
+            texObject.write('\\PicPath={' + self.draftIllustrationFolder + '/}\n')
+        # Load hyphenation data if needed
+        if self.useHyphenation :
+            # This is the main hyphenation settings file, this must be loaded first
+            texObject.write('\\input \"' + self.proj_hyphenation.projHyphSetTexFile + '\"\n')
+            # This is the character definition file for hyphenation, this should be loaded second
+            texObject.write('\\input \"' + self.proj_hyphenation.projHyphCharTexFile + '\"\n')
+            # This is the exception words list (all the hyphenated words), this is loaded last
+            texObject.write('\\input \"' + self.proj_hyphenation.projHyphExcTexFile + '\"\n')
+
+
+    def writeTexPreambleOrFormat (self, texObject) :
+        '''If a preloaded format is being used, the preamble is already in
+        it so just make a note of the format. Otherwise write out the
+        whole preamble.'''
+
+        if self.texFormat :
+            texObject.write('% Macros and settings are preloaded in format: ' + self.texFormat + '\n')
+        else :
+            self.writeTexPreamble(texObject)
+
+
+    def writeCidTexLines (self, texObject, cid, source = None) :
+        '''Write out the lines needed to render one component, including
+        any component level TeX and style override files. A source can be
+        given to use in place of the cid working text.'''
+
+        # Output files and commands for usfm cType
+        if self.cType == 'usfm' :
+            # Have XeTeX note in the log what page this cid starts on (see XetexLog)
+            texObject.write('\\write-1{RapumaCidStart:' + cid + ':\\the\\pageno}\n')
+            cidSource       = source or self.project.groups[self.gid].getCidPath(cid)
+            cidTexFileOn    = os.path.join(self.local.projTexFolder, self.gid + '-' + cid + '-On-ext.tex')
+            cidTexFileOff   = os.path.join(self.local.projTexFolder, self.gid + '-' + cid + '-Off-ext.tex')
+            cidStyFileOn    = os.path.join(self.local.projStyleFolder, self.gid + '-' + cid + '-On-ext.sty')
+            cidStyFileOff   = os.path.join(self.local.projStyleFolder, self.gid + '-' + cid + '-Off-ext.sty')
+            # Check to see if a TeX macro override is needed
+            if self.projectConfig['Groups'][self.gid].has_key('compTexOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compTexOverrideList'] :
+                self.makeCmpExtTexFileOn(cidTexFileOn)
+                texObject.write('\\input \"' + cidTexFileOn + '\"\n')
+            # Check to see if a style override is needed (if so create "on" file)
+            if self.projectConfig['Groups'][self.gid].has_key('compStyOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compStyOverrideList'] :
+                self.makeCmpExtStyFileOn(cidStyFileOn)
+                texObject.write('\\stylesheet{' + cidStyFileOn + '}\n')
+            # Check for short books add omit statement
+            if self.chapNumOffSingChap and self.cidChapNumDict[cid] == 1 :
+                texObject.write('\\OmitChapterNumbertrue\n') 
+            # Add the working file here
+            texObject.write('\\ptxfile{' + cidSource + '}\n')
+            # Check again for short books turn off omit statement
+            if self.chapNumOffSingChap and self.cidChapNumDict[cid] == 1 :
+                texObject.write('\\OmitChapterNumberfalse\n') 
+            # Check for for style override and add the "Off" style file here
+            if self.projectConfig['Groups'][self.gid].has_key('compStyOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compStyOverrideList'] :
+                self.makeCmpExtStyFileOn(cidStyFileOff)
+                texObject.write('\\stylesheet{' + cidStyFileOff + '}\n')
+            # Check for for TeX macro override and add the "Off" TeX file here
+            if self.projectConfig['Groups'][self.gid].has_key('compTexOverrideList') and cid in self.projectConfig['Groups'][self.gid]['compTexOverrideList'] :
+                self.makeCmpExtTexFileOff(cidTexFileOff)
+                texObject.write('\\input \"' + cidTexFileOff + '\"\n')
+        else :
+            self.log.writeToLog(self.errorCodes['0650'], [self.cType])
+
+
     def makeXoneACompliant (self) :
         '''Insert the necessary TeX code into the header to give the
         appearance of being PDF x1-a compliant. If the feature is turned
@@ -635,11 +873,37 @@ class Xetex (Manager) :
                 cnid = "{:0>3}".format(self.cidPtIdDict[cid])
                 cidListSubFileName = cnid + '-' + cid
 
+        # Parallel rendering is only worth doing if there is more than one cid
+        # (It is always used in watch mode so only the changed cids are rendered again)
+        # or if big cids have been split into chunks
+        units = self.getRenderUnits(cidList)
+        parallel = ((self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex'].get('useParallelRender', '')) \
+                        or self.project.watchMode) and len(cidList) > 1) or len(units) > len(cidList)
+        # In two stage mode typesetting (XeTeX) and PDF output (xdvipdfmx) are done separately
+        self.twoStageRender = self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex'].get('useTwoStageRender', ''))
+
+        # Create the environment that XeTeX will use
+        envDict = self.makeXetexEnv()
+
+        # Get the draft illustrations ready before anything is written that uses them
+        if self.draftMode :
+            self.log.writeToLog(self.errorCodes['0765'], [gid, self.local.gidPdfFile])
+            with self.trace.span('draftIllustrations') :
+                size = self.projectConfig['Managers'][self.cType + '_Xetex'].get('draftIllustrationSize', '600')
+                self.draftIllustrationFolder = self.proj_illustration.makeDraftIllustrations(size)
+
         # Create, if necessary, the gid.tex file
         # First, go through and make/update any dependency files
-        self.makeSettingsTexFile()
-        # Now make the gid main setting file
-        self.makeGidTexFile(cidList)
+        with self.trace.span('settingsTexFile') :
+            self.makeSettingsTexFile()
+        # Dump (if needed) a format file with all the macros and settings preloaded
+        with self.trace.span('texFormat') :
+            self.texFormat = self.makeTexFormat(envDict)
+        # Now make the gid main setting file. This is made even for a parallel
+        # render (cid files are made as they are rendered) as it is part of
+        # the render cache key
+        with self.trace.span('gidTexFile') :
+            self.makeGidTexFile(cidList)
         # Dynamically create a dependency list for the render process
         # Note: gidTexFile is remade on every run, do not test against that file
         dep = [self.local.extTexFile, self.local.projectConfFile, self.local.layoutConfFile, 
@@ -657,78 +921,122 @@ class Xetex (Manager) :
                 if os.path.exists(cidAdj) :
                     dep.append(cidAdj)
 
-        # Call the renderer
-        # Create the environment that XeTeX will use. This will be temporarily set
-        # by subprocess.call() just before XeTeX is run.
-        texInputsLine = self.project.local.projHome + ':' \
-                        + self.local.projStyleFolder + ':' \
-                        + self.local.projTexFolder + ':' \
-                        + self.local.projMacPackFolder + ':' \
-                        + self.local.projMacroFolder + ':' \
-                        + self.local.projGidFolder + ':.'
-
-        # Create the environment dictionary that will be fed into subprocess.call()
-        #envDict = dict(os.environ)
-        envDict={}
-        # These are project environment vars
-        envDict['TEXINPUTS'] = texInputsLine
-        # These are XeTeX environment vars that are run if the internal (fast) version
-        # of XeTeX is being run, which is the default. If runExternalXetex is set to
-        # False, the following special environment vars will be run. If set to true,
-        # an external version of XeTeX, provided it is installed, will run with its own
-        # environment vars set elsewhere
-        runExternal = self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex'].get('runExternalXetex', ''))
-        if not runExternal :
-            envDict['PATH'] = os.path.join(self.local.rapumaXetexFolder, 'bin', 'x86_64-linux')
-            envDict['TEXMFCNF'] = os.path.join(self.local.rapumaXetexFolder, 'texmf-local', 'web2c')
-            envDict['TEXFORMATS'] = os.path.join(self.local.rapumaXetexFolder, 'texmf-local', 'web2c', 'xetex')
-            # To help with debugging the following hook has been added. This is not
-            # something the user would ever use. It is only for developer diagnostics.
-            # for infomation on what integers can be used refer to this URL:
-            # http://www.dcs.ed.ac.uk/home/latex/Informatics/Obsolete/html/kpathsea/kpathsea.html
-            debugXetex = self.projectConfig['Managers'][self.cType + '_Xetex'].get('debugKpse', None)
-            if debugXetex :
-                try :
-                    if int(debugXetex) > 0 :
-                        envDict['KPATHSEA_DEBUG'] = debugXetex
-                        self.log.writeToLog(self.errorCodes['1000'], [str(debugXetex), str(envDict)])
-                except :
-                    self.log.writeToLog(self.errorCodes['1090'], [debugXetex])
+        # If nothing has changed since this was last rendered, there is no need
+        # to run XeTeX, we can pull the results out of the render cache
+        totalPages = None
+        cacheKey = None
+        components = {}
+        xetexTime = None
+        if self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex'].get('useRenderCache', 'True')) :
+            with self.trace.span('renderCacheLookup') :
+                cacheKey = self.makeRenderCacheKey(dep)
+                totalPages = self.getCachedRender(cacheKey)
+
+        # XeTeX and xdvipdfmx write into their output files which could be
+        # linked to a saved or cached copy (see Tools.materializeFile())
+        if totalPages == None :
+            for f in [self.local.gidPdfFile, self.getXdvFile(self.local.gidTexFile)] :
+                self.tools.unshareFile(f)
+
+        # Only a render that finished, and wrote a new PDF, goes in the cache
+        renderOk = True
+        renderStart = time.time()
+        if totalPages != None :
+            self.log.writeToLog(self.errorCodes['0660'], [self.local.gidPdfFileName, str(totalPages)])
+        elif parallel :
+            # Each cid gets its own XeTeX process, the results are joined into the gidPdfFile
+            (components, renderOk) = self.renderParallel(cidList, envDict, units)
         else :
-            envDict.update(os.environ)
+            # In two stage mode, if the typesetting has not changed (only things like
+            # the background) the XDV file from last time can go straight to xdvipdfmx
+            xdvKey = None
+            gidXdvFile = self.getXdvFile(self.local.gidTexFile)
+            if self.twoStageRender :
+                xdvKey = self.makeXdvCacheKey(cidList)
+            if xdvKey and self.getCachedXdv(xdvKey, gidXdvFile) :
+                self.log.writeToLog(self.errorCodes['0750'], [self.local.gidTexFileName])
+            else :
+                # Create the XeTeX command argument list that subprocess.call() will run with
+                # the environment vars we set above
+                cmds = self.makeXetexCmd(self.local.gidTexFile)
 
-        # Create the XeTeX command argument list that subprocess.call() will run with
-        # the environment vars we set above
-        cmds = ['xetex', '-output-directory=' + self.local.projGidFolder, self.local.gidTexFile]
+                # For debugging purposes, output the following DBG message
+                if self.projectConfig['Managers'][self.cType + '_Xetex'].has_key('freezeTexSettings') and \
+                        self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex']['freezeTexSettings']) :
+                    self.log.writeToLog(self.errorCodes['0620'], [os.getcwd(), str(envDict), " ".join(cmds)])
 
-        # For debugging purposes, output the following DBG message
-        if self.projectConfig['Managers'][self.cType + '_Xetex'].has_key('freezeTexSettings') and \
-                self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex']['freezeTexSettings']) :
-            self.log.writeToLog(self.errorCodes['0620'], [os.getcwd(), str(envDict), " ".join(cmds)])
+                # Run the XeTeX and collect the return code for analysis
+                try :
+                    with self.trace.span('xetex', {'file' : self.local.gidTexFileName}) :
+                        xetexStart = time.time()
+                        rCode = subprocess.call(cmds, env = envDict)
+                        xetexTime = round(time.time() - xetexStart, 2)
+                    self.reportXetexResult(self.local.gidTexFileName, rCode)
+                    renderOk = rCode == 0
+                except Exception as e :
+                    # If subprocess fails it might be because XeTeX did not execute
+                    # we will try to report back something useful
+                    renderOk = False
+                    self.log.writeToLog(self.errorCodes['0615'], [str(e)])
+
+                # Pick out what XeTeX had to say about each cid
+                with self.trace.span('xetexLog') :
+                    xetexLog = XetexLog(self.getCidFiles(cidList))
+                    xetexLog.parseFile(self.getXetexLogFile(self.local.gidTexFile))
+                    self.updateDiagnostics(cidList, xetexLog.getIndex())
+                    components = self.calcSerialPages(cidList, xetexLog.getPageMarks())
+                    if len(cidList) == 1 :
+                        components.setdefault(cidList[0], {})['xetexTime'] = xetexTime
+
+                if xdvKey and renderOk :
+                    self.storeCachedXdv(xdvKey, gidXdvFile)
+
+            # Second stage, make the PDF
+            if self.twoStageRender :
+                try :
+                    with self.trace.span('xdvipdfmx', {'file' : self.tools.fName(gidXdvFile)}) :
+                        rCode = subprocess.call(self.makeXdvipdfmxCmd(gidXdvFile, self.local.gidPdfFile), env = envDict)
+                except Exception as e :
+                    rCode = str(e)
+                if rCode != 0 :
+                    renderOk = False
+                    self.log.writeToLog(self.errorCodes['0755'], [self.tools.fName(gidXdvFile), str(rCode)])
 
-        # Run the XeTeX and collect the return code for analysis
-        try :
-            rCode = subprocess.call(cmds, env = envDict)
-            # Analyse the return code
-            if rCode == int(0) :
-                self.log.writeToLog(self.errorCodes['0625'], [self.local.gidTexFileName])
-            elif rCode in self.xetexErrorCodes :
-                self.log.writeToLog(self.errorCodes['0630'], [self.local.gidTexFileName, self.xetexErrorCodes[rCode], str(rCode)])
-            else :
-                self.log.writeToLog(self.errorCodes['0635'], [str(rCode)])
-        except Exception as e :
-            # If subprocess fails it might be because XeTeX did not execute
-            # we will try to report back something useful
-            self.log.writeToLog(self.errorCodes['0615'], [str(e)])
+        # Let the user know if there is anything in the log to look at
+        self.reportDiagnostics(cidList)
 
         # Collect the page count and record in group (Write out at the end of the opp.)
-        self.projectConfig['Groups'][gid]['totalPages'] = str(PdfFileReader(open(self.local.gidPdfFile)).getNumPages())
+        if totalPages == None :
+            # A PDF left from some earlier render does not count
+            renderOk = renderOk and self.renderedSince(self.local.gidPdfFile, renderStart)
+            totalPages = self.tools.pdfTotalPages(self.local.gidPdfFile)
+            # The last cid runs to the end of the group
+            if not parallel :
+                lastCid = cidList[-1]
+                if components.get(lastCid, {}).get('startPage') != None :
+                    components[lastCid]['pages'] = self.getStartPageNumber(cidList) + totalPages - components[lastCid]['startPage']
+            with self.trace.span('renderManifest') :
+                self.updateRenderManifest(cidList, components, totalPages, renderOk and cacheKey or None, xetexTime)
+            if cacheKey and renderOk :
+                with self.trace.span('renderCacheStore') :
+                    self.storeCachedRender(cacheKey, totalPages)
+            elif cacheKey :
+                self.log.writeToLog(self.errorCodes['0667'], [self.local.gidPdfFileName])
+                self.dropCachedRender(cacheKey)
+        # A speculative render is only done to fill the render cache
+        if self.speculative :
+            return True
+        # A draft or slice can come out a different length so it is not recorded
+        if not self.draftMode and not self.renderRef :
+            self.projectConfig['Groups'][gid]['totalPages'] = str(totalPages)
         # Write out any changes made to the project.conf file that happened during this opp.
         self.tools.writeConfFile(self.projectConfig)
 
-        # Pull out pages if requested (use the same file for output)
+        # Pull out pages if requested. This goes to its own file, the gidPdfFile
+        # is left whole so it can still be used for binding.
+        outputFile = self.local.gidPdfFile
         if pgRange :
-            self.tools.pdftkPullPages(self.local.gidPdfFile, self.local.gidPdfFile, pgRange)
+            outputFile = self.tools.pdfPullPages(self.local.gidPdfFile, self.local.gidPagesPdfFile, pgRange)
 
         # The gidPdfFile is the residue of the last render and if approved, can be
         # used for the binding process. In regard to saving and file naming, the
@@ -741,6 +1049,10 @@ class Xetex (Manager) :
                 saveFileName = saveFileName + '_' + cidListSubFileName
             if pgRange :
                 saveFileName = saveFileName + '_pg(' + pgRange + ')'
+            if self.renderRef :
+                saveFileName = saveFileName + '_' + re.sub(r'[^\w-]+', '.', self.renderRef.strip())
+            if self.draftMode :
+                saveFileName = saveFileName + '_draft'
             # Add date stamp
             saveFileName = saveFileName + '_' + self.tools.ymd()
             # Add render file extention
@@ -750,20 +1062,19 @@ class Xetex (Manager) :
                 os.makedirs(self.local.projDeliverableFolder)
             # Final file name and path
             saveFile = os.path.join(self.local.projDeliverableFolder, saveFileName)
-            # Copy, no news is good news
-            if shutil.copy(self.local.gidPdfFile, saveFile) :
-                self.log.writeToLog(self.errorCodes['0730'], [saveFileName])
+            # Link or copy it, whatever the file system can do fastest
+            if self.tools.materializeFile(outputFile, saveFile) :
+                self.log.writeToLog(self.errorCodes['0720'], [saveFileName])
             else :
-                self.log.writeToLog(self.errorCodes['0720'], [saveFileName])            
+                self.log.writeToLog(self.errorCodes['0730'], [saveFileName])
 
         # If given, the override file name becomes the file name 
         if override :
             saveFile = override
-            # With shutil.copy(), no news is good news
-            if shutil.copy(self.local.gidPdfFile, saveFile) :
-                self.log.writeToLog(self.errorCodes['0730'], [saveFileName])
-            else :
+            if self.tools.materializeFile(outputFile, saveFile) :
                 self.log.writeToLog(self.errorCodes['0720'], [saveFileName])
+            else :
+                self.log.writeToLog(self.errorCodes['0730'], [saveFileName])
 
         # Once we know the file is successfully generated, add a background if defined
         viewFile = ''
@@ -771,7 +1082,7 @@ class Xetex (Manager) :
             if saveFile :
                 viewFile = self.pg_back.addBackground(saveFile)
             else :
-                viewFile = self.pg_back.addBackground(self.local.gidPdfFile)
+                viewFile = self.pg_back.addBackground(outputFile)
                 
         # Add a timestamp and doc info if requested in addition to background
         if self.useDocInfo :
@@ -784,15 +1095,16 @@ class Xetex (Manager) :
                 if os.path.isfile(viewFile) :
                     viewFile = self.pg_back.addDocInfo(viewFile)
                 else :
-                    viewFile = self.pg_back.addDocInfo(self.local.gidPdfFile)
+                    viewFile = self.pg_back.addDocInfo(outputFile)
 
         # Add a diagnostic layer to the rendered output. Normally this is
         # not used with a normal background layer
         if self.useDiagnostic :
-            if saveFile :
-                viewFile = self.fmt_diagnose.addTransparency(saveFile)
-            else :
-                viewFile = self.fmt_diagnose.addTransparency(self.local.gidPdfFile)
+            with self.trace.span('addTransparency') :
+                if saveFile :
+                    viewFile = self.fmt_diagnose.addTransparency(saveFile)
+                else :
+                    viewFile = self.fmt_diagnose.addTransparency(outputFile)
 
         # To avoid confusion with file names, if this is a saved file,
         # and it has a background, we need to remove the original, non-
@@ -814,11 +1126,14 @@ class Xetex (Manager) :
         else :
             # The view file in this case is just temporary
             if not os.path.isfile(viewFile) :
-                viewFile = self.local.gidPdfFile.replace(gid + '.pdf', gid + '-view.pdf')
-                shutil.copy(self.local.gidPdfFile, viewFile)
+                viewFile = os.path.splitext(outputFile)[0] + '-view.pdf'
+                self.tools.materializeFile(outputFile, viewFile)
 
-        # Now view it
+        # Now view it (In watch mode the viewer is only started once, it
+        # should pick up the changes to the view file after that)
         if os.path.isfile(viewFile) :
+            if not self.project.viewRender :
+                return True
             if self.pdfViewerCmd :
                 # Add the file to the viewer command
                 self.pdfViewerCmd.append(viewFile)
@@ -838,3 +1153,859 @@ class Xetex (Manager) :
         return True
 
 
+###############################################################################
+############################## Parallel Functions #############################
+###############################################################################
+######################## Error Code Block Series = 0600 #######################
+###############################################################################
+
+    def makeXetexEnv (self) :
+        '''Create the environment that XeTeX will use. This will be temporarily set
+        by subprocess.call() just before XeTeX is run.'''
+
+        texInputsLine = self.project.local.projHome + ':' \
+                        + self.local.projStyleFolder + ':' \
+                        + self.local.projTexFolder + ':' \
+                        + self.local.projMacPackFolder + ':' \
+                        + self.local.projMacroFolder + ':' \
+                        + self.local.projGidFolder + ':.'
+
+        # Create the environment dictionary that will be fed into subprocess.call()
+        #envDict = dict(os.environ)
+        envDict={}
+        # These are project environment vars
+        envDict['TEXINPUTS'] = texInputsLine
+        # These are XeTeX environment vars that are run if the internal (fast) version
+        # of XeTeX is being run, which is the default. If runExternalXetex is set to
+        # False, the following special environment vars will be run. If set to true,
+        # an external version of XeTeX, provided it is installed, will run with its own
+        # environment vars set elsewhere
+        runExternal = self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex'].get('runExternalXetex', ''))
+        if not runExternal :
+            envDict['PATH'] = os.path.join(self.local.rapumaXetexFolder, 'bin', 'x86_64-linux')
+            envDict['TEXMFCNF'] = os.path.join(self.local.rapumaXetexFolder, 'texmf-local', 'web2c')
+            # Project formats are looked for first, then the ones that come with Rapuma
+            envDict['TEXFORMATS'] = self.getTexFormatFolder() + ':' + os.path.join(self.local.rapumaXetexFolder, 'texmf-local', 'web2c', 'xetex')
+            # To help with debugging the following hook has been added. This is not
+            # something the user would ever use. It is only for developer diagnostics.
+            # for infomation on what integers can be used refer to this URL:
+            # http://www.dcs.ed.ac.uk/home/latex/Informatics/Obsolete/html/kpathsea/kpathsea.html
+            debugXetex = self.projectConfig['Managers'][self.cType + '_Xetex'].get('debugKpse', None)
+            if debugXetex :
+                try :
+                    if int(debugXetex) > 0 :
+                        envDict['KPATHSEA_DEBUG'] = debugXetex
+                        self.log.writeToLog(self.errorCodes['1000'], [str(debugXetex), str(envDict)])
+                except :
+                    self.log.writeToLog(self.errorCodes['1090'], [debugXetex])
+        else :
+            envDict.update(os.environ)
+            # Add our format folder to the search path, the trailing
+            # separator brings in the default XeTeX format path
+            envDict['TEXFORMATS'] = self.getTexFormatFolder() + ':' + os.environ.get('TEXFORMATS', '')
+
+        return envDict
+
+
+    def makeXetexCmd (self, texFile, batch = False) :
+        '''Return the XeTeX command argument list for a TeX control file.
+        In batch mode XeTeX will not stop for input or write to the terminal,
+        this is needed when more than one XeTeX is running at the same time.'''
+
+        cmds = ['xetex', '-output-directory=' + self.local.projGidFolder]
+        if batch :
+            cmds.append('-interaction=batchmode')
+        if self.texFormat :
+            cmds.append('-fmt=' + self.texFormat)
+        if self.twoStageRender :
+            cmds.append('-no-pdf')
+
+        return cmds + [texFile]
+
+
+    def makeXdvipdfmxCmd (self, xdvFile, pdfFile, quiet = False) :
+        '''Return the xdvipdfmx command argument list to turn an XDV
+        file into a PDF file.'''
+
+        cmds = ['xdvipdfmx']
+        if quiet :
+            cmds.append('-q')
+
+        return cmds + ['-o', pdfFile, xdvFile]
+
+
+    def getXdvFile (self, texFile) :
+        '''Return the name of the XDV file XeTeX makes for a TeX file
+        in two stage mode.'''
+
+        return os.path.join(self.local.projGidFolder, os.path.splitext(os.path.basename(texFile))[0] + '.xdv')
+
+
+    def reportXetexResult (self, texFileName, rCode) :
+        '''Analyse the return code from a XeTeX run and report it.'''
+
+        if rCode == int(0) :
+            self.log.writeToLog(self.errorCodes['0625'], [texFileName])
+        elif rCode in self.xetexErrorCodes :
+            self.log.writeToLog(self.errorCodes['0630'], [texFileName, self.xetexErrorCodes[rCode], str(rCode)])
+        else :
+            self.log.writeToLog(self.errorCodes['0635'], [str(rCode)])
+
+
+    def getRenderWorkerCount (self, jobs) :
+        '''Return the number of XeTeX processes that can be run at once.
+        Zero (the default) means use one for each CPU.'''
+
+        try :
+            workers = int(self.projectConfig['Managers'][self.cType + '_Xetex'].get('renderWorkers', 0))
+        except :
+            workers = 0
+        if workers < 1 :
+            workers = multiprocessing.cpu_count()
+
+        return max(1, min(workers, jobs))
+
+
+    def loadRenderManifest (self) :
+        '''Return the render manifest dictionary for this group. It has a
+        group section about the last render and a components section with
+        an entry for each cid. If there is not one yet, or it cannot be
+        read, return an empty one.'''
+
+        try :
+            with codecs.open(self.local.gidRenderManifestFile, "r", encoding='utf_8') as manObject :
+                manifest = json.load(manObject)
+            if manifest.has_key('group') and manifest.has_key('components') :
+                return manifest
+        except :
+            pass
+        return {'group' : {}, 'components' : {}}
+
+
+    def saveRenderManifest (self, manifest) :
+        '''Write out the render manifest dictionary for this group.'''
+
+        with codecs.open(self.local.gidRenderManifestFile, "w", encoding='utf_8') as manObject :
+            json.dump(manifest, manObject, indent = 4, sort_keys = True)
+
+
+    def updateRenderManifest (self, cidList, components, totalPages, cacheKey, xetexTime) :
+        '''Record what went into a render and where each cid ended up in
+        the render manifest. Components has what the render found out
+        about each cid (startPage, pages, xetexTime, etc.), the input file
+        hashes, warning count and end page are worked out here. Entries
+        for cids that were not in this render are left as they were.'''
+
+        manifest = self.loadRenderManifest()
+        diagnostics = self.loadDiagnostics()
+        for cid in cidList :
+            entry = manifest['components'].setdefault(cid, {})
+            if components.has_key(cid) :
+                entry.pop('pages', None)
+                entry.pop('endPage', None)
+                entry.pop('chunks', None)
+                entry.pop('chunkSource', None)
+                entry.update(components[cid])
+            entry.setdefault('outputFile', self.local.gidPdfFile)
+            if entry.get('startPage') != None and entry.get('pages') != None :
+                entry['endPage'] = entry['startPage'] + entry['pages'] - 1
+            entry['inputs'] = dict([(self.tools.fName(f), self.hashFiles([f])) for f in self.getCidInputFiles(cid) if os.path.isfile(f)])
+            entry['warnings'] = sum(diagnostics.get(cid, {}).get('counts', {}).values())
+
+        manifest['group'] = {
+            'gid'           : self.gid,
+            'cidList'       : list(cidList),
+            'date'          : self.tools.tStamp(),
+            'firstPage'     : self.getStartPageNumber(cidList),
+            'totalPages'    : totalPages,
+            'cacheKey'      : cacheKey,
+            'xetexTime'     : xetexTime,
+            'outputFile'    : self.local.gidPdfFile
+        }
+        self.saveRenderManifest(manifest)
+
+
+    def calcSerialPages (self, cidList, pageMarks) :
+        '''Work out the start page and page count of each cid in a group
+        rendered in one XeTeX run from the page marks it left in the log.
+        The page count of the last cid needs the total so is left out.'''
+
+        components = {}
+        for i, cid in enumerate(cidList) :
+            if not pageMarks.has_key(cid) :
+                continue
+            components[cid] = {'startPage' : pageMarks[cid], 'outputFile' : self.local.gidPdfFile}
+            if i + 1 < len(cidList) and pageMarks.has_key(cidList[i + 1]) :
+                components[cid]['pages'] = pageMarks[cidList[i + 1]] - pageMarks[cid]
+
+        return components
+
+
+    def getCidInputFiles (self, cid) :
+        '''Return a list of the files that belong to a single cid, the
+        working text, adjustment, piclist and illustration files.'''
+
+        files = [self.project.groups[self.gid].getCidPath(cid), self.proj_illustration.getCidPiclistFile(cid)]
+        if self.cType == 'usfm' :
+            files.append(self.project.groups[self.gid].getCidAdjPath(cid))
+        try :
+            for i in self.proj_illustration.illustrationConfig[self.gid].keys() :
+                if self.proj_illustration.illustrationConfig[self.gid][i]['bid'] == cid :
+                    files.append(os.path.join(self.local.projIllustrationFolder, self.proj_illustration.illustrationConfig[self.gid][i]['fileName']))
+        except :
+            pass
+
+        return files
+
+
+    def getCidFiles (self, cidList) :
+        '''Return a dict of the working text file names for the cids
+        in the list, {fileName : (cid, path)}, for the XeTeX log parser.'''
+
+        cidFiles = {}
+        for cid in cidList :
+            path = self.project.groups[self.gid].getCidPath(cid)
+            cidFiles[os.path.basename(path)] = (cid, path)
+        return cidFiles
+
+
+    def getXetexLogFile (self, texFile) :
+        '''Return the name of the log file XeTeX makes for a TeX file.'''
+
+        return os.path.join(self.local.projGidFolder, os.path.splitext(os.path.basename(texFile))[0] + '.log')
+
+
+    def loadDiagnostics (self) :
+        '''Return the diagnostics dictionary for this group, or an empty
+        one if there is not one yet.'''
+
+        try :
+            with codecs.open(self.local.gidDiagnosticsFile, "r", encoding='utf_8') as diagObject :
+                return json.load(diagObject)
+        except :
+            return {}
+
+
+    def updateDiagnostics (self, cidList, index) :
+        '''Replace the diagnostic entries for the cids in the list with
+        what is in the index (a XetexLog index) and save them.'''
+
+        diagnostics = self.loadDiagnostics()
+        for cid in cidList + ['-'] :
+            if diagnostics.has_key(cid) :
+                del diagnostics[cid]
+        diagnostics.update(index)
+        with codecs.open(self.local.gidDiagnosticsFile, "w", encoding='utf_8') as diagObject :
+            json.dump(diagnostics, diagObject, indent = 4, sort_keys = True)
+
+
+    def reportDiagnostics (self, cidList) :
+        '''Give a summary of what XeTeX reported for the cids in the list.'''
+
+        diagnostics = self.loadDiagnostics()
+        totals = {}
+        for cid in cidList + ['-'] :
+            for (wClass, count) in diagnostics.get(cid, {}).get('counts', {}).items() :
+                totals[wClass] = totals.get(wClass, 0) + count
+        if totals :
+            summary = ', '.join([c + ' (' + str(totals[c]) + ')' for c in sorted(totals.keys())])
+            self.log.writeToLog(self.errorCodes['0740'], [summary, self.local.gidDiagnosticsFileName])
+        else :
+            self.log.writeToLog(self.errorCodes['0745'], [self.gid])
+
+
+    def calcStartPages (self, cidList, pageCounts, firstPage) :
+        '''Return a dictionary of start pages for each cid based on the
+        page count of the cids that come before it.'''
+
+        startPages = {}
+        page = firstPage
+        for cid in cidList :
+            startPages[cid] = page
+            page = page + pageCounts.get(cid, 0)
+
+        return startPages
+
+
+    def renderParallel (self, cidList, envDict, units) :
+        '''Render each unit (a cid or a chunk of one, see getRenderUnits())
+        in its own XeTeX process on a pool of workers, then join the
+        results, in order, into the gidPdfFile. Start pages come from the
+        page counts recorded in the render manifest. If a page count comes
+        out different than expected, the units that follow it are rendered
+        again with the corrected start page so the page numbers run on
+        across cids and chunks. Every chunk ends with a page break, if one
+        (other than the last) ends on a page that is not full, the text
+        would not have broken there so the cid is rendered again as a
+        whole. A unit that has not changed since it was last rendered, and
+        starts on the same page, is not rendered again. Return what was
+        found out about each cid for the render manifest and if all the
+        units rendered. A unit that did not is left without a key so it
+        will not be reused.'''
+
+#        import pdb; pdb.set_trace()
+
+        firstPage   = self.getStartPageNumber(cidList)
+        manifest    = self.loadRenderManifest()['components']
+        # A cid that had to be rendered whole last time, and has not
+        # changed since, is not worth splitting again
+        joined      = {}
+        for cid in cidList :
+            sourceKey = manifest.get(cid, {}).get('chunkSource')
+            if sourceKey and len([u for u in units if u[1] == cid]) > 1 \
+                    and sourceKey == self.hashFiles([self.project.groups[self.gid].getCidPath(cid)]) :
+                self.log.writeToLog(self.errorCodes['0642'], [cid])
+                units = self.joinChunks(units, cid)
+                joined[cid] = sourceKey
+        unitIds     = [u[0] for u in units]
+        unitCids    = dict([(u[0], u[1]) for u in units])
+        unitSources = dict([(u[0], u[2]) for u in units])
+        # What was recorded for each unit last time, chunks are kept with their cid
+        last        = {}
+        for (unit, cid, source) in units :
+            if unit == cid :
+                last[unit] = manifest.get(cid, {})
+            else :
+                last[unit] = manifest.get(cid, {}).get('chunks', {}).get(unit, {})
+        pageCounts  = {}
+        for unit in unitIds :
+            try :
+                pageCounts[unit] = int(last[unit]['pages'])
+            except :
+                pageCounts[unit] = 0
+        pageFills   = dict([(unit, last[unit].get('pageFill')) for unit in unitIds])
+
+        usedStarts  = {}
+        xetexTimes  = {}
+        unitKeys    = {}
+        failed      = set()
+        cidFiles    = self.getCidFiles(cidList)
+        for (unit, cid, source) in units :
+            if source :
+                cidFiles[os.path.basename(source)] = (cid, source)
+        todo        = list(unitIds)
+        passes      = 0
+        # Two passes should always be enough, the third is a safety net
+        # (one more is allowed when chunks have to be put back together)
+        maxPasses   = 3
+        workers     = self.getRenderWorkerCount(len(unitIds))
+        pool        = None
+        try :
+            while todo and passes < maxPasses :
+                startPages = self.calcStartPages(unitIds, pageCounts, firstPage)
+                jobs = []
+                for unit in todo :
+                    self.makeCidTexFile(unitCids[unit], startPages[unit], unit, unitSources[unit])
+                    usedStarts[unit] = startPages[unit]
+                    unitKeys[unit] = self.makeCidRenderKey(unitCids[unit], unit)
+                    failed.discard(unit)
+                    # Reuse the last render of this unit if we can
+                    if last[unit].get('key') == unitKeys[unit] \
+                            and last[unit].get('startPage') == startPages[unit] \
+                                and os.path.isfile(self.getCidPdfFile(unit)) :
+                        continue
+                    pdfCmds = None
+                    if self.twoStageRender :
+                        pdfCmds = self.makeXdvipdfmxCmd(self.getXdvFile(self.getCidTexFile(unit)), self.getCidPdfFile(unit), True)
+                    jobs.append((unit, self.makeXetexCmd(self.getCidTexFile(unit), True), envDict,
+                        self.getXetexLogFile(self.getCidTexFile(unit)), cidFiles, pdfCmds))
+
+                if jobs :
+                    if not pool :
+                        pool = multiprocessing.Pool(workers)
+                    self.log.writeToLog(self.errorCodes['0640'], [str(len(jobs)), str(workers)])
+                    passStart = time.time()
+                    with self.trace.span('xetexParallel', {'pass' : passes + 1, 'jobs' : len(jobs)}) :
+                        # In two stage mode each worker runs xdvipdfmx on its own XDV file
+                        # as soon as XeTeX is done with it, so a unit is converted while
+                        # the other workers are still typesetting theirs
+                        for unit, rCode, err, index, xetexTime, converted, pageFill in pool.imap_unordered(renderCidWorker, jobs) :
+                            if err :
+                                self.log.writeToLog(self.errorCodes['0615'], [err])
+                            xetexTimes[unit] = xetexTime
+                            pageFills[unit] = pageFill
+                            self.reportXetexResult(self.tools.fName(self.getCidTexFile(unit)), rCode)
+                            if rCode != 0 or (converted and converted[1] != 0) :
+                                failed.add(unit)
+                            # The diagnostics for chunks are collected when they are all done
+                            if unit == unitCids[unit] :
+                                self.updateDiagnostics([unit], self.claimLogItems(unit, index))
+                            if converted and converted[1] != 0 :
+                                self.log.writeToLog(self.errorCodes['0755'], [self.tools.fName(self.getXdvFile(self.getCidTexFile(unit))), converted[2] or str(converted[1])])
+                    for job in jobs :
+                        if job[0] in failed or not self.renderedSince(self.getCidPdfFile(job[0]), passStart) :
+                            failed.add(job[0])
+                            unitKeys.pop(job[0], None)
+                        pageCounts[job[0]] = self.tools.pdfTotalPages(self.getCidPdfFile(job[0]))
+
+                # Put back together any cid with a chunk that did not end on a
+                # full page, it is rendered whole on the next pass
+                for cid in cidList :
+                    chunks = [unit for unit in unitIds if unitCids[unit] == cid and unit != cid]
+                    if not chunks or len([u for u in chunks[:-1] if not self.chunkEndsFull(pageFills[u])]) == 0 :
+                        continue
+                    self.log.writeToLog(self.errorCodes['0646'], [cid])
+                    units = self.joinChunks(units, cid)
+                    joined[cid] = self.hashFiles([self.project.groups[self.gid].getCidPath(cid)])
+                    last[cid] = manifest.get(cid, {})
+                    pageCounts[cid] = sum([pageCounts[unit] for unit in chunks])
+                    pageFills[cid] = None
+                    unitIds = [u[0] for u in units]
+                    unitCids[cid] = cid
+                    unitSources[cid] = None
+                    maxPasses += 1
+
+                # Any unit that did not start where it should have must be done again
+                startPages = self.calcStartPages(unitIds, pageCounts, firstPage)
+                todo = [unit for unit in unitIds if usedStarts.get(unit) != startPages[unit]]
+                if todo :
+                    self.log.writeToLog(self.errorCodes['0645'], [' '.join(todo)])
+                passes += 1
+        finally :
+            if pool :
+                pool.close()
+                pool.join()
+
+        # Anything still left to do did not get the right start page
+        if todo :
+            self.log.writeToLog(self.errorCodes['0647'], [str(passes), ' '.join(todo)])
+
+        # The diagnostics for a chunked cid come from the logs of all its chunks
+        for cid in cidList :
+            chunks = [unit for unit in unitIds if unitCids[unit] == cid and unit != cid]
+            if chunks :
+                xetexLog = XetexLog(cidFiles)
+                for unit in chunks :
+                    xetexLog.parseFile(self.getXetexLogFile(self.getCidTexFile(unit)))
+                self.updateDiagnostics([cid], self.claimLogItems(cid, xetexLog.getIndex()))
+
+        # Join the results in the order they were given
+        if not self.tools.concatPdfFiles([self.getCidPdfFile(unit) for unit in unitIds], self.local.gidPdfFile) :
+            self.log.writeToLog(self.errorCodes['0655'], [self.local.gidPdfFileName])
+
+        # Report what we found, units that were not rendered keep their last XeTeX time
+        components = {}
+        for (unit, cid, source) in units :
+            entry = {'startPage' : usedStarts[unit], 'pages' : pageCounts[unit], 'key' : unitKeys.get(unit),
+                        'outputFile' : self.getCidPdfFile(unit), 'xetexTime' : xetexTimes.get(unit, last[unit].get('xetexTime'))}
+            if unit == cid :
+                if joined.has_key(cid) :
+                    entry['chunkSource'] = joined[cid]
+                components[cid] = entry
+                continue
+            entry['pageFill'] = pageFills[unit]
+            # A chunked cid is the sum of its chunks
+            whole = components.setdefault(cid, {'startPage' : entry['startPage'], 'pages' : 0, 'xetexTime' : 0,
+                        'outputFile' : self.local.gidPdfFile, 'chunks' : {}})
+            whole['pages'] += entry['pages']
+            if whole['xetexTime'] != None and entry['xetexTime'] != None :
+                whole['xetexTime'] = round(whole['xetexTime'] + entry['xetexTime'], 2)
+            else :
+                whole['xetexTime'] = None
+            whole['chunks'][unit] = entry
+
+        return (components, not failed)
+
+
+    def joinChunks (self, units, cid) :
+        '''Return a list of render units with the chunks of a cid put
+        back together into the whole cid.'''
+
+        joined = []
+        for unit in units :
+            if unit[1] != cid :
+                joined.append(unit)
+            elif (cid, cid, None) not in joined :
+                joined.append((cid, cid, None))
+
+        return joined
+
+
+    def chunkEndsFull (self, pageFill) :
+        '''Return True if how full the page was at the end of a chunk (see
+        XetexLog.getPageFill()) shows there was no room left on it for
+        another line. The goal is \maxdimen if the page was empty, that
+        is, the text ran right to the bottom of the last one. If nothing
+        was noted it cannot be said the page was full.'''
+
+        if not pageFill :
+            return False
+        (total, goal, line) = pageFill
+
+        return goal >= 16383 or goal - total < line
+
+
+    def getRenderUnits (self, cidList) :
+        '''Return a list of (unit, cid, source) for a parallel render. If
+        chunkChapters is set, cids with more chapters than that are split
+        into chunks (see Usfm.makeChunks()) that are rendered separately.
+        The source is the chunk working text, None for a whole cid.'''
+
+        try :
+            chapters = int(self.projectConfig['Managers'][self.cType + '_Xetex'].get('chunkChapters', 0))
+        except :
+            chapters = 0
+        units = []
+        for cid in cidList :
+            chunks = []
+            if chapters and self.cType == 'usfm' :
+                chunks = self.project.groups[self.gid].makeChunks(cid, chapters)
+            if len(chunks) > 1 :
+                for i in range(len(chunks)) :
+                    units.append((cid + '-' + str(i + 1), cid, chunks[i]))
+            else :
+                units.append((cid, cid, None))
+
+        return units
+
+
+    def claimLogItems (self, cid, index) :
+        '''Anything in a XetexLog index that could not be tied to a cid
+        belongs to the cid that was rendered on its own.'''
+
+        if index.has_key('-') :
+            index.setdefault(cid, {'counts' : {}, 'items' : []})
+            for item in index.pop('-')['items'] :
+                index[cid]['items'].append(item)
+                index[cid]['counts'][item['class']] = index[cid]['counts'].get(item['class'], 0) + 1
+        return index
+
+
+###############################################################################
+############################ Render Cache Functions ###########################
+###############################################################################
+######################## Error Code Block Series = 0600 #######################
+###############################################################################
+
+    def makeRenderCacheKey (self, dep) :
+        '''Return a hash of everything that goes into a render. This
+        includes the dependency files, any files the gidTexFile links to,
+        the illustration files, and the macro package files (which stand
+        in for a version number). Lines that change on every run, like
+        time stamps, are left out so they do not spoil the key.'''
+
+#        import pdb; pdb.set_trace()
+
+        files = list(dep) + [self.local.macSettingsFile, self.local.gidTexFile]
+        # Add anything the TeX control file pulls in
+        files = files + self.getLinkedTexFiles(self.local.gidTexFile)
+        # Add the illustration files (the piclist only has their names)
+        try :
+            for i in self.proj_illustration.illustrationConfig[self.gid].keys() :
+                files.append(os.path.join(self.local.projIllustrationFolder, self.proj_illustration.illustrationConfig[self.gid][i]['fileName']))
+        except :
+            pass
+        # Add the macro package files
+        files = files + self.getMacPackFiles()
+
+        return self.hashFiles(files)
+
+
+    def makeXdvCacheKey (self, cidList) :
+        '''Return a hash of the files that go into typesetting the group.
+        This is like the render cache key but the config files are left
+        out. Anything in them that has to do with typesetting ends up in the
+        settings file, things like background and diagnostic settings do
+        not, so changing those will not cause the group to be typeset again.'''
+
+        files = [self.local.macSettingsFile, self.local.gidTexFile] + self.getLinkedTexFiles(self.local.gidTexFile)
+        for cid in cidList :
+            files.append(self.project.groups[self.gid].getCidPath(cid))
+            files.append(self.proj_illustration.getCidPiclistFile(cid))
+            if self.cType == 'usfm' :
+                files.append(self.project.groups[self.gid].getCidAdjPath(cid))
+        try :
+            for i in self.proj_illustration.illustrationConfig[self.gid].keys() :
+                files.append(os.path.join(self.local.projIllustrationFolder, self.proj_illustration.illustrationConfig[self.gid][i]['fileName']))
+        except :
+            pass
+
+        return self.hashFiles(files + self.getMacPackFiles())
+
+
+    def makeCidRenderKey (self, cid, unit = None) :
+        '''Return a hash of everything that goes into the render of a
+        single cid (or a chunk of one). The TeX file must be made before
+        this is called.'''
+
+        cidTexFile = self.getCidTexFile(unit or cid)
+        files = [cidTexFile, self.local.macSettingsFile] + self.getLinkedTexFiles(cidTexFile)
+        # The piclist, adjustment and illustration files are found by name, not linked
+        files = files + self.getCidInputFiles(cid)
+
+        return self.hashFiles(files + self.getMacPackFiles())
+
+
+    def getLinkedTexFiles (self, texFile) :
+        '''Return a list of the files a TeX control file pulls in.'''
+
+        with codecs.open(texFile, "r", encoding='utf_8') as texObject :
+            return re.findall(r'\\(?:input|stylesheet|ptxfile)\s*[{"]([^}"]+)["}]', texObject.read())
+
+
+    def getMacPackFiles (self) :
+        '''Return a sorted list of all the files in the macro package.'''
+
+        files = []
+        for root, dirs, names in os.walk(self.local.projMacPackFolder) :
+            dirs.sort()
+            for name in sorted(names) :
+                files.append(os.path.join(root, name))
+
+        return files
+
+
+    def hashFiles (self, files) :
+        '''Return a hash of the names and contents of a list of files.
+        Lines that change on every run, like time stamps, are left out.
+        Only the base name of each file is used so renders made in another
+        output folder (see useOutputFolder()) come out with the same key.
+        The page counts recorded after a render are left out too. These
+        lines are only looked for in the kind of file they are found in
+        (the "created:" header only on the first line) so the same text
+        anywhere else still counts. Each file is hashed on its own first
+        so nothing can be moved from one file to the next and still come
+        out with the same key.'''
+
+        header = re.compile(r'^[%#] \S+ created: ')
+        volatile = {
+            '.conf'     : re.compile(r'^\s*(lastEdit|totalPages)\s*='),
+            '.tex'      : re.compile(r'^% Settings fingerprint: '),
+            '.pdf'      : re.compile(r'^/ModDate\(')
+        }
+        sha = hashlib.sha1()
+        for f in files :
+            fileHash = '-'
+            if os.path.isfile(f) :
+                fileSha = hashlib.sha1()
+                skip = volatile.get(os.path.splitext(f)[1].lower())
+                with open(f, 'rb') as fileObject :
+                    for i, line in enumerate(fileObject) :
+                        if (i == 0 and header.match(line)) or (skip and skip.match(line)) :
+                            continue
+                        fileSha.update(line)
+                fileHash = fileSha.hexdigest()
+            sha.update(os.path.basename(f).encode('utf_8') + '\0' + fileHash + '\n')
+
+        return sha.hexdigest()
+
+
+    def renderedSince (self, pdfFile, start) :
+        '''Return True if a PDF file is there and was written after a render
+        started (start is from time.time()). File times can be coarser than
+        the clock so only whole seconds are compared.'''
+
+        try :
+            return os.path.getmtime(pdfFile) >= int(start)
+        except OSError :
+            return False
+
+
+    def getCachedRender (self, cacheKey) :
+        '''Look for a render that matches the cache key. If one is found,
+        copy it to the gidPdfFile, put back its render manifest and return
+        its page count. Otherwise return None.'''
+
+        cachePdf = os.path.join(self.local.projRenderCacheFolder, cacheKey + '.pdf')
+        cacheInfo = os.path.join(self.local.projRenderCacheFolder, cacheKey + '.json')
+        if not os.path.isfile(cachePdf) or not os.path.isfile(cacheInfo) :
+            return None
+        try :
+            with codecs.open(cacheInfo, "r", encoding='utf_8') as infoObject :
+                info = json.load(infoObject)
+            totalPages = int(info['pages'])
+            if not self.tools.materializeFile(cachePdf, self.local.gidPdfFile) :
+                return None
+            # Touch it so it will not be pruned too soon
+            os.utime(cachePdf, None)
+            # The cid PDF files on hand could be from some other render so
+            # their keys are dropped, the pages are all in the gidPdfFile
+            if info.has_key('manifest') and self.loadRenderManifest()['group'].get('cacheKey') != cacheKey :
+                for entry in info['manifest']['components'].values() :
+                    entry.pop('key', None)
+                    entry['outputFile'] = self.local.gidPdfFile
+                self.saveRenderManifest(info['manifest'])
+            return totalPages
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['0670'], [str(e)])
+            return None
+
+
+    def storeCachedRender (self, cacheKey, totalPages) :
+        '''Store the gidPdfFile and its page count in the render cache
+        under the cache key. Only the most recently used renders are kept.'''
+
+        cachePdf = os.path.join(self.local.projRenderCacheFolder, cacheKey + '.pdf')
+        cacheInfo = os.path.join(self.local.projRenderCacheFolder, cacheKey + '.json')
+        try :
+            if not os.path.isdir(self.local.projRenderCacheFolder) :
+                os.makedirs(self.local.projRenderCacheFolder)
+            self.tools.materializeFile(self.local.gidPdfFile, cachePdf)
+            with codecs.open(cacheInfo, "w", encoding='utf_8') as infoObject :
+                json.dump({'pages' : totalPages, 'date' : self.tools.tStamp(),
+                    'manifest' : self.loadRenderManifest()}, infoObject, indent = 4)
+            self.log.writeToLog(self.errorCodes['0665'], [self.local.gidPdfFileName, cacheKey])
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['0670'], [str(e)])
+            return False
+
+        self.pruneRenderCache('.pdf')
+        return True
+
+
+    def dropCachedRender (self, cacheKey) :
+        '''Remove a render from the render cache so a render that did not
+        finish cannot be pulled out of it later.'''
+
+        for ext in ['.pdf', '.json'] :
+            f = os.path.join(self.local.projRenderCacheFolder, cacheKey + ext)
+            if os.path.isfile(f) :
+                os.remove(f)
+
+
+    def getCachedXdv (self, xdvKey, xdvFile) :
+        '''Look for an XDV file that matches the key, if found, copy it
+        to the xdvFile and return True.'''
+
+        cacheXdv = os.path.join(self.local.projRenderCacheFolder, xdvKey + '.xdv')
+        if not os.path.isfile(cacheXdv) :
+            return False
+        try :
+            if not self.tools.materializeFile(cacheXdv, xdvFile) :
+                return False
+            os.utime(cacheXdv, None)
+            return True
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['0670'], [str(e)])
+            return False
+
+
+    def storeCachedXdv (self, xdvKey, xdvFile) :
+        '''Store an XDV file in the render cache under the key.'''
+
+        try :
+            if not os.path.isdir(self.local.projRenderCacheFolder) :
+                os.makedirs(self.local.projRenderCacheFolder)
+            self.tools.materializeFile(xdvFile, os.path.join(self.local.projRenderCacheFolder, xdvKey + '.xdv'))
+            self.log.writeToLog(self.errorCodes['0760'], [self.tools.fName(xdvFile), xdvKey])
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['0670'], [str(e)])
+            return False
+
+        self.pruneRenderCache('.xdv')
+        return True
+
+
+    def pruneRenderCache (self, ext) :
+        '''Remove the oldest entries of one kind (by extension) from the
+        render cache so only the most recently used ones are kept.'''
+
+        try :
+            cacheSize = int(self.projectConfig['Managers'][self.cType + '_Xetex'].get('renderCacheSize', 10))
+        except :
+            cacheSize = 10
+        entries = [os.path.join(self.local.projRenderCacheFolder, f) for f in os.listdir(self.local.projRenderCacheFolder) if f.endswith(ext)]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for f in entries[cacheSize:] :
+            for old in [f, os.path.splitext(f)[0] + '.json'] :
+                if os.path.isfile(old) :
+                    os.remove(old)
+
+
+###############################################################################
+############################# TeX Format Functions ############################
+###############################################################################
+######################## Error Code Block Series = 0600 #######################
+###############################################################################
+
+    def getTexFormatFolder (self) :
+        '''Return the folder where the XeTeX format files made for this
+        project are kept.'''
+
+        return self.local.projTexFormatFolder
+
+
+    def makeTexFormat (self, envDict) :
+        '''Dump a XeTeX format file with the macro package, styles and
+        settings preloaded so XeTeX does not have to read them in on every
+        run. The format name has a hash of everything that goes into it
+        so it will be remade when macro.conf, font.conf, the macPack
+        files or any other part of the preamble change. Return the format
+        name to use with -fmt, or None if the macros should be loaded
+        the normal way.'''
+
+#        import pdb; pdb.set_trace()
+
+        if not self.tools.str2bool(self.projectConfig['Managers'][self.cType + '_Xetex'].get('useTexFormat', 'False')) :
+            return None
+
+        fmtFolder = self.getTexFormatFolder()
+        if not os.path.isdir(fmtFolder) :
+            try :
+                os.makedirs(fmtFolder)
+            except OSError :
+                pass
+        if not os.access(fmtFolder, os.W_OK) :
+            self.log.writeToLog(self.errorCodes['0685'], [fmtFolder])
+            return None
+
+        # Write out the preamble with a dump command at the end
+        fmtTexFile = os.path.join(self.local.projGidFolder, self.gid + '-format.tex')
+        with codecs.open(fmtTexFile, "w", encoding='utf_8') as fmtTexObject :
+            fmtTexObject.write(self.tools.makeFileHeader(self.tools.fName(fmtTexFile), 'This is the XeTeX format source file, it is auto-generated.'))
+            self.writeTexPreamble(fmtTexObject)
+            fmtTexObject.write('\\dump\n')
+
+        files = [self.local.macroConfFile, self.local.fontConfFile, fmtTexFile] \
+                    + self.getLinkedTexFiles(fmtTexFile) + self.getMacPackFiles()
+        fmtName = 'rapuma-' + self.macPackId + '-' + self.hashFiles(files)[:16]
+        fmtFile = os.path.join(fmtFolder, fmtName + '.fmt')
+        failFile = os.path.join(fmtFolder, fmtName + '.fail')
+
+        # Use what we have if we can
+        if os.path.isfile(fmtFile) :
+            os.utime(fmtFile, None)
+            return fmtName
+        # Do not try again if this one has failed before
+        if os.path.isfile(failFile) :
+            return None
+
+        # Start from the plain XeTeX format and dump ours. It is dumped
+        # under a name of its own and moved into place when done so another
+        # render never picks up a part made (or stopped) one.
+        jobName = fmtName + '-' + str(os.getpid())
+        cmds = ['xetex', '-ini', '-interaction=batchmode', '-jobname=' + jobName,
+                    '-output-directory=' + fmtFolder, '&xetex', fmtTexFile]
+        try :
+            rCode = subprocess.call(cmds, env = envDict)
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['0615'], [str(e)])
+            return None
+
+        jobFmtFile = os.path.join(fmtFolder, jobName + '.fmt')
+        jobLog = os.path.join(fmtFolder, jobName + '.log')
+        if rCode == 0 and os.path.isfile(jobFmtFile) :
+            os.rename(jobFmtFile, fmtFile)
+            self.log.writeToLog(self.errorCodes['0675'], [fmtName])
+            if os.path.isfile(jobLog) :
+                os.remove(jobLog)
+            self.pruneTexFormats(fmtFolder)
+            return fmtName
+        else :
+            # Leave the log with the fail marker for diagnosing
+            if os.path.isfile(jobLog) :
+                os.rename(jobLog, os.path.join(fmtFolder, fmtName + '.log'))
+            open(failFile, 'w').close()
+            self.log.writeToLog(self.errorCodes['0680'], [fmtName])
+            return None
+
+
+    def pruneTexFormats (self, fmtFolder, keep = 10) :
+        '''Remove all but the most recently used Rapuma format files.'''
+
+        fmts = [os.path.join(fmtFolder, f) for f in os.listdir(fmtFolder) if f.startswith('rapuma-') and f.endswith('.fmt')]
+        fmts.sort(key=os.path.getmtime, reverse=True)
+        for f in fmts[keep:] :
+            os.remove(f)
+
+
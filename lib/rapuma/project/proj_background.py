@@ -25,6 +25,7 @@ from rapuma.core.user_config            import UserConfig
 from rapuma.project.proj_config         import Config
 from rapuma.core.proj_local             import ProjLocal
 from rapuma.core.proj_log               import ProjLog
+from rapuma.core.proj_trace             import ProjTrace
 
 
 class ProjBackground (object) :
@@ -44,6 +45,7 @@ class ProjBackground (object) :
         self.projectConfig              = self.proj_config.projectConfig
         self.layoutConfig               = self.proj_config.layoutConfig
         self.log                        = ProjLog(pid)
+        self.trace                      = ProjTrace(pid)
         self.user                       = UserConfig()
         self.userConfig                 = self.user.userConfig
         self.projHome                   = os.path.join(os.environ['RAPUMA_PROJECTS'], self.pid)
@@ -110,25 +112,27 @@ class ProjBackground (object) :
         figure out what the background is to be composed of and create
         a master background page. Using force will cause it to be remade.'''
 
-        # Do a quick check if the background needs to be remade
-        # The background normally is not remade if one already exists.
-        # If one is there, it can be remade if regenerate is set to
-        # to True. Obviously, if one is not there, it will be made.
-        if self.tools.str2bool(self.layoutConfig['DocumentFeatures']['regenerateBackground']) :
-            self.createBackground()
-        else :
-            # If there isn't one, make it
-            if not os.path.exists(self.local.backgroundFile) :
+        with self.trace.span('addBackground', {'file' : self.tools.fName(target)}) :
+
+            # Do a quick check if the background needs to be remade
+            # The background normally is not remade if one already exists.
+            # If one is there, it can be remade if regenerate is set to
+            # to True. Obviously, if one is not there, it will be made.
+            if self.tools.str2bool(self.layoutConfig['DocumentFeatures']['regenerateBackground']) :
                 self.createBackground()
+            else :
+                # If there isn't one, make it
+                if not os.path.exists(self.local.backgroundFile) :
+                    self.createBackground()
 
-        # Merge target with the project's background file in the Illustraton folder
-        self.log.writeToLog(self.errorCodes['1300'])
+            # Merge target with the project's background file in the Illustraton folder
+            self.log.writeToLog(self.errorCodes['1300'])
 
-        # Create a special name for the file with the background
-        # Then merge and save it
-        viewFile = self.tools.alterFileName(target, 'view')
+            # Create a special name for the file with the background
+            # Then merge and save it
+            viewFile = self.tools.alterFileName(target, 'view')
         
-        shutil.copy(self.tools.mergePdfFilesPdftk(self.centerOnPrintPage(target), self.local.backgroundFile), viewFile)
+            self.tools.materializeFile(self.tools.mergePdfFiles(self.centerOnPrintPage(target), self.local.backgroundFile), viewFile)
 
         # Not returning a file name would mean it failed
         if os.path.exists(viewFile) :
@@ -175,19 +179,20 @@ class ProjBackground (object) :
                 </svg>''')
 
         # Merge target with the background
-        self.log.writeToLog(self.errorCodes['1305'])
-
-        # Create a special name for the file with the background
-        viewFile = self.tools.alterFileName(target, 'view')
-        # Compare the new file name with the target to see if we are
-        # already working with a background file
-        if viewFile == target :
-            # If the target is a BG file all we need to do is merge it
-            self.tools.mergePdfFilesPdftk(viewFile, self.tools.convertSvgToPdfRsvg(svgFile))
-        else :
-            # If not a BG file, we need to be sure the target is the same
-            # size as the print page to merge with pdftk
-            shutil.copy(self.tools.mergePdfFilesPdftk(self.centerOnPrintPage(target), self.tools.convertSvgToPdfRsvg(svgFile)), viewFile)
+        with self.trace.span('addDocInfo', {'file' : self.tools.fName(target)}) :
+            self.log.writeToLog(self.errorCodes['1305'])
+
+            # Create a special name for the file with the background
+            viewFile = self.tools.alterFileName(target, 'view')
+            # Compare the new file name with the target to see if we are
+            # already working with a background file
+            if viewFile == target :
+                # If the target is a BG file all we need to do is merge it
+                self.tools.mergePdfFiles(viewFile, self.tools.convertSvgToPdfRsvg(svgFile))
+            else :
+                # If not a BG file, we need to be sure the target is the same
+                # size as the print page to merge with pdftk
+                self.tools.materializeFile(self.tools.mergePdfFiles(self.centerOnPrintPage(target), self.tools.convertSvgToPdfRsvg(svgFile)), viewFile)
 
         # Not returning a file name would mean it failed
         if os.path.exists(viewFile) :
@@ -275,7 +280,7 @@ class ProjBackground (object) :
                 </text></g></svg>''')
 
         # Convert the temp svg to pdf and merge into backgroundFile
-        results = self.tools.mergePdfFilesPdftk(self.local.backgroundFile, self.tools.convertSvgToPdfRsvg(svgFile))
+        results = self.tools.mergePdfFiles(self.local.backgroundFile, self.tools.convertSvgToPdfRsvg(svgFile))
         if os.path.isfile(results) :
             return True
 
@@ -318,7 +323,7 @@ class ProjBackground (object) :
             fbackgr.write( '''</svg>''')
 
         # Convert the temp svg to pdf and merge into backgroundFile
-        results = self.tools.mergePdfFilesPdftk(self.local.backgroundFile, self.tools.convertSvgToPdfRsvg(svgFile))
+        results = self.tools.mergePdfFiles(self.local.backgroundFile, self.tools.convertSvgToPdfRsvg(svgFile))
         if os.path.isfile(results) :
             return True
 
@@ -348,7 +353,7 @@ class ProjBackground (object) :
                 </svg>''')
 
         # Convert the temp svg to pdf and merge into backgroundFile
-        results = self.tools.mergePdfFilesPdftk(self.local.backgroundFile, self.tools.convertSvgToPdfRsvg(svgFile))
+        results = self.tools.mergePdfFiles(self.local.backgroundFile, self.tools.convertSvgToPdfRsvg(svgFile))
         if os.path.isfile(results) :
             return True
 
@@ -397,7 +402,8 @@ class ProjBackground (object) :
 
         # Run the process
         try:
-            subprocess.call(cmd) 
+            with self.trace.span('centerOnPrintPage') :
+                subprocess.call(cmd) 
             # Return the name of the temp PDF
             return tmpFile
         except Exception as e :
@@ -108,14 +108,14 @@ class ProjDiagnose (object) :
         # Copy the target to the tmpTarget
         shutil.copy(target, tmpTarget)
         # Overlay the transparency diagnostic file over the tmpTarget
-        self.tools.mergePdfFilesPdftk(tmpTarget, self.local.diagnosticFile)
+        self.tools.mergePdfFiles(tmpTarget, self.local.diagnosticFile)
 
         # Create a special name for the file with the background
         # Then merge and save it
         viewFile = self.tools.alterFileName(target, 'view')
 
         # Copy the results back to the target (should be done now)
-        shutil.copy(tmpTarget, viewFile)
+        self.tools.materializeFile(tmpTarget, viewFile)
 
         # Not returning a file name would mean it failed
         if os.path.exists(viewFile) :
@@ -247,7 +247,7 @@ class ProjDiagnose (object) :
         leadingPdf = self.tools.convertSvgToPdfRsvg(svgFile)
 
         # Merge leadingPdf with existing transparency
-        results = self.tools.mergePdfFilesPdftk(self.local.diagnosticFile, leadingPdf)
+        results = self.tools.mergePdfFiles(self.local.diagnosticFile, leadingPdf)
         # Test and return if good
         if os.path.isfile(results) :
             return True
@@ -16,7 +16,7 @@
 # Firstly, import all the standard Python modules we need for
 # this process
 
-import os, shutil, codecs
+import os, shutil, codecs, subprocess
 
 # Load the local classes
 from rapuma.core.tools              import Tools
@@ -78,7 +78,10 @@ class ProjIllustration (object) :
             '2010' : ['MSG', 'Updated illustration file [<<1>>] in project Illustration folder.'],
             '2020' : ['ERR', 'Update failed, file [<<1>>] not found in project Illustration folder. Use add illustration command to install the illustration.'],
             '2030' : ['ERR', 'Update failed on file [<<1>>]. Copy proceedure failed.'],
-            '2040' : ['MSG', 'Illustration update operation complete!']
+            '2040' : ['MSG', 'Illustration update operation complete!'],
+
+            '3010' : ['LOG', 'Made draft copy of illustration [<<1>>].'],
+            '3020' : ['WRN', 'Could not make a low resolution copy of [<<1>>], the original will be used in the draft. Error: [<<2>>]']
 
         }
 
@@ -295,4 +298,48 @@ class ProjIllustration (object) :
         return True
 
 
+###############################################################################
+######################### Illustration Draft Functions ########################
+###############################################################################
+######################## Error Code Block Series = 3000 #######################
+###############################################################################
+
+    def makeDraftIllustrations (self, size) :
+        '''Make low resolution copies of the illustrations in this group
+        for a draft render. They are no larger than size pixels either way
+        and are kept (in a folder for that size) until the original
+        changes. Return the folder they are in.'''
+
+        draftFolder = os.path.join(self.local.projIllustrationDraftFolder, str(size))
+        if not os.path.isdir(draftFolder) :
+            os.makedirs(draftFolder)
+
+        try :
+            illustrations = self.illustrationConfig[self.gid].keys()
+        except :
+            illustrations = []
+        for i in illustrations :
+            fileName = self.illustrationConfig[self.gid][i]['fileName']
+            source = os.path.join(self.projIllustrationFolder, fileName)
+            target = os.path.join(draftFolder, fileName)
+            if not os.path.isfile(source) :
+                continue
+            # Use what was made before if the original has not changed since
+            if os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(source) :
+                continue
+            # Only bitmaps are worth shrinking, anything else is copied as is
+            if os.path.splitext(fileName)[1].lower() in ['.jpg', '.jpeg', '.png', '.tif', '.tiff'] :
+                try :
+                    rCode = subprocess.call(['convert', source, '-resize', str(size) + 'x' + str(size) + '>', target])
+                except Exception as e :
+                    rCode = str(e)
+                if rCode == 0 :
+                    self.log.writeToLog(self.errorCodes['3010'], [fileName])
+                    continue
+                self.log.writeToLog(self.errorCodes['3020'], [fileName, str(rCode)])
+            shutil.copy(source, target)
+
+        return draftFolder
+
+
 
@@ -25,6 +25,7 @@ from rapuma.project.proj_config     import Config
 from rapuma.project.proj_macro      import Macro
 from rapuma.core.proj_local         import ProjLocal
 from rapuma.core.proj_log           import ProjLog
+from rapuma.core.usfm_index         import UsfmIndex
 from rapuma.core.user_config        import UserConfig
 
 ###############################################################################
@@ -66,6 +67,8 @@ class ProjScript (object) :
 
             '4210' : ['MSG', 'Processes completed successfully on: [<<1>>] by [<<2>>]'],
             '4220' : ['ERR', 'Processes for [<<1>>] failed. Script [<<2>>] returned this error: [<<3>>]'],
+            '4230' : ['ERR', 'Could not load the text process module [<<1>>]. Error given was: [<<2>>]'],
+            '4240' : ['ERR', 'Processes for [<<1>>] failed. The transform() in [<<2>>] gave this error: [<<3>>]'],
             '4260' : ['ERR', 'Installed the default component preprocessing script. Editing will be required for it to work with your project.'],
             '4265' : ['LOG', 'Component preprocessing script is already installed.'],
             '4310' : ['ERR', 'Script is an unrecognized type: [<<1>>] Cannot continue with installation.']
@@ -160,16 +163,34 @@ class ProjScript (object) :
 ###############################################################################
 
 
-    def runProcessScript (self, target, scriptFile) :
+    def runProcessScript (self, target, scriptFile, cid = None) :
         '''Run a text processing script on a component. This assumes the 
         component and the script are valid and the component lock is turned 
-        off. If not, you cannot expect any good to come of this.'''
+        off. If not, you cannot expect any good to come of this. If the
+        script has a transform() function it is run in this process,
+        otherwise the script is run on its own.'''
+
+        transform = self.getTextTransform(scriptFile)
+        if transform :
+            if not cid :
+                cid = self.tools.discoverCIDFromFile(target)
+            context = {'pid' : self.pid, 'gid' : self.gid, 'cType' : self.cType, 'target' : target, 'projectConfig' : self.projectConfig}
+            try :
+                if self.tools.transformTextFile(transform, target, cid, context) :
+                    # The text has moved, so should its index
+                    UsfmIndex(target).refresh()
+            except Exception as e :
+                self.log.writeToLog(self.errorCodes['4240'], [cid, self.tools.fName(scriptFile), str(e)])
+                return False
+            self.log.writeToLog(self.errorCodes['4210'], [self.tools.fName(target), self.tools.fName(scriptFile)])
+            return True
 
         # subprocess will fail if permissions are not set on the
         # script we want to run. The correct permission should have
         # been set when we did the installation.
         err = subprocess.call([scriptFile, target])
         if err == 0 :
+            UsfmIndex(target).refresh()
             self.log.writeToLog(self.errorCodes['4210'], [self.tools.fName(target), self.tools.fName(scriptFile)])
         else :
             self.log.writeToLog(self.errorCodes['4220'], [self.tools.fName(target), self.tools.fName(scriptFile), str(err)])
@@ -178,6 +199,29 @@ class ProjScript (object) :
         return True
 
 
+    def getTextTransform (self, scriptFile) :
+        '''Return the transform() function of a text process module, or None
+        if the script is an old style one that needs to be run on its own.
+        The module is only loaded once.'''
+
+        try :
+            return self.tools.getTextTransform(scriptFile)
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['4230'], [self.tools.fName(scriptFile), str(e)])
+
+
+    def runTextTransform (self, transform, scriptFile, text, cid, context) :
+        '''Run a text process module's transform() on the text of a
+        component and return the new text. If nothing comes back the text
+        is left as it was.'''
+
+        try :
+            return self.tools.runTextTransform(transform, text, cid, context)
+        except Exception as e :
+            self.log.writeToLog(self.errorCodes['4240'], [cid, self.tools.fName(scriptFile), str(e)])
+            return text
+
+
     def scriptInstall (self, source, target) :
         '''Install a script. A script can be a collection of items in
         a zip file or a single .py script file.'''
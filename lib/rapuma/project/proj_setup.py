@@ -15,7 +15,8 @@
 # Firstly, import all the standard Python modules we need for
 # this process
 
-import codecs, os, sys, unicodedata, subprocess, shutil, re, tempfile, difflib
+import codecs, os, sys, unicodedata, subprocess, shutil, re, tempfile, difflib, multiprocessing
+import hashlib, json, fcntl
 from configobj                              import ConfigObj
 from importlib                              import import_module
 from functools                              import partial
@@ -28,6 +29,9 @@ from rapuma.core.tools                      import Tools
 from rapuma.core.user_config                import UserConfig
 from rapuma.core.proj_local                 import ProjLocal
 from rapuma.core.proj_log                   import ProjLog
+from rapuma.core.proj_trace                 import ProjTrace
+from rapuma.core.style_registry             import StyleRegistry
+from rapuma.core.usfm_index                 import UsfmIndex
 from rapuma.core.proj_compare               import ProjCompare
 from rapuma.core.proj_data                  import ProjData
 from rapuma.manager.project                 import Project
@@ -37,6 +41,38 @@ from rapuma.project.proj_script             import ProjScript
 from rapuma.group.usfm_data                 import UsfmData
 
 
+###############################################################################
+############################### Worker Functions ##############################
+###############################################################################
+
+def importCidWorker (job) :
+    '''Import the working text for one cid in its own process (see
+    ProjSetup.installGroupComps()). Figures found in the text are sent
+    back to be written to illustration.conf all at once, and so are the
+    log events so the parent can write them in order. This lives out
+    here so it can be handed to multiprocessing. Anything that goes
+    wrong (including a sys.exit() after an error is logged) is sent back
+    as the error.'''
+
+    (pid, gid, systemVersion, source, cType, cid) = job
+    # Only send back the stages timed in this process
+    trace = ProjTrace(pid)
+    trace.reset()
+    log = ProjLog(pid)
+    log.holdEvents()
+    try :
+        setup = ProjSetup({'Rapuma' : {'systemVersion' : systemVersion}}, pid, gid)
+        setup.figureLog = {}
+        result = setup.importUsfmWorkingText(source, cType, gid, cid)
+        return (cid, result, None, setup.figureLog, trace.getSpans(), log.getHeldEvents())
+    except BaseException as e :
+        return (cid, False, str(e), {}, trace.getSpans(), log.getHeldEvents())
+
+
+###############################################################################
+################################## Begin Class ################################
+###############################################################################
+
 class ProjSetup (object) :
 
     def __init__(self, sysConfig, pid, gid=None) :
@@ -51,6 +87,7 @@ class ProjSetup (object) :
         self.projHome                       = os.path.join(os.path.expanduser(os.environ['RAPUMA_PROJECTS']), self.pid)
         self.tools                          = Tools()
         self.log                            = ProjLog(self.pid)
+        self.trace                          = ProjTrace(self.pid)
         self.systemVersion                  = sysConfig['Rapuma']['systemVersion']
         self.projectConfig                  = self.loadUpProjConfig(self.pid, self.gid)
         # Just in case no groups have been input yet
@@ -68,6 +105,9 @@ class ProjSetup (object) :
         self.otCidList                      = self.usfmData.otCidList()
         self.wholeCanonList                 = self.usfmData.wholeCanonList()
         self.cidNameDict                    = self.usfmData.cidNameDict()
+        # When this is a dictionary, logFigure() collects the figures in it
+        # rather than writing them out (see importCidWorker())
+        self.figureLog                      = None
 
         if self.userConfig['System']['textDifferentialViewerCommand'] == '' :
             self.diffViewCmd                = None
@@ -94,10 +134,14 @@ class ProjSetup (object) :
             '0260' : ['ERR', 'Sorry, cannot delete [<<1>>] from the [<<2>>] group. This component is shared by another group group.'],
             '0262' : ['WRN', 'Component [<<1>>] not found in group [<<2>>]'],
             '0265' : ['ERR', 'Unable to complete working text installation for [<<1>>]. May require \"force\" (-f).'],
+            '0266' : ['WRN', 'Importing component [<<1>>] failed with this error: [<<2>>]'],
+            '0268' : ['LOG', 'Importing [<<1>>] components with [<<2>>] processes.'],
             '0270' : ['LOG', 'The [<<1>>] compare file was created for component [<<2>>]. - project.uninstallGroupComponent()'],
             '0272' : ['MSG', 'Update for [<<1>>] component is unnecessary. Source is the same as the group source copy.'],
             '0273' : ['ERR', 'The compont [<<1>>] is not a part of the [<<2>>] group.'],
             '0274' : ['MSG', 'Force set to true, component [<<1>>] has been overwritten in the [<<2>>] group.'],
+            '0276' : ['MSG', 'Updated [<<1>>] component(s) in the [<<2>>] group: <<3>>'],
+            '0278' : ['MSG', 'Skipped [<<1>>] unchanged component(s) in the [<<2>>] group: <<3>>'],
             '0280' : ['LOG', 'The [<<1>>] file was removed from component [<<2>>]. - project.uninstallGroupComponent()'],
             '0290' : ['LOG', 'Removed the [<<1>>] component group folder and all its contents.'],
             '0291' : ['MSG', 'Removed the [<<1>>] component from the [<<2>>] group.'],
@@ -122,6 +166,7 @@ class ProjSetup (object) :
             '0390' : ['MSG', 'Successfully added component(s) to the [<<1>>] group.'],
 
             '1060' : ['LOG', 'Text validation succeeded on USFM file: [<<1>>]'],
+            '1065' : ['LOG', 'Text validation skipped on USFM file: [<<1>>], the same text passed before.'],
             '1070' : ['ERR', 'Text validation failed on USFM file: [<<1>>] It reported this error: [<<2>>]'],
             '1080' : ['LOG', 'Normalizing Unicode text to the [<<1>>] form.'],
             '1090' : ['ERR', 'USFM file: [<<1>>] did NOT pass the validation test. Because of an encoding conversion, the terminal output is from the file [<<2>>]. Please only edit [<<1>>].'],
@@ -132,6 +177,7 @@ class ProjSetup (object) :
             '1130' : ['ERR', 'Failed to complete preprocessing on component [<<1>>].'],
             '1135' : ['ERR', 'Failed to process component [<<1>>]. Process script not found.'],
             '1140' : ['MSG', 'Completed installation on [<<1>>] component working text.'],
+            '1145' : ['WRN', 'Could not make the chapter/verse index for the [<<1>>] component. Error given was: [<<2>>]'],
             '1150' : ['ERR', 'Unable to copy [<<1>>] to [<<2>>] - error in text.'],
             '1999' : ['WRN', 'Collect end notes is not fully implemented yet. Skipped end notes in: [<<1>>]'],
 
@@ -229,6 +275,7 @@ class ProjSetup (object) :
                     shutil.copy(targetFile, targetFileBak)
                 # Copy in our source (over target if needed)
                 shutil.copy(source, targetFile)
+                return (cid, 'changed')
             else :
                 self.log.writeToLog(self.errorCodes['0320'], [cid,gid])
                 return False
@@ -247,6 +294,11 @@ class ProjSetup (object) :
                 compFiles           = self.local.getComponentFiles(gid, cid, cType)
                 workingBak          = tempfile.NamedTemporaryFile(delete=True).name
 
+                # Nothing needs to be done if the source has not changed
+                if self.sourceIsUnchanged(source, compFiles) :
+                    self.log.writeToLog(self.errorCodes['0272'], [cid])
+                    return (cid, 'unchanged')
+
                 # Create temp backup of working file
                 if os.path.exists(compFiles['working']) :
                     shutil.copy(compFiles['working'], workingBak)
@@ -259,6 +311,7 @@ class ProjSetup (object) :
                 # Install the new text
                 if self.importUsfmWorkingText(source, cType, gid, cid) :
                     self.log.writeToLog(self.errorCodes['0315'], [cid])
+                    return (cid, 'changed')
                 
             else :
                 self.log.writeToLog(self.errorCodes['0320'], [cid,gid])
@@ -277,6 +330,32 @@ class ProjSetup (object) :
             return False
 
 
+    def sourceIsUnchanged (self, source, compFiles) :
+        '''Return True if the content of an incoming source file is the
+        same as the source copy that was stored the last time the
+        component was imported, and the working text is still there.'''
+
+        storedSource = compFiles.get('source')
+        if not storedSource or not os.path.isfile(storedSource) :
+            return False
+        if not os.path.isfile(compFiles['working']) :
+            return False
+        if os.path.getsize(source) != os.path.getsize(storedSource) :
+            return False
+
+        return self.hashSourceFile(source) == self.hashSourceFile(storedSource)
+
+
+    def hashSourceFile (self, fileName) :
+        '''Return a hash of the raw contents of a file.'''
+
+        sha = hashlib.sha1()
+        with open(fileName, 'rb') as fileObject :
+            for chunk in iter(lambda : fileObject.read(65536), '') :
+                sha.update(chunk)
+        return sha.hexdigest()
+
+
     def addGroup (self, cType, gid) :
         '''Add a group to a project by providing a component type, group
         ID. This wil lonly add a group. Group components are added in a 
@@ -424,11 +503,29 @@ class ProjSetup (object) :
 
 
     def updateComponents (self, gid, sourceList) :
-        '''Update in a group one or more components.'''
+        '''Update in a group one or more components. Components whose
+        source has not changed since the last import are skipped.'''
         
-        for source in sourceList :
-            self.updateGroupComponent(gid, source)
-            
+        changed = []
+        unchanged = []
+        # Hold on to the figures found until all the updates are done
+        self.figureLog = {}
+        try :
+            for source in sourceList :
+                result = self.updateGroupComponent(gid, source)
+                if result :
+                    (cid, status) = result
+                    if status == 'unchanged' :
+                        unchanged.append(cid)
+                    else :
+                        changed.append(cid)
+        finally :
+            self.commitFigureLog(gid)
+
+        # Give a summary of what was done
+        self.log.writeToLog(self.errorCodes['0276'], [str(len(changed)), gid, ' '.join(changed)])
+        if unchanged :
+            self.log.writeToLog(self.errorCodes['0278'], [str(len(unchanged)), gid, ' '.join(unchanged)])
         self.log.writeToLog(self.errorCodes['0299'], [gid])
         return True
 
@@ -517,23 +614,122 @@ class ProjSetup (object) :
         if not os.path.exists(os.path.join(self.local.projComponentFolder, gid)) :
             os.makedirs(os.path.join(self.local.projComponentFolder, gid))
 
+        # More than one component can be imported at a time if wanted
+        if self.tools.str2bool(self.projectConfig['Groups'][gid].get('useParallelImport', 'False')) and len(sources) > 1 :
+            return self.installGroupCompsParallel(gid, cType, sources)
+
+        # The figures found in all the components are written out together
+        # at the end (even if something goes wrong on the way)
+        self.figureLog = {}
+        try :
+            for fName in sources :
+                cid = self.tools.discoverCIDFromFile(fName)
+                self.log.writeToLog(self.errorCodes['0250'], [self.cidNameDict[cid]])
+                # See if the working text is present, quite if it is not
+
+                # Install our working text files
+                if self.importUsfmWorkingText(fName, cType, gid, cid) :
+                    self.log.writeToLog(self.errorCodes['0230'], [cid, gid])
+
+                else :
+                    self.log.writeToLog(self.errorCodes['0265'], [cid])
+                    return False
+        finally :
+            self.commitFigureLog(gid)
+
+        # If we got this far it must be okay to leave
+        return True
+
+
+    def installGroupCompsParallel (self, gid, cType, sources) :
+        '''Install components to a group with each one imported in its
+        own process. The figures found in all of them are written to the
+        illustration.conf file in one go at the end. The project.conf file
+        is left for the caller to update, as it is with a normal install.'''
+
+#        import pdb; pdb.set_trace()
+
+        jobs = []
         for fName in sources :
             cid = self.tools.discoverCIDFromFile(fName)
             self.log.writeToLog(self.errorCodes['0250'], [self.cidNameDict[cid]])
-            # See if the working text is present, quite if it is not
+            jobs.append((self.pid, gid, self.systemVersion, fName, cType, cid))
 
-            # Install our working text files
-            if self.importUsfmWorkingText(fName, cType, gid, cid) :
-                self.log.writeToLog(self.errorCodes['0230'], [cid, gid])
+        try :
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError :
+            workers = 1
+        workers = max(1, min(workers, len(jobs)))
+        self.log.writeToLog(self.errorCodes['0268'], [str(len(jobs)), str(workers)])
+
+        # Make sure the illustration config is there before anyone needs it
+        self.proj_config.getIllustrationConfig()
+
+        # Results come back in the order they were sent so if the same
+        # figure is in more than one component the last one wins, like
+        # it would with a normal install
+        figures = {}
+        failed = []
+        with self.trace.span('parallelImport', {'gid' : gid, 'workers' : workers}) :
+            pool = multiprocessing.Pool(workers)
+            try :
+                for cid, result, err, figureLog, spans, events in pool.imap(importCidWorker, jobs) :
+                    self.trace.addSpans(spans)
+                    self.log.writeHeldEvents(events)
+                    if result :
+                        figures.update(figureLog)
+                        self.log.writeToLog(self.errorCodes['0230'], [cid, gid])
+                    else :
+                        if err :
+                            self.log.writeToLog(self.errorCodes['0266'], [cid, err])
+                        failed.append(cid)
+                pool.close()
+            except :
+                pool.terminate()
+                raise
+            finally :
+                pool.join()
 
-            else :
-                self.log.writeToLog(self.errorCodes['0265'], [cid])
-                return False
+            # Whatever went in, record its figures
+            self.mergeFigureLog(gid, figures)
+
+        if failed :
+            self.log.writeToLog(self.errorCodes['0265'], [' '.join(failed)])
+            return False
 
-        # If we got this far it must be okay to leave
         return True
 
 
+    def mergeFigureLog (self, gid, figures) :
+        '''Put figures collected by logFigure() into the illustration.conf
+        file and write it out once.'''
+
+        if not figures :
+            return False
+        self.proj_config.getIllustrationConfig()
+        self.tools.buildConfSection(self.proj_config.illustrationConfig, gid)
+        for illustrationID in figures.keys() :
+            if not self.proj_config.illustrationConfig[gid].has_key(illustrationID) :
+                self.tools.buildConfSection(self.proj_config.illustrationConfig[gid], illustrationID)
+            for k, v in figures[illustrationID].iteritems() :
+                self.proj_config.illustrationConfig[gid][illustrationID][k] = v
+
+        return self.tools.writeConfFile(self.proj_config.illustrationConfig)
+
+
+    def commitFigureLog (self, gid) :
+        '''Write out the figures logFigure() has been holding on to and
+        go back to not holding them.'''
+
+        figures = self.figureLog
+        self.figureLog = None
+        if figures :
+            with self.trace.span('importFigureWrite', {'gid' : gid, 'figures' : len(figures)}) :
+                return self.mergeFigureLog(gid, figures)
+
+        return False
+
+
 ###############################################################################
 ########################### Project Lock Functions ############################
 ###############################################################################
@@ -695,6 +891,10 @@ class ProjSetup (object) :
         if not os.path.isdir(targetFolder) :
             os.makedirs(targetFolder)
 
+        # Read the source in once, everything else works from what is in memory
+        with open(source, 'rb') as sourceObject :
+            data = sourceObject.read()
+
         # Always save an untouched copy of the source and set to
         # read only. We may need this to restore/reset later.
         if os.path.isfile(compFiles['source']) :
@@ -702,30 +902,46 @@ class ProjSetup (object) :
             if compFiles['source'] != source :
                 # Reset permissions to overwrite
                 self.tools.makeWriteable(compFiles['source'])
-                shutil.copy(source, compFiles['source'])
+                with open(compFiles['source'], 'wb') as backupObject :
+                    backupObject.write(data)
                 self.tools.makeReadOnly(compFiles['source'])
         else :
-            shutil.copy(source, compFiles['source'])
+            with open(compFiles['source'], 'wb') as backupObject :
+                backupObject.write(data)
             self.tools.makeReadOnly(compFiles['source'])
 
-        # To be sure nothing happens, copy from our project source
-        # backup file. (Is self.local.defaultStyFile the best thing?)
-        if self.usfmCopy(compFiles['source'], compFiles['working'], gid) :
+        # A preprocess module with a transform() is run on the text as part
+        # of the import, other (old style) scripts are run on the working
+        # text after it has been written
+        preprocess = None
+        if usePreprocessScript :
+            preprocessScriptFile = os.path.join(self.local.projScriptFolder, self.projectConfig['Groups'][gid]['preprocessScript'])
+            if os.path.isfile(preprocessScriptFile) :
+                transform = proj_script.getTextTransform(preprocessScriptFile)
+                if transform :
+                    preprocess = partial(proj_script.runTextTransform, transform, preprocessScriptFile)
+
+        # Run the text through the import stages and write it out once
+        if self.usfmImport(data, compFiles['source'], compFiles['working'], cType, gid, cid, preprocess) :
             # Run any working text preprocesses on the new component text
-            if usePreprocessScript :
-                preprocessScriptFile = os.path.join(self.local.projScriptFolder, self.projectConfig['Groups'][gid]['preprocessScript'])
+            if usePreprocessScript and not preprocess :
 #                import pdb; pdb.set_trace()
 
-
-                if os.path.isfile(preprocessScriptFile) :
-                    if not proj_script.runProcessScript(compFiles['working'], preprocessScriptFile) :
-                        self.log.writeToLog(self.errorCodes['1130'], [cid])
-                else :
-                    self.log.writeToLog(self.errorCodes['1135'], [cid])
-            # Remove \fig (illustration) markers
-            self.takeOutFigMarkers(compFiles['working'], cType, gid, cid)
-            # Remove \fe (end note) markers
-            self.takeOutFeMarkers(compFiles['working'], cType, gid, cid)
+                with self.trace.span('importPreprocess', {'cid' : cid}) :
+                    if os.path.isfile(preprocessScriptFile) :
+                        if not proj_script.runProcessScript(compFiles['working'], preprocessScriptFile) :
+                            self.log.writeToLog(self.errorCodes['1130'], [cid])
+                    else :
+                        self.log.writeToLog(self.errorCodes['1135'], [cid])
+            # Index where the chapters, verses, etc. are in the final text
+            info = {'cid' : cid}
+            with self.trace.span('importIndex', info) :
+                try :
+                    usfmIndex = UsfmIndex(compFiles['working'])
+                    usfmIndex.build()
+                    info['markers'] = len(usfmIndex.offsets)
+                except Exception as e :
+                    self.log.writeToLog(self.errorCodes['1145'], [cid, str(e)])
             # If we made it this far, return True
             return True 
         else :
@@ -733,27 +949,119 @@ class ProjSetup (object) :
             return False
 
 
-    def takeOutFigMarkers (self, target, cType, gid, cid) :
-        '''Remove \fig markers and log the information in a config file.'''
+    def usfmImport (self, data, source, target, cType, gid, cid, preprocess = None) :
+        '''Bring USFM text into the project. The text (data) goes through
+        these stages in order: decode, normalize, validate (unless that is
+        turned off), \fig and \fe marker extraction, then the group
+        preprocess (if one is given). The working text is only written
+        once, at the end. How long each stage took, with a count of what
+        it did, is recorded in the trace report.'''
+
+        sourceEncode                = self.projectConfig['Managers']['usfm_Text']['sourceEncode']
+        workEncode                  = self.projectConfig['Managers']['usfm_Text']['workEncode']
+        unicodeNormalForm           = self.projectConfig['Managers']['usfm_Text']['unicodeNormalForm']
+        validateSourceMarkup        = self.tools.str2bool(self.projectConfig['Groups'][gid]['validateSourceMarkup'])
+
+#        import pdb; pdb.set_trace()
+
+        # Bring in our source text and work with the encoding if needed
+        info = {'cid' : cid, 'bytes' : len(data)}
+        with self.trace.span('importDecode', info) :
+            if sourceEncode == workEncode :
+                lines = self.tools.decodeData(data, 'utf_8_sig', source).splitlines(True)
+            else :
+                # Lets try to change the encoding.
+                lines = self.tools.decodeData(data, sourceEncode, source).splitlines(True)
+            info['lines'] = len(lines)
+
+        # Normalize the text
+        info = {'cid' : cid, 'form' : unicodeNormalForm}
+        with self.trace.span('importNormalize', info) :
+            normal = [unicodedata.normalize(unicodeNormalForm, line) for line in lines]
+            info['changed'] = len([i for i in range(len(lines)) if normal[i] != lines[i]])
+            lines = normal
+        self.log.writeToLog(self.errorCodes['1080'], [unicodeNormalForm])
+
+        # Validate the markup (Defalt is True)
+        if validateSourceMarkup :
+            with self.trace.span('importValidate', {'cid' : cid}) :
+                if not self.usfmTextFileIsValid(source, gid, lines) :
+                    self.log.writeToLog(self.errorCodes['1090'], [source,self.tools.fName(target)])
+                    return False
+        else :
+            # Warn that validation was turned off
+            self.log.writeToLog(self.errorCodes['1095'], [self.tools.fName(target)])
+
+        # Remove \fig (illustration) markers
+        info = {'cid' : cid}
+        with self.trace.span('importFigures', info) :
+            lines = self.takeOutFigMarkers(lines, cType, gid, cid, info)
+        # Remove \fe (end note) markers
+        info = {'cid' : cid}
+        with self.trace.span('importEndNotes', info) :
+            lines = self.takeOutFeMarkers(lines, cType, gid, cid, info)
+        # Run the group preprocess on the whole text
+        if preprocess :
+            info = {'cid' : cid}
+            with self.trace.span('importPreprocess', info) :
+                text = u''.join(lines)
+                context = {'pid' : self.pid, 'gid' : gid, 'cType' : cType, 'source' : source, 'target' : target, 'projectConfig' : self.projectConfig}
+                newText = preprocess(text, cid, context)
+                info['changed'] = newText != text
+                lines = newText.splitlines(True)
+
+        # All should be okay to write out the text to the target
+        with self.trace.span('importWrite', {'cid' : cid}) :
+            with codecs.open(target, "wt", "utf_8_sig") as writeout :
+                writeout.writelines(lines)
+
+        return True
+
+
+    def takeOutFigMarkers (self, lines, cType, gid, cid, info = None) :
+        '''Remove \fig markers from a list of text lines and log the
+        information in a config file. Return the lines that are left.'''
 
         extractFigMarkers = self.tools.str2bool(self.projectConfig['CompTypes'][cType.capitalize()]['extractFigMarkers'])
         # logUsfmFigure() logs the fig data and strips it from the working text
         # Note: Using partial() to allows the passing of the cid param 
         # into logUsfmFigure()
         if extractFigMarkers :
-            tempFile = tempfile.NamedTemporaryFile()
-            contents = codecs.open(target, "rt", encoding="utf_8_sig").read()
-            contents = re.sub(r'\\fig\s(.+?)\\fig\*', partial(self.logFigure, gid, cid), contents)
-            # Write out the remaining data to the working file
-            codecs.open(tempFile.name, "wt", encoding="utf_8_sig").write(contents)
-            # Finish by copying the tempFile to the source
-            shutil.copy(tempFile.name, target)
-
-        return True
-
-
-    def takeOutFeMarkers (self, target, cType, gid, cid) :
-        '''Remove \fe markers and log the information in a config file.'''
+            # The figures are written to illustration.conf in one go after
+            # they are all found. If the caller is already holding figures
+            # for a bigger import these just go in with them.
+            ownFigureLog = self.figureLog == None
+            if ownFigureLog :
+                self.figureLog = {}
+            figCount = 0
+            figMarker = re.compile(r'\\fig\s(.+?)\\fig\*')
+            # A figure with no chapter:verse in its reference gets the one
+            # it is found in, looked up in an index of the text
+            usfmIndex = None
+            if [l for l in lines if '\\fig' in l] :
+                usfmIndex = UsfmIndex()
+                usfmIndex.build(u''.join(lines))
+            lineStart = 0
+            try :
+                for i in range(len(lines)) :
+                    lineLength = len(lines[i])
+                    if '\\fig' in lines[i] :
+                        logFigure = partial(self.logFigure, gid, cid, usfmIndex = usfmIndex, offset = lineStart)
+                        (lines[i], n) = figMarker.subn(logFigure, lines[i])
+                        figCount += n
+                    lineStart += lineLength
+            finally :
+                if ownFigureLog :
+                    self.commitFigureLog(gid)
+            if info != None :
+                info['figures'] = figCount
+
+        return lines
+
+
+    def takeOutFeMarkers (self, lines, cType, gid, cid, info = None) :
+        '''Remove \fe markers from a list of text lines and log the
+        information in a config file. Return the lines that are left.'''
 
 #        import pdb; pdb.set_trace()
 
@@ -767,62 +1075,21 @@ class ProjSetup (object) :
 
 # FIXME: The collectEndNotes() function doesn't really work yet.
 
-            contents = codecs.open(target, "rt", encoding="utf_8_sig").read()
-            if re.search(r'\\fe\s', contents) :
+            feCount = len([line for line in lines if re.search(r'\\fe\s', line)])
+            if feCount :
                 self.log.writeToLog(self.errorCodes['1999'], [cid])
-#                tempFile = tempfile.NamedTemporaryFile()
-#                contents = re.sub(r'\\fe\s(.+?)\\fe\*', partial(self.collectEndNotes, cid), contents)
-                # Write out the remaining data to the working file
-#                codecs.open(tempFile.name, "wt", encoding="utf_8_sig").write(contents)
-                # Finish by copying the tempFile to the source
-#                shutil.copy(tempFile.name, target)
-
-        return True
-
-
-    def usfmCopy (self, source, target, gid) :
-        '''Copy USFM text from source to target. Decode if necessary, then
-        normalize. With the text in place, validate unless that is False.'''
-
-        sourceEncode                = self.projectConfig['Managers']['usfm_Text']['sourceEncode']
-        workEncode                  = self.projectConfig['Managers']['usfm_Text']['workEncode']
-        unicodeNormalForm           = self.projectConfig['Managers']['usfm_Text']['unicodeNormalForm']
-        validateSourceMarkup        = self.tools.str2bool(self.projectConfig['Groups'][gid]['validateSourceMarkup'])
-
-#        import pdb; pdb.set_trace()
-
-        # Validate the source markup text (Defalt is True)
-        if validateSourceMarkup :
-            if not self.usfmTextFileIsValid(source, gid) :
-                self.log.writeToLog(self.errorCodes['1090'], [source,self.tools.fName(target)])
-                return False
-        else :
-            # Warn that validation was turned off
-            self.log.writeToLog(self.errorCodes['1095'], [self.tools.fName(target)])
-
-        # Bring in our source text and work with the encoding if needed
-        if sourceEncode == workEncode :
-            contents = codecs.open(source, 'rt', 'utf_8_sig')
-            lines = contents.read()
-        else :
-            # Lets try to change the encoding.
-            lines = self.tools.decodeText(source, sourceEncode)
+#                lines = [re.sub(r'\\fe\s(.+?)\\fe\*', partial(self.collectEndNotes, cid), line) for line in lines]
+            if info != None :
+                info['endNotes'] = feCount
 
-        # Normalize the text
-        normal = unicodedata.normalize(unicodeNormalForm, lines)
-        self.log.writeToLog(self.errorCodes['1080'], [unicodeNormalForm])
-
-        # All should be okay to write out the text to the target
-        writeout = codecs.open(target, "wt", "utf_8_sig")
-        writeout.write(normal)
-        writeout.close
-        return True
+        return lines
 
 
-    def usfmTextFileIsValid (self, source, gid) :
+    def usfmTextFileIsValid (self, source, gid, lines = None) :
         '''Use the USFM parser to validate a style file. For now,
         if a file fails, we'll just quite right away, otherwise,
-        return True.'''
+        return True. If the text lines are given they are used
+        instead of reading the source file.'''
 
 #        import pdb; pdb.set_trace()
 
@@ -838,21 +1105,43 @@ class ProjSetup (object) :
 
         # Grab the default style file from the style foldern
         try :
-            fh = codecs.open(source, 'rt', 'utf_8_sig')
-            stylesheet = usfm.default_stylesheet.copy()
-            stylesheet_extra = style.parse(open(os.path.expanduser(self.local.defaultStyFile),'r'))
-            stylesheet.update(stylesheet_extra)
+            if lines == None :
+                with codecs.open(source, 'rt', 'utf_8_sig') as fh :
+                    lines = fh.readlines()
+            # The stylesheet is only parsed once (see StyleRegistry)
+            stylesheet = StyleRegistry(self.local.projStyleCacheFolder).getStylesheet([self.local.defaultStyFile])
             # FIXME: Keep an eye on this: error_level=sfm.level.Structure
             # gave less than helpful feedback when a mal-formed verse was
             # found. Switched to "Content" to get better error feedback
-#            doc = usfm.parser(fh, stylesheet, error_level=sfm.level.Structure)
-            doc = usfm.parser(fh, stylesheet, error_level=sfm.level.Content)
-            # With the doc text loaded up, we run a list across it
-            # so the parser will either pass or fail
-            testlist = list(doc)
-            # Good to go
-            self.log.writeToLog(self.errorCodes['1060'], [self.tools.fName(source)])
-            return True
+#            errorLevel = sfm.level.Structure
+            errorLevel = sfm.level.Content
+
+            # If this text has been through the parser before with the
+            # same stylesheet, we already know how it will turn out
+            validKey = self.makeValidationKey(lines, stylesheet, errorLevel)
+            result = self.getValidationResult(validKey)
+            if result and result['valid'] :
+                self.log.writeToLog(self.errorCodes['1065'], [self.tools.fName(source)])
+                return True
+            elif result :
+                message = result['message']
+            else :
+                try :
+                    doc = usfm.parser(lines, stylesheet, error_level=errorLevel)
+                    # With the doc text loaded up, we run a list across it
+                    # so the parser will either pass or fail
+                    testlist = list(doc)
+                    message = None
+                except Exception as e :
+                    message = str(e)
+                self.storeValidationResult(validKey, message)
+
+            if message == None :
+                # Good to go
+                self.log.writeToLog(self.errorCodes['1060'], [self.tools.fName(source)])
+                return True
+            self.log.writeToLog(self.errorCodes['1070'], [source,message], 'proj_setup.usfmTextFileIsValid():1070')
+            return False
 
         except Exception as e :
             # If the text is not good, I think we should die here an now.
@@ -861,6 +1150,60 @@ class ProjSetup (object) :
             return False
 
 
+    def makeValidationKey (self, lines, stylesheet, errorLevel) :
+        '''Return a hash of the text lines, the stylesheet and the parser
+        error level for the validation cache.'''
+
+        sha = hashlib.sha1()
+        for line in lines :
+            sha.update(line.encode('utf_8'))
+        sha.update('\0' + str(stylesheet.styleHash) + '\0' + str(errorLevel))
+
+        return sha.hexdigest()
+
+
+    def getValidationResult (self, validKey) :
+        '''Return the cached validation result for a key, a dictionary with
+        valid (True/False) and the parser message, or None if there is not one.'''
+
+        try :
+            with codecs.open(self.local.validationCacheFile, 'r', encoding='utf_8') as cacheObject :
+                return json.load(cacheObject).get(validKey)
+        except (IOError, ValueError) :
+            return None
+
+
+    def storeValidationResult (self, validKey, message, keep = 1000) :
+        '''Record a validation result in the cache. No message means the
+        text passed. Only the most recent results are kept. More than one
+        process can be importing at once so the cache is locked while it
+        is updated.'''
+
+        cacheFile = self.local.validationCacheFile
+        try :
+            if not os.path.isdir(os.path.dirname(cacheFile)) :
+                os.makedirs(os.path.dirname(cacheFile))
+            with open(cacheFile + '.lock', 'a') as lockObject :
+                fcntl.flock(lockObject, fcntl.LOCK_EX)
+                try :
+                    with codecs.open(cacheFile, 'r', encoding='utf_8') as cacheObject :
+                        results = json.load(cacheObject)
+                except (IOError, ValueError) :
+                    results = {}
+                results[validKey] = {'valid' : message == None, 'message' : message, 'date' : self.tools.tStamp()}
+                if len(results) > keep :
+                    for k in sorted(results.keys(), key=lambda k : results[k]['date'])[:len(results) - keep] :
+                        del results[k]
+                tmpFile = cacheFile + '.' + str(os.getpid())
+                with codecs.open(tmpFile, 'w', encoding='utf_8') as cacheObject :
+                    json.dump(results, cacheObject, indent = 4, sort_keys = True)
+                os.rename(tmpFile, cacheFile)
+                fcntl.flock(lockObject, fcntl.LOCK_UN)
+            return True
+        except Exception :
+            return False
+
+
     def collectEndNotes (self, cid, endNoteConts) :
         '''Collect the end notes from a cid.'''
 
@@ -869,10 +1212,11 @@ class ProjSetup (object) :
         return True
 
 
-    def logFigure (self, gid, cid, figConts) :
+    def logFigure (self, gid, cid, figConts, usfmIndex = None, offset = 0) :
         '''Log the figure data in the illustration.conf. If nothing is returned, the
         existing \fig markers with their contents will be removed. That is the default
-        behavior.'''
+        behavior. If there is no chapter:verse in the reference and an index of the
+        text is given, the chapter and verse the \fig is found in are used.'''
 
         # Just in case this section isn't there
         # Load illustrationConfig if it is not already (probably isn't)
@@ -924,6 +1268,10 @@ class ProjSetup (object) :
             figDict['verse'] = 0  # Or however you want to handle "pattern not found"
         else:
             figDict['verse'] = v.group(1)
+        if c is None and usfmIndex :
+            (chap, verse) = usfmIndex.getRefAt(offset + figConts.start())
+            figDict['chapter'] = str(chap)
+            figDict['verse'] = str(verse)
 
         # If this is an update, we need to keep the original settings in case the
         # default settings have been modified for this project.
@@ -955,8 +1303,12 @@ class ProjSetup (object) :
         for k in figDict.keys() :
             self.proj_config.illustrationConfig[gid][figDict['illustrationID']][k] = figDict[k]
 
-        # Write out the conf file to preserve the data found
-        self.tools.writeConfFile(self.proj_config.illustrationConfig)
+        # Hold on to the data found so it can all be written out at once
+        # (see takeOutFigMarkers()), or write it out now if no one is
+        if self.figureLog != None :
+            self.figureLog[figDict['illustrationID']] = dict(self.proj_config.illustrationConfig[gid][figDict['illustrationID']])
+        else :
+            self.tools.writeConfFile(self.proj_config.illustrationConfig)
 
         # Just incase we need to keep the fig markers intact this will
         # allow for that. However, default behavior is to strip them
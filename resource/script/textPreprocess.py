@@ -6,6 +6,10 @@
 ############################## Setup Environment ##############################
 ###############################################################################
 
+# Rapuma loads this module once and runs transform() on the text of each
+# component as it is imported. It can still be run on its own on a working
+# text file as well, like this:  textPreprocess.py MAT_base.usfm
+
 import os, sys, shutil, re, codecs
 
 from rapuma.core.tools import Tools
@@ -16,39 +20,48 @@ from rapuma.core.tools import Tools
 
 tools = Tools()
 
-source = sys.argv[1]
-tempFile = source + '.tmp'
-bakFile = source + '.bak'
-# Make backup and temp file
-shutil.copy(source, bakFile)
+def transform (text, cid, context) :
+    '''Take the text of a component and return it with any changes made.
+    The context is a dictionary with things like the pid and gid in it.'''
+
+    # Do stuff here
+
+    # Please delete this warning message when you start modifying this script.
+    tools.terminal('\nThe group preprocess script has not been modified yet. It is in its default form. Nothing has been done to the component data.\n(This anoying little message can be found in a file in your project Script folder.)\n')
+
+    # Examples:
+    # Change cross reference into footnotes
+    #text = re.sub(ur'\\x(\s.+?)\\xo(\s\d+:\d+)(.+?)\\x\*', ur'\\f\1\\fr\2 \\ft\3\\f*', text)
 
-# Read in the source file
-contents = codecs.open(source, "rt", encoding="utf_8_sig").read()
+    # Insert horizontal rule after intro section
+    #text = re.sub(ur'(\\c\s1\r\n)', ur'\skipline\n\hrule\r\n\1', text)
 
-# Do stuff here
+    # Insert a chapter label marker with zwsp to center the chapter number
+    #text = re.sub(ur'(\\c\s1\r\n)', ur'\cl \u200b\r\n\1', text)
 
-# Please delete this warning message when you start modifying this script.
-tools.terminal('\nThe group preprocess script has not been modified yet. It is in its default form. Nothing has been done to the component data.\n(This anoying little message can be found in a file in your project Script folder.)\n')
+    return text
 
-# Examples:
-# Change cross reference into footnotes
-#contents = re.sub(ur'\\x(\s.+?)\\xo(\s\d+:\d+)(.+?)\\x\*', ur'\\f\1\\fr\2 \\ft\3\\f*', contents)
 
-# Insert horizontal rule after intro section
-#contents = re.sub(ur'(\\c\s1\r\n)', ur'\skipline\n\hrule\r\n\1', contents)
+if __name__ == '__main__' :
 
-# Insert a chapter label marker with zwsp to center the chapter number
-#contents = re.sub(ur'(\\c\s1\r\n)', ur'\cl \u200b\r\n\1', contents)
+    source = sys.argv[1]
+    tempFile = source + '.tmp'
+    bakFile = source + '.bak'
+    # Make backup and temp file
+    shutil.copy(source, bakFile)
 
-# Write out a temp file so we can do some checks
-codecs.open(tempFile, "wt", encoding="utf_8_sig").write(contents)
+    # Read in the source file
+    contents = codecs.open(source, "rt", encoding="utf_8_sig").read()
 
-# Finish by copying the tempFile to the source
-if not shutil.copy(tempFile, source) :
-    # Take out the trash
-    os.remove(tempFile)
-    sys.exit(0)
-else :
-    tools.terminal('\nSCRIPT: Error: Failed to copy: [' + tempFile + '] to: [' + source + ']')
+    contents = transform(contents, tools.discoverCIDFromFile(source), {'target' : source})
 
+    # Write out a temp file so we can do some checks
+    codecs.open(tempFile, "wt", encoding="utf_8_sig").write(contents)
 
+    # Finish by copying the tempFile to the source
+    if not shutil.copy(tempFile, source) :
+        # Take out the trash
+        os.remove(tempFile)
+        sys.exit(0)
+    else :
+        tools.terminal('\nSCRIPT: Error: Failed to copy: [' + tempFile + '] to: [' + source + ']')
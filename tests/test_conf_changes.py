@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on merging the config changes made by groups rendered in other
+# processes (Tools.confDiff() and Tools.applyConfChanges()). Run from the
+# top folder with:  python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, unittest
+from configobj                          import ConfigObj
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.core.tools                  import Tools
+
+
+class ConfChangesTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.tools = Tools()
+        self.old = {'Groups' : {'GOS' : {'totalPages' : '10', 'cidList' : ['MAT', 'MRK']}, 'NT' : {'totalPages' : '3'}},
+                        'ProjectInfo' : {'projectTitle' : 'Test'}}
+
+
+    def test_no_changes (self) :
+        self.assertEqual(self.tools.confDiff(self.old, self.old), [])
+
+
+    def test_changes_are_found (self) :
+        new = {'Groups' : {'GOS' : {'totalPages' : '12', 'cidList' : ['MAT', 'MRK'], 'startPageNumber' : '3'}},
+                        'ProjectInfo' : {'projectTitle' : 'Test'}}
+        self.assertEqual(sorted(self.tools.confDiff(self.old, new)), sorted([
+                    (('Groups', 'GOS', 'totalPages'), '12', False),
+                    (('Groups', 'GOS', 'startPageNumber'), '3', False),
+                    (('Groups', 'NT'), None, True)]))
+
+
+    def test_changes_merge_with_others (self) :
+        # Two groups changed their own settings from the same starting
+        # point, both sets of changes must end up in the config
+        config = ConfigObj(self.old)
+        gos = {'Groups' : {'GOS' : {'totalPages' : '12', 'cidList' : ['MAT', 'MRK']}, 'NT' : {'totalPages' : '3'}},
+                        'ProjectInfo' : {'projectTitle' : 'Test'}}
+        nt = {'Groups' : {'GOS' : {'totalPages' : '10', 'cidList' : ['MAT', 'MRK']}, 'NT' : {'totalPages' : '5', 'startPageNumber' : '13'}},
+                        'ProjectInfo' : {'projectTitle' : 'Test'}}
+        self.tools.applyConfChanges(config, self.tools.confDiff(self.old, gos))
+        self.tools.applyConfChanges(config, self.tools.confDiff(self.old, nt))
+        self.assertEqual(config['Groups']['GOS']['totalPages'], '12')
+        self.assertEqual(config['Groups']['NT']['totalPages'], '5')
+        self.assertEqual(config['Groups']['NT']['startPageNumber'], '13')
+
+
+    def test_sections_are_made_and_removed (self) :
+        config = ConfigObj(self.old)
+        self.tools.applyConfChanges(config, [(('Illustrations', 'GOS', 'scale'), '1.0', False),
+                    (('Groups', 'NT'), None, True), (('Groups', 'XYZ', 'totalPages'), None, True)])
+        self.assertEqual(config['Illustrations']['GOS']['scale'], '1.0')
+        self.assertFalse(config['Groups'].has_key('NT'))
+        self.assertFalse(config['Groups'].has_key('XYZ'))
+
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on reading pdftk style page ranges (Tools.parsePageRange()). Run
+# from the top folder with:  python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.core.tools                  import Tools
+
+
+class PageRangeTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.tools = Tools()
+
+
+    def test_single_pages_and_ranges (self) :
+        self.assertEqual(self.tools.parsePageRange('1-3 7', 10), [0, 1, 2, 6])
+        self.assertEqual(self.tools.parsePageRange('2,4, 6', 10), [1, 3, 5])
+        self.assertEqual(self.tools.parsePageRange(5, 10), [4])
+
+
+    def test_end (self) :
+        self.assertEqual(self.tools.parsePageRange('8-end', 10), [7, 8, 9])
+        self.assertEqual(self.tools.parsePageRange('end', 10), [9])
+
+
+    def test_backwards (self) :
+        self.assertEqual(self.tools.parsePageRange('3-1', 10), [2, 1, 0])
+        self.assertEqual(self.tools.parsePageRange('end-9', 10), [9, 8])
+
+
+    def test_out_of_range (self) :
+        self.assertEqual(self.tools.parsePageRange('0', 10), None)
+        self.assertEqual(self.tools.parsePageRange('9-11', 10), None)
+
+
+    def test_not_a_range (self) :
+        # Let pdftk have a go at anything we do not understand
+        for pgRange in ['', 'odd', '1-3even', '1--3', '-2'] :
+            self.assertEqual(self.tools.parsePageRange(pgRange, 10), None)
+
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on the render cache key (Xetex.hashFiles()). Anything that changes
+# what comes out of a render must change the key, the lines that are left
+# out because they change on every run must not. Run from the top folder
+# with:  python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, shutil, tempfile, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.manager.xetex               import Xetex
+
+
+class RenderCacheKeyTest (unittest.TestCase) :
+
+    def setUp (self) :
+        '''Make a working text, a config and a settings file to hash.
+        The Xetex object is not set up, hashFiles() does not need it.'''
+
+        self.folder = tempfile.mkdtemp()
+        self.xetex = Xetex.__new__(Xetex)
+        self.source = self.writeFile('MAT_base.usfm', '\\id MAT\n\\c 1\n\\p\n\\v 1 In the beginning\n')
+        self.config = self.writeFile('layout.conf', '# layout.conf created: 2016-03-12 10:00\nlastEdit = 20160312\n[Fonts]\nfontSize = 10\n')
+        self.settings = self.writeFile('usfmTex-settings.tex', '% Settings fingerprint: 1234\n\\FontSizeUnit=0.8pt\n')
+        self.files = [self.source, self.config, self.settings]
+
+
+    def tearDown (self) :
+        shutil.rmtree(self.folder)
+
+
+    def writeFile (self, name, contents) :
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as fileObject :
+            fileObject.write(contents)
+        return path
+
+
+    def key (self) :
+        return self.xetex.hashFiles(self.files)
+
+
+    def test_same_inputs_same_key (self) :
+        self.assertEqual(self.key(), self.key())
+
+
+    def test_source_text_changes_key (self) :
+        before = self.key()
+        self.writeFile('MAT_base.usfm', '\\id MAT\n\\c 1\n\\p\n\\v 1 In the beginning was\n')
+        self.assertNotEqual(before, self.key())
+
+
+    def test_setting_changes_key (self) :
+        before = self.key()
+        self.writeFile('layout.conf', '# layout.conf created: 2016-03-12 10:00\nlastEdit = 20160312\n[Fonts]\nfontSize = 11\n')
+        self.assertNotEqual(before, self.key())
+        before = self.key()
+        self.writeFile('usfmTex-settings.tex', '% Settings fingerprint: 1234\n\\FontSizeUnit=0.9pt\n')
+        self.assertNotEqual(before, self.key())
+
+
+    def test_volatile_lines_do_not_change_key (self) :
+        before = self.key()
+        self.writeFile('layout.conf', '# layout.conf created: 2016-10-18 09:30\nlastEdit = 20161018\n[Fonts]\nfontSize = 10\n')
+        self.writeFile('usfmTex-settings.tex', '% Settings fingerprint: 5678\n\\FontSizeUnit=0.8pt\n')
+        self.assertEqual(before, self.key())
+
+
+    def test_volatile_looking_text_in_source_changes_key (self) :
+        before = self.key()
+        self.writeFile('MAT_base.usfm', '\\id MAT\n\\c 1\n\\p\n\\v 1 In the beginning\ntotalPages = 5\n')
+        self.assertNotEqual(before, self.key())
+        before = self.key()
+        self.writeFile('MAT_base.usfm', '\\id MAT\n\\c 1\n\\p\n\\v 1 In the beginning\ntotalPages = 5\n% Settings fingerprint: 1\n')
+        self.assertNotEqual(before, self.key())
+
+
+    def test_created_stamp_only_left_out_of_first_line (self) :
+        before = self.key()
+        self.writeFile('layout.conf', '# layout.conf created: 2016-03-12 10:00\nlastEdit = 20160312\n[Fonts]\nfontSize = 10\n# x created: 1\n')
+        self.assertNotEqual(before, self.key())
+
+
+    def test_moving_text_between_files_changes_key (self) :
+        before = self.key()
+        self.writeFile('MAT_base.usfm', '\\id MAT\n\\c 1\n\\p\n')
+        self.writeFile('layout.conf', '\\v 1 In the beginning\n# layout.conf created: 2016-03-12 10:00\nlastEdit = 20160312\n[Fonts]\nfontSize = 10\n')
+        self.assertNotEqual(before, self.key())
+
+
+    def test_missing_and_empty_files_differ (self) :
+        os.remove(self.settings)
+        missing = self.key()
+        self.writeFile('usfmTex-settings.tex', '')
+        self.assertNotEqual(missing, self.key())
+
+
+    def test_file_order_changes_key (self) :
+        before = self.key()
+        self.files.reverse()
+        self.assertNotEqual(before, self.key())
+
+
+class RenderedSinceTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.folder = tempfile.mkdtemp()
+        self.xetex = Xetex.__new__(Xetex)
+        self.pdfFile = os.path.join(self.folder, 'MAT.pdf')
+
+
+    def tearDown (self) :
+        shutil.rmtree(self.folder)
+
+
+    def test_missing_pdf_was_not_rendered (self) :
+        self.assertFalse(self.xetex.renderedSince(self.pdfFile, time.time()))
+
+
+    def test_stale_pdf_was_not_rendered (self) :
+        open(self.pdfFile, 'wb').close()
+        os.utime(self.pdfFile, (time.time() - 60, time.time() - 60))
+        self.assertFalse(self.xetex.renderedSince(self.pdfFile, time.time()))
+
+
+    def test_new_pdf_was_rendered (self) :
+        start = time.time()
+        open(self.pdfFile, 'wb').close()
+        self.assertTrue(self.xetex.renderedSince(self.pdfFile, start))
+
+
+    def test_dropped_render_is_gone_from_cache (self) :
+        class Local (object) :
+            projRenderCacheFolder = self.folder
+        self.xetex.local = Local()
+        for ext in ['.pdf', '.json'] :
+            open(os.path.join(self.folder, 'abc' + ext), 'wb').close()
+        self.xetex.dropCachedRender('abc')
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on the page and worker sums behind a parallel render (see
+# Xetex.renderParallel()). Run from the top folder with:
+#   python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, multiprocessing, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.manager.xetex               import Xetex
+
+
+class RenderParallelTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.xetex = Xetex.__new__(Xetex)
+        self.xetex.cType = 'usfm'
+        self.xetex.projectConfig = {'Managers' : {'usfm_Xetex' : {}}}
+
+
+    def test_start_pages_run_on (self) :
+        self.assertEqual(self.xetex.calcStartPages(['MAT', 'MRK', 'LUK'], {'MAT' : 30, 'MRK' : 19, 'LUK' : 33}, 5),
+                    {'MAT' : 5, 'MRK' : 35, 'LUK' : 54})
+
+
+    def test_start_pages_without_a_count (self) :
+        # A cid that has not been rendered yet is taken to have no pages
+        self.assertEqual(self.xetex.calcStartPages(['MAT', 'MRK', 'LUK'], {'MAT' : 30}, 1),
+                    {'MAT' : 1, 'MRK' : 31, 'LUK' : 31})
+
+
+    def test_workers_default_to_cpus (self) :
+        self.assertEqual(self.xetex.getRenderWorkerCount(1000), multiprocessing.cpu_count())
+
+
+    def test_workers_never_more_than_jobs (self) :
+        self.xetex.projectConfig['Managers']['usfm_Xetex']['renderWorkers'] = '8'
+        self.assertEqual(self.xetex.getRenderWorkerCount(3), 3)
+        self.assertEqual(self.xetex.getRenderWorkerCount(20), 8)
+
+
+    def test_bad_worker_setting (self) :
+        self.xetex.projectConfig['Managers']['usfm_Xetex']['renderWorkers'] = 'lots'
+        self.assertEqual(self.xetex.getRenderWorkerCount(1), 1)
+
+
+if __name__ == '__main__' :
+    unittest.main()
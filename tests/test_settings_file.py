@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on the settings fingerprint (Xetex.makeSettingsTexFile()). A
+# settings file is only left alone if it carries the same fingerprint, so a
+# file that was only part written must never carry one. Run from the top
+# folder with:  python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.manager.xetex               import Xetex
+
+
+class Log (object) :
+
+    def __init__ (self) :
+        self.codes = []
+
+    def writeToLog (self, code, args = None) :
+        self.codes.append(code)
+
+
+class Tools (object) :
+
+    def __init__ (self, macPackDict) :
+        self.macPackDict = macPackDict
+
+    def makeFileHeader (self, fileName, desc = None, noEditWarn = True) :
+        return '% ' + fileName + ' created: now\n'
+
+    def xmlFileToDict (self, path) :
+        if isinstance(self.macPackDict, Exception) :
+            raise self.macPackDict
+        return self.macPackDict
+
+    def str2bool (self, value) :
+        return str(value).lower() == 'true'
+
+
+class Local (object) :
+    pass
+
+
+class SettingsFileTest (unittest.TestCase) :
+
+    def setUp (self) :
+        '''Set up just enough of a Xetex object to make a settings file
+        with no sections and no fonts in it.'''
+
+        self.folder = tempfile.mkdtemp()
+        self.xetex = Xetex.__new__(Xetex)
+        self.xetex.gid = 'GOS'
+        self.xetex.cType = 'usfm'
+        self.xetex.errorCodes = {'0420' : '0420', '0430' : '0430', '0440' : '0440'}
+        self.xetex.log = Log()
+        self.xetex.projectConfig = {'Managers' : {'usfm_Xetex' : {}}, 'CompTypes' : {'Usfm' : {'fontName' : 'Charis'}}}
+        self.xetex.fontConfig = {'Fonts' : {}}
+        self.xetex.local = Local()
+        self.xetex.local.macSettingsFile = os.path.join(self.folder, 'usfmTex-settings.tex')
+        self.xetex.local.macSettingsFileName = 'usfmTex-settings.tex'
+        self.xetex.local.macPackConfXmlFile = os.path.join(self.folder, 'usfmTex.xml')
+        self.xetex.makeSettingsFingerprint = lambda : 'new'
+
+
+    def tearDown (self) :
+        shutil.rmtree(self.folder)
+
+
+    def writeSettings (self, contents) :
+        with open(self.xetex.local.macSettingsFile, 'wb') as fileObject :
+            fileObject.write(contents)
+
+
+    def readSettings (self) :
+        with open(self.xetex.local.macSettingsFile, 'rb') as fileObject :
+            return fileObject.read()
+
+
+    def test_finished_file_carries_fingerprint (self) :
+        self.xetex.tools = Tools({'root' : {'section' : []}})
+        self.assertTrue(self.xetex.makeSettingsTexFile())
+        self.assertEqual(self.xetex.getSettingsFingerprint(), 'new')
+        # Made again only when the fingerprint changes
+        self.assertTrue(self.xetex.makeSettingsTexFile())
+        self.assertEqual(self.xetex.log.codes, ['0440', '0430'])
+
+
+    def test_failed_file_leaves_old_one (self) :
+        self.writeSettings('% usfmTex-settings.tex created: then\n% Settings fingerprint: old\n\\OldSetting\n')
+        self.xetex.tools = Tools(IOError('macPack XML went missing'))
+        self.assertRaises(IOError, self.xetex.makeSettingsTexFile)
+        self.assertEqual(self.xetex.getSettingsFingerprint(), 'old')
+        self.assertTrue('\\OldSetting' in self.readSettings())
+
+
+    def test_failed_file_has_no_fingerprint (self) :
+        self.xetex.tools = Tools(IOError('macPack XML went missing'))
+        self.assertRaises(IOError, self.xetex.makeSettingsTexFile)
+        self.assertEqual(self.xetex.getSettingsFingerprint(), None)
+
+
+if __name__ == '__main__' :
+    unittest.main()
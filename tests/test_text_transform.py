@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on the text process (preprocess) script hook. Python modules with a
+# transform() are run in-process, any other script (shell, Perl, old style
+# Python) must still be run on its own. Run from the top folder with:
+#   python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, shutil, tempfile, codecs, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.core.tools                  import Tools
+from rapuma.project.proj_script         import ProjScript
+
+
+class Log (object) :
+
+    def __init__ (self) :
+        self.codes = []
+
+    def writeToLog (self, code, args = None) :
+        self.codes.append(code)
+
+
+class TextTransformTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.folder = tempfile.mkdtemp()
+        self.tools = Tools()
+        self.target = self.writeFile('MAT_base.usfm', u'\\id MAT\n\\c 1\n\\p\n\\v 1 In the beginning\n')
+
+
+    def tearDown (self) :
+        shutil.rmtree(self.folder)
+
+
+    def writeFile (self, name, contents, executable = False) :
+        path = os.path.join(self.folder, name)
+        with codecs.open(path, 'w', 'utf_8') as fileObject :
+            fileObject.write(contents)
+        if executable :
+            os.chmod(path, 0755)
+        return path
+
+
+    def readTarget (self) :
+        with codecs.open(self.target, 'r', 'utf_8_sig') as fileObject :
+            return fileObject.read()
+
+
+    def makeProjScript (self) :
+        '''Set up just enough of a ProjScript to run a script.'''
+
+        projScript = ProjScript.__new__(ProjScript)
+        projScript.pid = 'TEST'
+        projScript.gid = 'GOS'
+        projScript.cType = 'usfm'
+        projScript.projectConfig = {}
+        projScript.tools = self.tools
+        projScript.log = Log()
+        projScript.errorCodes = dict([(c, c) for c in ['4210', '4220', '4230', '4240']])
+        return projScript
+
+
+    def test_module_with_transform_is_loaded (self) :
+        script = self.writeFile('textPreprocess.py', u"def transform (text, cid, context) :\n    return text.replace('beginning', 'start')\n")
+        transform = self.tools.getTextTransform(script)
+        self.assertTrue(transform)
+        self.assertTrue(self.tools.transformTextFile(transform, self.target, 'MAT', {}))
+        self.assertTrue(u'In the start' in self.readTarget())
+
+
+    def test_transform_returning_nothing_leaves_text (self) :
+        script = self.writeFile('textPreprocess.py', u"def transform (text, cid, context) :\n    pass\n")
+        transform = self.tools.getTextTransform(script)
+        self.assertEqual(self.tools.runTextTransform(transform, u'abc', 'MAT', {}), u'abc')
+        self.assertFalse(self.tools.transformTextFile(transform, self.target, 'MAT', {}))
+
+
+    def test_old_style_python_script_is_not_run (self) :
+        marker = os.path.join(self.folder, 'ran')
+        script = self.writeFile('oldPreprocess', u"#!/usr/bin/python\nopen(%r, 'w').close()\n" % marker)
+        self.assertEqual(self.tools.getTextTransform(script), None)
+        self.assertFalse(os.path.exists(marker))
+
+
+    def test_shell_script_falls_back (self) :
+        script = self.writeFile('preprocess.sh', u'#!/bin/sh\nif [ -f "$1" ]; then echo hi; fi\n')
+        self.assertEqual(self.tools.getTextTransform(script), None)
+
+
+    def test_perl_script_falls_back (self) :
+        script = self.writeFile('preprocess.pl', u'#!/usr/bin/perl -pi\ns/beginning/start/g;\n')
+        self.assertEqual(self.tools.getTextTransform(script), None)
+        script = self.writeFile('preprocess2.pl', u's/beginning/start/g;\n')
+        self.assertEqual(self.tools.getTextTransform(script), None)
+
+
+    def test_unknown_script_that_is_not_python_falls_back (self) :
+        script = self.writeFile('preprocess', u'sed -i s/beginning/start/ "$1"\n')
+        self.assertEqual(self.tools.getTextTransform(script), None)
+
+
+    def test_broken_python_module_is_an_error (self) :
+        script = self.writeFile('textPreprocess.py', u'def transform (text, cid, context)\n    return text\n')
+        self.assertRaises(SyntaxError, self.tools.getTextTransform, script)
+
+
+    def test_run_process_script_runs_shell_script (self) :
+        script = self.writeFile('preprocess.sh', u'#!/bin/sh\nsed -i s/beginning/start/ "$1"\n', True)
+        projScript = self.makeProjScript()
+        self.assertTrue(projScript.runProcessScript(self.target, script))
+        self.assertTrue(u'In the start' in self.readTarget())
+        self.assertEqual(projScript.log.codes, ['4210'])
+
+
+    def test_run_process_script_runs_transform (self) :
+        script = self.writeFile('textPreprocess.py', u"def transform (text, cid, context) :\n    return text.replace('beginning', context['gid'])\n")
+        projScript = self.makeProjScript()
+        self.assertTrue(projScript.runProcessScript(self.target, script, 'MAT'))
+        self.assertTrue(u'In the GOS' in self.readTarget())
+        self.assertEqual(projScript.log.codes, ['4210'])
+
+
+if __name__ == '__main__' :
+    unittest.main()
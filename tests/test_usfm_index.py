@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on the working text index (UsfmIndex). Run from the top folder
+# with:  python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.core.usfm_index             import UsfmIndex
+
+
+class UsfmIndexTest (unittest.TestCase) :
+
+    text = u'\\id MAT\n\\mt Matthew\n\\c 1\n\\p\n\\v 1 One ĝ\n\\v 2-3 Two\n\\s Head\n\\p\n\\v 4 Four\n' \
+                u'\\c 2\n\\p\n\\v 1 A \\fig x|a.jpg|col|||cap|\\fig*\n\\v 2 B \\f + \\ft note\\f*\n'
+
+    def setUp (self) :
+        self.folder = tempfile.mkdtemp()
+        self.workingFile = os.path.join(self.folder, 'MAT_base.usfm')
+        self.data = self.text.encode('utf_8')
+        with open(self.workingFile, 'wb') as textObject :
+            textObject.write(self.data)
+        self.index = UsfmIndex(self.workingFile)
+        self.index.getIndex()
+
+
+    def tearDown (self) :
+        shutil.rmtree(self.folder)
+
+
+    def test_range_of_a_chapter (self) :
+        (start, end) = self.index.getRange(1, 0, 1, 0)
+        self.assertTrue(self.data[start:end].startswith('\\c 1'))
+        self.assertTrue(self.data[start:end].endswith('Four\n'))
+        (start, end) = self.index.getRange(2, 0, 2, 0)
+        self.assertEqual(end, len(self.data))
+
+
+    def test_range_of_verses (self) :
+        (start, end) = self.index.getRange(1, 2, 1, 4)
+        self.assertTrue(self.data[start:end].startswith('\\v 2-3'))
+        self.assertTrue(self.data[start:end].endswith('Four\n'))
+        self.assertEqual(self.index.getText(1, 1), u'\\v 1 One ĝ\n')
+
+
+    def test_missing_reference (self) :
+        self.assertEqual(self.index.getRange(3, 0, 3, 0), None)
+        self.assertEqual(self.index.getText(1, 9), None)
+
+
+    def test_ref_at_offset (self) :
+        self.assertEqual(self.index.getRefAt(0), (0, 0))
+        self.assertEqual(self.index.getRefAt(self.data.index('Four')), (1, 4))
+        self.assertEqual(self.index.getRefAt(self.data.index('\\fig')), (2, 1))
+
+
+    def test_verses_of_a_chapter (self) :
+        self.assertEqual([v for (v, pos) in self.index.getVerses(1)], [1, 2, 4])
+        self.assertEqual(self.index.getVerses(5), [])
+
+
+    def test_marker_counts (self) :
+        self.assertEqual(self.index.getMarkerCounts(), {'c' : 2, 'v' : 5, 's' : 1, 'fig' : 1, 'f' : 1})
+        self.assertEqual(self.index.getMarkerCounts(1), {'c' : 1, 'v' : 3, 's' : 1, 'fig' : 0, 'f' : 0})
+
+
+    def test_index_in_memory (self) :
+        index = UsfmIndex()
+        index.build(self.text)
+        self.assertEqual(index.getRefAt(self.text.index(u'\\fig')), (2, 1))
+
+
+    def test_saved_index_is_used_until_text_changes (self) :
+        self.assertTrue(os.path.isfile(self.workingFile + '.idx'))
+        index = UsfmIndex(self.workingFile)
+        self.assertTrue(index.loadIndex())
+        with open(self.workingFile, 'ab') as textObject :
+            textObject.write('\\v 3 C\n')
+        self.assertFalse(index.loadIndex())
+        self.assertTrue(index.refresh())
+        self.assertEqual([v for (v, pos) in index.getVerses(2)], [1, 2, 3])
+
+
+if __name__ == '__main__' :
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf_8 -*-
+
+# By Dennis Drescher (sparkycbr at gmail dot com)
+
+###############################################################################
+######################### Description/Documentation ###########################
+###############################################################################
+
+# Checks on the XeTeX log parser (XetexLog). Each thing found has to be tied
+# back to the right cid and file, even when the log is cut short or has odd
+# parentheses in it. Run from the top folder with:
+#   python -m unittest discover -s tests
+
+
+###############################################################################
+################################# Test Class ##################################
+###############################################################################
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+from rapuma.core.xetex_log              import XetexLog
+
+
+class XetexLogTest (unittest.TestCase) :
+
+    def setUp (self) :
+        self.log = XetexLog({'MAT_base.usfm' : ('MAT', None), 'MRK_base.usfm' : ('MRK', None)})
+
+
+    def parse (self, lines) :
+        for line in lines :
+            self.log.parseLine(line)
+
+
+    def test_items_are_tied_to_their_cid (self) :
+        self.parse(['(./MAT_base.usfm', 'Missing character: There is no X in font Charis!', ')',
+                    '(./MRK_base.usfm', 'Missing character: There is no Y in font Charis!', ')'])
+        self.assertEqual([(i['cid'], i['file']) for i in self.log.items],
+                    [('MAT', 'MAT_base.usfm'), ('MRK', 'MRK_base.usfm')])
+
+
+    def test_box_lines_are_skipped (self) :
+        self.parse(['(./MAT_base.usfm', 'Underfull \\hbox (badness 10000) in paragraph at lines 5--6',
+                    '\\TU/Charis(0)/m/n/10 (a warning: in the text) ) )', '',
+                    'Missing character: There is no X in font Charis!'])
+        self.assertEqual(len(self.log.items), 2)
+        self.assertEqual(self.log.items[1]['cid'], 'MAT')
+
+
+    def test_box_lines_end_without_a_blank_line (self) :
+        # The log was cut short after a box warning, a page mark and the
+        # next warning must still be seen
+        self.parse(['(./MAT_base.usfm', 'Overfull \\hbox (2.5pt too wide) in paragraph at lines 7--7',
+                    '\\TU/Charis(0)/m/n/10 text', 'RapumaCidStart:MRK:12',
+                    'Missing character: There is no X in font Charis!'])
+        self.assertEqual(self.log.getPageMarks(), {'MRK' : 12})
+        self.assertEqual([i['class'] for i in self.log.items], ['overfullHbox', 'missingCharacter'])
+        self.assertEqual(self.log.items[1]['cid'], 'MAT')
+
+
+    def test_box_lines_end_at_the_next_warning (self) :
+        self.parse(['(./MAT_base.usfm', 'Overfull \\hbox (2.5pt too wide) in paragraph at lines 7--7',
+                    '\\TU/Charis(0)/m/n/10 text', '! Undefined control sequence.'])
+        self.assertEqual([i['class'] for i in self.log.items], ['overfullHbox', 'error'])
+
+
+    def test_box_lines_are_limited (self) :
+        self.parse(['(./MAT_base.usfm', 'Overfull \\hbox (2.5pt too wide) in paragraph at lines 7--7'])
+        self.parse(['.\\glue 3.0'] * XetexLog.maxBoxLines)
+        self.parse([')', '(./MRK_base.usfm', 'Font \\x=Charis substituted instead'])
+        self.assertEqual(self.log.items[-1]['cid'], 'MRK')
+
+
+    def test_other_parentheses_do_not_pile_up (self) :
+        self.parse(['(./MAT_base.usfm'] + ['(see page 3'] * 1000)
+        self.assertEqual(self.log.fileStack, ['./MAT_base.usfm'])
+
+
+    def test_file_inside_other_parentheses (self) :
+        self.parse(['(./MAT_base.usfm', '[1] (see (./MRK_base.usfm) here)'])
+        self.assertEqual(self.log.fileStack, ['./MAT_base.usfm'])
+
+
+    def test_close_with_nothing_open_is_ignored (self) :
+        self.parse([') ) )', '(./MAT_base.usfm', 'Missing character: There is no X in font Charis!'])
+        self.assertEqual(self.log.items[0]['cid'], 'MAT')
+
+
+if __name__ == '__main__' :
+    unittest.main()